@@ -0,0 +1,81 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Benchmark of the enrichment of the events by the collector, for payloads with the maximum number of events
+(DATA_MAX_EVENT_COUNT).
+
+Compares determining the HttpContext and parsing the MarketingContexts per event, with determining the
+HttpContext once per request and caching the MarketingContexts per url.
+
+Run from the backend directory:
+    python -m benchmarks.bench_enrichment
+"""
+from typing import List
+
+import flask
+
+from benchmarks.util import make_sample_events, measure, print_speedup
+from objectiv_backend.common.config import get_collector_config
+from objectiv_backend.common.event_utils import add_global_context_to_event, get_optional_context
+from objectiv_backend.common.types import EventDataList
+from objectiv_backend.end_points.collector import DATA_MAX_EVENT_COUNT, add_cookie_id_contexts, \
+    add_enriched_contexts, add_http_context_to_event, _get_marketing_context_fields
+from objectiv_backend.schema.schema import MarketingContext
+
+REPEAT = 5
+
+_HEADERS = {
+    'Referer': 'http://localhost:3000/',
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0',
+    'X-Forwarded-For': '10.0.0.1 192.168.1.1'
+}
+
+
+def _make_payloads() -> List[EventDataList]:
+    """ Give a payload per run, as enrichment modifies the events. The tracker sends no HttpContext. """
+    payloads = []
+    for _ in range(REPEAT):
+        events = make_sample_events(DATA_MAX_EVENT_COUNT)
+        for event in events:
+            event['global_contexts'] = [context for context in event['global_contexts']
+                                        if context['_type'] not in ('HttpContext', 'CookieIdContext')]
+        payloads.append(events)
+    return payloads
+
+
+def _add_enriched_contexts_per_event(events: EventDataList):
+    """ Enrich the events the way this was done before request data was determined once per request. """
+    add_cookie_id_contexts(events)
+    for event in events:
+        add_http_context_to_event(event=event, request=flask.request)
+        path_context = get_optional_context(event, 'PathContext')
+        if path_context:
+            # bypass the cache
+            for fields in _get_marketing_context_fields.__wrapped__(str(path_context['id'])):
+                add_global_context_to_event(event, MarketingContext(**fields))
+
+
+def bench_enrichment():
+    app = flask.Flask(__name__)
+    headers = dict(_HEADERS)
+    cookie_config = get_collector_config().cookie
+    if cookie_config:
+        headers['Cookie'] = f'{cookie_config.name}=f84446c6-eb76-4458-8ef4-93ade596fd5b'
+
+    def run(enrich):
+        payloads = _make_payloads()
+
+        def function() -> int:
+            events = payloads.pop()
+            with app.test_request_context('/', method='POST', headers=headers):
+                enrich(events)
+            return len(events)
+        return function
+
+    before = measure('events/sec, per event', run(_add_enriched_contexts_per_event), repeat=REPEAT)
+    after = measure('events/sec, per request', run(add_enriched_contexts), repeat=REPEAT)
+    print_speedup(before, after)
+
+
+if __name__ == '__main__':
+    bench_enrichment()
@@ -0,0 +1,51 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Micro-benchmark of JSON encoding and decoding of events, as done several times per event by the
+collector and workers. Compares the standard library with the backend selected by json_codec.
+
+Run from the backend directory:
+    python -m benchmarks.bench_json
+"""
+import json
+
+from benchmarks.util import make_sample_events, measure, print_speedup
+from objectiv_backend.common.json_codec import json_dumps, json_loads, JSON_BACKEND
+
+EVENT_COUNT = 1000
+
+
+def bench_json():
+    events = make_sample_events(EVENT_COUNT)
+    encoded = [json.dumps(event) for event in events]
+
+    def stdlib_dumps() -> int:
+        for event in events:
+            json.dumps(event)
+        return len(events)
+
+    def codec_dumps() -> int:
+        for event in events:
+            json_dumps(event)
+        return len(events)
+
+    def stdlib_loads() -> int:
+        for data in encoded:
+            json.loads(data)
+        return len(encoded)
+
+    def codec_loads() -> int:
+        for data in encoded:
+            json_loads(data)
+        return len(encoded)
+
+    before = measure('events/sec, encode with json', stdlib_dumps)
+    after = measure(f'events/sec, encode with {JSON_BACKEND}', codec_dumps)
+    print_speedup(before, after)
+    before = measure('events/sec, decode with json', stdlib_loads)
+    after = measure(f'events/sec, decode with {JSON_BACKEND}', codec_loads)
+    print_speedup(before, after)
+
+
+if __name__ == '__main__':
+    bench_json()
@@ -0,0 +1,58 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Benchmark of the file formats of the S3 and filesystem outputs: write throughput and total size of the
+files. The baseline is the json array per request, as written before the outputs were buffered.
+
+Requires pyarrow. Run from the backend directory:
+    python -m benchmarks.bench_parquet
+"""
+from typing import List
+
+from benchmarks.util import make_sample_events, measure, print_speedup
+from objectiv_backend.common.config import OutputBufferConfig
+from objectiv_backend.common.json_codec import json_dumps
+from objectiv_backend.end_points.output_buffer import OutputBuffer, FileFormat, JsonFormat
+from objectiv_backend.end_points.parquet_output import ParquetFormat
+
+EVENT_COUNT = 20000
+EVENTS_PER_REQUEST = 20
+
+
+def bench_parquet():
+    events = make_sample_events(EVENT_COUNT)
+    requests = [events[i:i + EVENTS_PER_REQUEST] for i in range(0, len(events), EVENTS_PER_REQUEST)]
+    sizes = {}
+
+    def json_per_request() -> int:
+        sizes['json per request'] = sum(len(json_dumps(request).encode('utf-8')) for request in requests)
+        return len(events)
+
+    def buffered(name: str, file_format: FileFormat):
+        def write() -> int:
+            written: List[bytes] = []
+            config = OutputBufferConfig(max_bytes=1024 ** 3, max_seconds=3600, compression='none')
+            output_buffer = OutputBuffer(
+                write_object=lambda prefix, name_, moment, data: written.append(data),
+                config=config,
+                file_format=file_format)
+            for request in requests:
+                output_buffer.append('OK', request)
+            output_buffer.close()
+            sizes[name] = sum(len(data) for data in written)
+            return len(events)
+        return write
+
+    before = measure('events/sec, json per request', json_per_request)
+    for name, file_format in [('ndjson gzip', JsonFormat('gzip')),
+                              ('parquet gzip', ParquetFormat('gzip', row_group_size=10000)),
+                              ('parquet zstd', ParquetFormat('zstd', row_group_size=10000))]:
+        after = measure(f'events/sec, {name}', buffered(name, file_format))
+        print_speedup(before, after)
+
+    for name, size in sizes.items():
+        print(f'{"bytes/event, " + name:<40} {size / len(events):>14,.1f}')
+
+
+if __name__ == '__main__':
+    bench_parquet()
@@ -0,0 +1,59 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Benchmark of writing events to the data, nok_data and queue tables, comparing the 'insert' and 'copy'
+write engines.
+
+Requires a Postgres database that is initialized with objectiv-db-init, and configured with the
+POSTGRES_* environment variables. All writes are rolled back afterwards.
+
+Run from the backend directory:
+    python -m benchmarks.bench_pg_write
+"""
+from benchmarks.util import make_sample_events, measure, print_speedup
+from objectiv_backend.common.config import get_config_postgres, PG_WRITE_ENGINES
+from objectiv_backend.common.db import get_db_connection
+from objectiv_backend.workers.pg_queues import PostgresQueues, ProcessingStage
+from objectiv_backend.workers.pg_storage import insert_events_into_data, insert_events_into_nok_data
+
+BATCH_SIZE = 1000
+BATCH_COUNT = 5
+
+
+def bench_pg_write():
+    pg_config = get_config_postgres()
+    if pg_config is None:
+        raise Exception('Missing Postgres configuration')
+    connection = get_db_connection(pg_config)
+    results = {}
+    for table in ('data', 'data (50% duplicates)', 'nok_data', 'queue_entry'):
+        print(f'\n# {table}')
+        for write_engine in PG_WRITE_ENGINES:
+            batches = [make_sample_events(BATCH_SIZE) for _ in range(BATCH_COUNT)]
+
+            def write() -> int:
+                try:
+                    with connection.cursor() as cursor:
+                        cursor.execute('select 1')
+                    for events in batches:
+                        if table == 'data':
+                            insert_events_into_data(connection, events, write_engine=write_engine)
+                        elif table == 'data (50% duplicates)':
+                            insert_events_into_data(connection, events[:BATCH_SIZE // 2],
+                                                    write_engine=write_engine)
+                            insert_events_into_data(connection, events, write_engine=write_engine)
+                        elif table == 'nok_data':
+                            insert_events_into_nok_data(connection, events, write_engine=write_engine)
+                        else:
+                            PostgresQueues(connection, write_engine=write_engine)\
+                                .put_events(queue=ProcessingStage.ENTRY, events=events)
+                finally:
+                    connection.rollback()
+                return BATCH_SIZE * BATCH_COUNT
+
+            results[write_engine] = measure(f'rows/sec, {write_engine}', write)
+        print_speedup(results['insert'], results['copy'])
+
+
+if __name__ == '__main__':
+    bench_pg_write()
@@ -0,0 +1,80 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Micro-benchmark of type-hydration and the required-contexts check, as done by the collector (sync mode)
+or the entry worker for every event.
+
+Compares determining and sorting the parent types per event and per context, and taking the union of the
+parent types of all contexts, with the lookup tables and bitmasks that are pre-calculated by EventSchema.
+
+The events are read from the sample payloads in the backend/jsons directory. If there are none, generated
+sample events are used.
+
+Run from the backend directory:
+    python -m benchmarks.bench_schema_tables
+"""
+from benchmarks.util import load_sample_events, make_sample_events, measure, print_speedup
+from objectiv_backend.common.config import get_collector_config
+from objectiv_backend.common.types import EventData
+from objectiv_backend.schema.event_schemas import EventSchema
+from objectiv_backend.schema.hydrate_events import hydrate_types_into_event
+from objectiv_backend.schema.validate_events import _validate_required_contexts
+
+SAMPLE_EVENT_COUNT = 1000
+
+
+def _hydrate_uncompiled(event_schema: EventSchema, event: EventData):
+    """ Hydrate the types the way this was done before the sorted types were pre-calculated. """
+    event['_types'] = sorted(event_schema.get_all_parent_event_types(event['_type']))
+    for context in event['global_contexts'] + event['location_stack']:
+        context['_types'] = sorted(event_schema.get_all_parent_context_types(context['_type']))
+
+
+def _has_required_contexts_uncompiled(event_schema: EventSchema, event: EventData) -> bool:
+    """ Check the required contexts the way this was done before the bitmasks were pre-calculated. """
+    required_context_types = event_schema.get_all_required_contexts(event['_type'])
+    actual_types = set()
+    for context in event['global_contexts'] + event['location_stack']:
+        actual_types |= event_schema.get_all_parent_context_types(context['_type'])
+    return required_context_types.issubset(actual_types)
+
+
+def bench_schema_tables():
+    event_schema = get_collector_config().event_schema
+    events = [event for event in load_sample_events() if event_schema.is_valid_event_type(event['_type'])]
+    print(f'{len(events)} events from sample payloads')
+    if not events:
+        events = make_sample_events(SAMPLE_EVENT_COUNT)
+        print(f'using {len(events)} generated events')
+
+    def hydrate_uncompiled() -> int:
+        for event in events:
+            _hydrate_uncompiled(event_schema, event)
+        return len(events)
+
+    def hydrate() -> int:
+        for event in events:
+            hydrate_types_into_event(event_schema, event)
+        return len(events)
+
+    before = measure('events/sec, hydrate, sort per event', hydrate_uncompiled)
+    after = measure('events/sec, hydrate, sorted tables', hydrate)
+    print_speedup(before, after)
+
+    def required_contexts_uncompiled() -> int:
+        for event in events:
+            _has_required_contexts_uncompiled(event_schema, event)
+        return len(events)
+
+    def required_contexts() -> int:
+        for event in events:
+            _validate_required_contexts(event_schema, event)
+        return len(events)
+
+    before = measure('events/sec, required contexts, sets', required_contexts_uncompiled)
+    after = measure('events/sec, required contexts, bitmask', required_contexts)
+    print_speedup(before, after)
+
+
+if __name__ == '__main__':
+    bench_schema_tables()
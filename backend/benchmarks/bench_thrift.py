@@ -0,0 +1,50 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Micro-benchmark of the Thrift serialization of Snowplow collector payloads, as done per event by the
+Snowplow output. Compares the generated Thrift code with the dedicated encoder.
+
+Run from the backend directory:
+    python -m benchmarks.bench_thrift
+"""
+from benchmarks.util import make_sample_events, measure, print_speedup
+from objectiv_backend.common.config import SnowplowConfig
+from objectiv_backend.snowplow.collector_payload import encode_collector_payload, \
+    encode_collector_payload_generic
+from objectiv_backend.snowplow.snowplow_helper import objectiv_event_to_snowplow_payload
+
+EVENT_COUNT = 1000
+
+_CONFIG = SnowplowConfig(
+    gcp_project='bench',
+    gcp_pubsub_topic_raw='raw',
+    gcp_pubsub_topic_bad='bad',
+    schema_collector_payload='iglu:com.snowplowanalytics.snowplow/CollectorPayload/thrift/1-0-0',
+    schema_contexts='iglu:com.snowplowanalytics.snowplow/contexts/jsonschema/1-0-0',
+    schema_objectiv_taxonomy='iglu:io.objectiv/taxonomy/jsonschema/1-0-0',
+    schema_payload_data='iglu:com.snowplowanalytics.snowplow/payload_data/jsonschema/1-0-4',
+    schema_schema_violations='iglu:com.snowplowanalytics.snowplow.badrows/schema_violations/jsonschema/2-0-0'
+)
+
+
+def bench_thrift():
+    events = make_sample_events(EVENT_COUNT)
+    payloads = [objectiv_event_to_snowplow_payload(event, _CONFIG) for event in events]
+
+    def generic() -> int:
+        for payload in payloads:
+            encode_collector_payload_generic(payload)
+        return len(payloads)
+
+    def dedicated() -> int:
+        for payload in payloads:
+            encode_collector_payload(payload)
+        return len(payloads)
+
+    before = measure('payloads/sec, generic thrift', generic)
+    after = measure('payloads/sec, dedicated encoder', dedicated)
+    print_speedup(before, after)
+
+
+if __name__ == '__main__':
+    bench_thrift()
@@ -0,0 +1,113 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Micro-benchmark of event validation, as done by the collector for every event.
+
+Compares validating against the json-schemas that were rebuilt per event and per context, with the
+pre-compiled validators on the EventSchema. Compares validating the events of a payload one by one, with
+validating them as a batch, and with the generated validators (SCHEMA_VALIDATOR=generated). And compares
+validating the structure of a full event list with the rebuilt event-list schema, with the pre-compiled
+validator and the fast path.
+
+Run from the backend directory:
+    python -m benchmarks.bench_validation
+"""
+from typing import List
+
+import jsonschema
+
+from benchmarks.util import make_sample_events, measure, print_speedup
+from objectiv_backend.common import config
+from objectiv_backend.common.config import get_collector_config
+from objectiv_backend.schema.event_schemas import get_event_list_schema
+from objectiv_backend.common.types import EventData
+from objectiv_backend.schema.validate_events import validate_event_adheres_to_schema, ErrorInfo, \
+    validate_structure_event_list, validate_events_adhere_to_schema
+
+EVENT_COUNT = 200
+# Events per payload for the structure validation, this is the maximum the collector accepts
+EVENT_LIST_COUNT = 1000
+
+
+def _validate_uncompiled(event: EventData) -> List[ErrorInfo]:
+    """ Validate event and contexts the way this was done before validators were pre-compiled. """
+    event_schema = get_collector_config().event_schema
+    jsonschema.validate(instance=event, schema=event_schema.get_event_schema(event['_type']))
+    for context in event['global_contexts'] + event['location_stack']:
+        jsonschema.validate(instance=context, schema=event_schema.get_context_schema(context['_type']))
+    return []
+
+
+def bench_schema_validation():
+    event_schema = get_collector_config().event_schema
+    events = make_sample_events(EVENT_COUNT)
+
+    def uncompiled() -> int:
+        for event in events:
+            _validate_uncompiled(event)
+        return len(events)
+
+    def compiled() -> int:
+        for event in events:
+            assert validate_event_adheres_to_schema(event_schema=event_schema, event=event) == []
+        return len(events)
+
+    before = measure('events/sec, validate per event', uncompiled)
+    after = measure('events/sec, pre-compiled validators', compiled)
+    print_speedup(before, after)
+
+
+def bench_batch_validation():
+    event_schema = get_collector_config().event_schema
+    events = make_sample_events(EVENT_LIST_COUNT)
+
+    def per_event() -> int:
+        for event in events:
+            assert validate_event_adheres_to_schema(event_schema=event_schema, event=event) == []
+        return len(events)
+
+    def batch() -> int:
+        errors = validate_events_adhere_to_schema(event_schema=event_schema, events=events)
+        assert not any(errors)
+        return len(events)
+
+    before = measure('events/sec, payload, per event', per_event)
+    after = measure('events/sec, payload, batch', batch)
+    print_speedup(before, after)
+
+    jsonschema_config = get_collector_config()
+    config._CACHED_COLLECTOR_CONFIG = jsonschema_config._replace(schema_validator='generated')
+    try:
+        generated = measure('events/sec, payload, generated validators', batch)
+    finally:
+        config._CACHED_COLLECTOR_CONFIG = jsonschema_config
+    print_speedup(before, generated)
+
+
+def bench_structure_validation():
+    event_schema = get_collector_config().event_schema
+    validator = get_collector_config().event_list_validator
+    event_list = {'events': make_sample_events(EVENT_LIST_COUNT), 'transport_time': 1}
+
+    def uncached() -> int:
+        jsonschema.validate(instance=event_list, schema=get_event_list_schema(event_schema))
+        return 1
+
+    def compiled() -> int:
+        assert validator.is_valid(event_list)
+        return 1
+
+    def fast_path() -> int:
+        assert validate_structure_event_list(event_list) == []
+        return 1
+
+    before = measure('payloads/sec, rebuild list schema', uncached)
+    measure('payloads/sec, pre-compiled validator', compiled)
+    after = measure('payloads/sec, fast path', fast_path)
+    print_speedup(before, after)
+
+
+if __name__ == '__main__':
+    bench_schema_validation()
+    bench_batch_validation()
+    bench_structure_validation()
@@ -0,0 +1,116 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Helpers that are shared between the benchmark scripts in this directory.
+"""
+import glob
+import gzip
+import io
+import os
+import time
+import uuid
+from copy import deepcopy
+from typing import Callable
+
+from objectiv_backend.common.json_codec import json_loads
+from objectiv_backend.common.types import EventData, EventDataList
+
+# Directory with sample payloads: the filesystem output writes the OK and NOK events to (git-ignored)
+# subdirectories of it when running the collector with FILESYSTEM_OUTPUT_DIR=jsons
+SAMPLE_PAYLOAD_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'jsons')
+
+_LOCATION_STACK = [
+    {'_type': 'RootLocationContext', 'id': 'home'},
+    {'_type': 'NavigationContext', 'id': 'navigation'},
+    {'_type': 'PressableContext', 'id': 'open-drawer'}
+]
+
+_GLOBAL_CONTEXTS = [
+    {'_type': 'ApplicationContext', 'id': 'rod-web-demo'},
+    {'_type': 'PathContext', 'id': 'http://localhost:3000/?utm_source=bench&utm_medium=cpc&utm_campaign=b'},
+    {'_type': 'HttpContext', 'id': 'http_context', 'referrer': '', 'user_agent': 'bench',
+     'remote_address': '127.0.0.1'},
+    {'_type': 'CookieIdContext', 'id': 'f84446c6-eb76-4458-8ef4-93ade596fd5b',
+     'cookie_id': 'f84446c6-eb76-4458-8ef4-93ade596fd5b'}
+]
+
+# (event-type, extra location contexts) combinations that are valid according to the base schema
+_EVENT_TYPES = [
+    ('PressEvent', []),
+    ('VisibleEvent', []),
+    ('HiddenEvent', []),
+    ('InputChangeEvent', [{'_type': 'InputContext', 'id': 'input'}]),
+]
+
+
+def make_sample_events(count: int, start_millis: int = 0) -> EventDataList:
+    """
+    Give a list of count distinct, valid events. The events are of a handful of different types, which is
+    representative of a normal payload sent by a tracker.
+    :param count: number of events
+    :param start_millis: time of the first event. Defaults to the current time
+    """
+    if not start_millis:
+        start_millis = round(time.time() * 1000)
+    events = []
+    for i in range(count):
+        event_type, extra_location = _EVENT_TYPES[i % len(_EVENT_TYPES)]
+        event: EventData = {
+            '_type': event_type,
+            'id': str(uuid.uuid4()),
+            'time': start_millis - i,
+            'location_stack': deepcopy(_LOCATION_STACK) + deepcopy(extra_location),
+            'global_contexts': deepcopy(_GLOBAL_CONTEXTS)
+        }
+        events.append(event)
+    return events
+
+
+def load_sample_events(directory: str = SAMPLE_PAYLOAD_DIRECTORY) -> EventDataList:
+    """
+    Give the events in the json files in directory and its subdirectories, as written by the filesystem
+    output (newline-delimited json, optionally compressed) or by older versions (a json array per file).
+    Parquet files are skipped, as are zstd compressed files if the zstandard package is not installed.
+    """
+    events: EventDataList = []
+    for path in sorted(glob.glob(os.path.join(directory, '**', '*.json*'), recursive=True)):
+        with open(path, 'rb') as file:
+            data = file.read()
+        if path.endswith('.gz'):
+            data = gzip.decompress(data)
+        elif path.endswith('.zst'):
+            try:
+                import zstandard
+            except ImportError:
+                continue
+            data = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)).read()
+        elif not path.endswith('.json'):
+            continue
+        if data.lstrip().startswith(b'['):
+            events.extend(json_loads(data))
+        else:
+            events.extend(json_loads(line) for line in data.splitlines() if line.strip())
+    return events
+
+
+def measure(name: str, function: Callable[[], int], repeat: int = 5) -> float:
+    """
+    Call function repeat times, and print and return the best throughput.
+    :param name: name to print with the result
+    :param function: function that takes no arguments and returns the number of items it processed
+    :param repeat: number of runs
+    :return: highest number of processed items per second, over all runs
+    """
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        item_count = function()
+        duration = time.perf_counter() - start
+        best = max(best, item_count / duration)
+    print(f'{name:<40} {best:>14,.0f} items/sec')
+    return best
+
+
+def print_speedup(before: float, after: float):
+    print(f'{"speedup":<40} {after / before:>14.2f} x')
+
@@ -1,5 +1,7 @@
 import os
 workers = os.environ.get('WORKERS', 2)
+# Number of threads per worker. With more than 1 thread gunicorn uses the gthread worker class
+threads = int(os.environ.get('THREADS', 1))
 host = os.environ.get('HOST', '0.0.0.0')
 port = os.environ.get('PORT', 5000)
 bind = f'{host}:{port}'
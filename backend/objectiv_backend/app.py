@@ -1,11 +1,12 @@
 from flask import Flask
 from flask_cors import CORS
 
-from objectiv_backend.common.config import init_collector_config
+from objectiv_backend.common.config import init_collector_config, get_collector_config
 
 
 def create_app() -> Flask:
     from objectiv_backend.end_points import collector
+    from objectiv_backend.end_points import metrics
     from objectiv_backend.end_points import schema
 
     # load config - this will raise an error if there are configuration problems, and will cache the
@@ -16,6 +17,8 @@ def create_app() -> Flask:
     flask_app.add_url_rule(rule='/schema', view_func=schema.schema, methods=['GET'])
     flask_app.add_url_rule(rule='/jsonschema', view_func=schema.json_schema, methods=['GET'])
     flask_app.add_url_rule(rule='/', view_func=collector.collect, methods=['POST'])
+    if get_collector_config().metrics_enabled:
+        flask_app.add_url_rule(rule='/metrics', view_func=metrics.metrics, methods=['GET'])
     init_cors(flask_app)
     return flask_app
 
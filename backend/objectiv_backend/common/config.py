@@ -3,13 +3,15 @@ Copyright 2021 Objectiv B.V.
 """
 
 import os
-from typing import NamedTuple, Optional
+from typing import NamedTuple, Optional, Any, Tuple
 
 # All settings that are controlled through environment variables are listed at the top here, for a
 # complete overview.
 # These settings should not be accessed by the constants here, but through the functions defined
 # below (e.g. get_config_output())
-from objectiv_backend.schema.event_schemas import EventSchema, get_event_schema, get_event_list_schema
+from objectiv_backend.schema.event_schemas import EventSchema, get_event_schema, get_event_list_schema, \
+    compile_json_schema_validator
+from objectiv_backend.schema.generate_validators import compile_validators
 from objectiv_backend.common.types import EventListSchema
 
 LOAD_BASE_SCHEMA = os.environ.get('LOAD_BASE_SCHEMA', 'true') == 'true'
@@ -17,6 +19,12 @@ SCHEMA_EXTENSION_DIRECTORY = os.environ.get('SCHEMA_EXTENSION_DIRECTORY')
 
 # when set to true, the collector will return detailed validation errors per event
 SCHEMA_VALIDATION_ERROR_REPORTING = os.environ.get('SCHEMA_VALIDATION_ERROR_REPORTING', 'false') == 'true'
+# How events are validated against the schema. Either 'jsonschema': the json-schemas of the event and
+# context types are interpreted by jsonschema, or 'generated': Python functions are generated from the
+# json-schemas when the schema is loaded, and only invalid events are validated with jsonschema, to get the
+# errors. See schema/generate_validators.py
+SCHEMA_VALIDATOR = os.environ.get('SCHEMA_VALIDATOR', 'jsonschema')
+SCHEMA_VALIDATORS = ('jsonschema', 'generated')
 
 # Number of ms before an event is considered too old. set to 0 to disable
 MAX_DELAYED_EVENTS_MILLIS = 1000 * 3600
@@ -32,6 +40,47 @@ _PG_PORT = os.environ.get('POSTGRES_PORT', '5432')
 _PG_DATABASE_NAME = os.environ.get('POSTGRES_DB', 'objectiv')
 _PG_USER = os.environ.get('POSTGRES_USER', 'objectiv')
 _PG_PASSWORD = os.environ.get('POSTGRES_PASSWORD', '')
+# Connection pool used by the collector: number of connections to open at start, and the maximum number
+# of connections that are open at the same time (per process).
+_PG_POOL_MIN_SIZE = os.environ.get('POSTGRES_POOL_MIN_SIZE', '1')
+_PG_POOL_MAX_SIZE = os.environ.get('POSTGRES_POOL_MAX_SIZE', '10')
+# Pooled connections that have been idle for longer than this are checked before being reused
+_PG_POOL_HEALTH_CHECK_SECONDS = os.environ.get('POSTGRES_POOL_HEALTH_CHECK_SECONDS', '30')
+# How events are written to the data, nok_data and queue tables. Either 'insert': multi-row insert
+# statements, or 'copy': `COPY ... FROM STDIN`, which is faster for large batches.
+PG_WRITE_ENGINE = os.environ.get('POSTGRES_WRITE_ENGINE', 'insert')
+PG_WRITE_ENGINES = ('insert', 'copy')
+# Layout of the data table. Either 'json': the event is stored in the json column `value`, or 'extracted':
+# `value` is a jsonb column, and the columns event_type, stack_event_types, global_contexts and
+# location_stack are extracted from the event when it is inserted. See data_layout_extracted.sql
+PG_DATA_LAYOUT = os.environ.get('POSTGRES_DATA_LAYOUT', 'json')
+PG_DATA_LAYOUTS = ('json', 'extracted')
+# Whether the data and nok_data tables are range-partitioned by day. See data_partitioned.sql
+PG_DATA_PARTITIONED = os.environ.get('POSTGRES_DATA_PARTITIONED', '') == 'true'
+# Layout of the queue tables. Either 'table': a single table per queue, or 'rotating': each queue is
+# partitioned in a ring of buckets, events are put in the bucket of the current period of
+# POSTGRES_QUEUE_BUCKET_SECONDS, and buckets are truncated by the workers once all their events are consumed.
+# See queue_rotating.sql
+PG_QUEUE_LAYOUT = os.environ.get('POSTGRES_QUEUE_LAYOUT', 'table')
+PG_QUEUE_LAYOUTS = ('table', 'rotating')
+PG_QUEUE_BUCKET_SECONDS = float(os.environ.get('POSTGRES_QUEUE_BUCKET_SECONDS', '300'))
+# In-memory filter of the ids of events that were recently committed to the data table, kept per process.
+# Events with an id in the filter are written to nok_data as duplicates directly, without inserting them
+# into the data table first. At most POSTGRES_DUPLICATE_FILTER_SIZE ids are kept, each for at most
+# POSTGRES_DUPLICATE_FILTER_SECONDS. A size of 0 disables the filter. See workers/recent_event_ids.py
+PG_DUPLICATE_FILTER_SIZE = int(os.environ.get('POSTGRES_DUPLICATE_FILTER_SIZE', '100000'))
+PG_DUPLICATE_FILTER_SECONDS = float(os.environ.get('POSTGRES_DUPLICATE_FILTER_SECONDS', '3600'))
+# Group commit: if not 'off', the collector buffers the events of many requests, and writes them to Postgres
+# in a single transaction, once GROUP_COMMIT_MAX_EVENTS events are buffered or the oldest buffered events
+# have waited GROUP_COMMIT_MAX_DELAY_MS. With 'wait' the response waits for the transaction to be committed,
+# with 'no_wait' the response is returned directly, and events are lost if the transaction fails.
+# At most GROUP_COMMIT_MAX_BUFFERED_EVENTS are buffered, requests wait if the buffer is full.
+# See end_points/group_commit.py
+_PG_GROUP_COMMIT = os.environ.get('POSTGRES_GROUP_COMMIT', 'off')
+_PG_GROUP_COMMIT_MAX_EVENTS = os.environ.get('POSTGRES_GROUP_COMMIT_MAX_EVENTS', '500')
+_PG_GROUP_COMMIT_MAX_DELAY_MS = os.environ.get('POSTGRES_GROUP_COMMIT_MAX_DELAY_MS', '20')
+_PG_GROUP_COMMIT_MAX_BUFFERED_EVENTS = os.environ.get('POSTGRES_GROUP_COMMIT_MAX_BUFFERED_EVENTS', '10000')
+PG_GROUP_COMMIT_MODES = ('off', 'wait', 'no_wait')
 
 # ### AWS S3 values, for writing data to S3.
 # default access keys to an empty string, otherwise the boto library will default ot user defaults.
@@ -46,6 +95,26 @@ _AWS_S3_PREFIX = os.environ.get('AWS_S3_PREFIX', '')
 _OUTPUT_ENABLE_FILESYSTEM = os.environ.get('OUTPUT_ENABLE_FILESYSTEM', '') == 'true'
 _FILESYSTEM_OUTPUT_DIR = os.environ.get('FILESYSTEM_OUTPUT_DIR')
 
+# ### Settings for the S3 and filesystem outputs
+# Events are buffered per output, and written as newline-delimited json files, compressed with
+# OUTPUT_COMPRESSION. A file is written once OUTPUT_BUFFER_MAX_BYTES bytes of json are buffered, or the
+# oldest buffered event has waited OUTPUT_BUFFER_MAX_SECONDS. See end_points/output_buffer.py
+_OUTPUT_COMPRESSION = os.environ.get('OUTPUT_COMPRESSION', 'gzip')
+_OUTPUT_BUFFER_MAX_BYTES = os.environ.get('OUTPUT_BUFFER_MAX_BYTES', str(64 * 1024 * 1024))
+_OUTPUT_BUFFER_MAX_SECONDS = os.environ.get('OUTPUT_BUFFER_MAX_SECONDS', '60')
+# 'zstd' requires the optional zstandard package
+OUTPUT_COMPRESSIONS = ('gzip', 'zstd', 'none')
+# Comma-separated list of the formats in which the events are written, see OUTPUT_FILE_FORMAT_NAMES.
+# Parquet files are written to the 'parquet' directory, partitioned by the day of the events, with row
+# groups of OUTPUT_PARQUET_ROW_GROUP_SIZE events. A Parquet file is written once the buffered events take
+# OUTPUT_PARQUET_BUFFER_MAX_BYTES bytes as (uncompressed) Arrow columns, or after OUTPUT_BUFFER_MAX_SECONDS.
+# The columns take less space than the json of the same events. See end_points/parquet_output.py
+_OUTPUT_FILE_FORMATS = os.environ.get('OUTPUT_FILE_FORMATS', 'json')
+_OUTPUT_PARQUET_ROW_GROUP_SIZE = os.environ.get('OUTPUT_PARQUET_ROW_GROUP_SIZE', '10000')
+_OUTPUT_PARQUET_BUFFER_MAX_BYTES = os.environ.get('OUTPUT_PARQUET_BUFFER_MAX_BYTES', str(64 * 1024 * 1024))
+# 'parquet' requires the optional pyarrow package
+OUTPUT_FILE_FORMAT_NAMES = ('json', 'parquet')
+
 # ### Snowplow settings
 _SP_SCHEMA_COLLECTOR_PAYLOAD = 'iglu:com.snowplowanalytics.snowplow/CollectorPayload/thrift/1-0-0'
 _SP_SCHEMA_CONTEXTS = 'iglu:com.snowplowanalytics.snowplow/contexts/jsonschema/1-0-0'
@@ -56,15 +125,57 @@ _SP_SCHEMA_SCHEMA_VIOLATIONS = 'iglu:com.snowplowanalytics.snowplow.badrows/sche
 _SP_GCP_PROJECT = os.environ.get('SP_GCP_PROJECT', None)
 _SP_GCP_PUBSUB_TOPIC_RAW = os.environ.get('SP_GCP_PUBSUB_TOPIC_RAW', '')
 _SP_GCP_PUBSUB_TOPIC_BAD = os.environ.get('SP_GCP_PUBSUB_TOPIC_BAD', '')
+# Batch settings of the Pub/Sub publisher: messages are sent in batches of at most this number of messages
+# or bytes, and a batch is sent at the latest after the given latency.
+_SP_GCP_PUBSUB_MAX_MESSAGES = os.environ.get('SP_GCP_PUBSUB_MAX_MESSAGES', '100')
+_SP_GCP_PUBSUB_MAX_BYTES = os.environ.get('SP_GCP_PUBSUB_MAX_BYTES', '1000000')
+_SP_GCP_PUBSUB_MAX_LATENCY_MS = os.environ.get('SP_GCP_PUBSUB_MAX_LATENCY_MS', '10')
+# Maximum time to wait till all messages of a request are published
+_SP_GCP_PUBSUB_TIMEOUT_SECONDS = os.environ.get('SP_GCP_PUBSUB_TIMEOUT_SECONDS', '10')
+
+# ### Output dispatching
+# The collector writes the events of a request to all configured outputs concurrently. The response is
+# returned once the mandatory outputs are written. If one of those fails, waits longer than
+# OUTPUT_TIMEOUT_SECONDS for a thread, or takes longer than OUTPUT_TIMEOUT_SECONDS after it started, the
+# request fails. At most OUTPUT_MANDATORY_QUEUE_SIZE mandatory writes can be pending per process, if there
+# are more the request fails. Other outputs are written in the background, with at most
+# OUTPUT_BACKGROUND_QUEUE_SIZE pending writes per process. Mandatory and background outputs each
+# have a pool of OUTPUT_THREADS threads per process. OUTPUT_MANDATORY is a comma-separated list of outputs
+# (see OUTPUT_NAMES), by default all configured outputs are mandatory. See end_points/output_dispatch.py
+_OUTPUT_MANDATORY = os.environ.get('OUTPUT_MANDATORY')
+_OUTPUT_TIMEOUT_SECONDS = os.environ.get('OUTPUT_TIMEOUT_SECONDS', '10')
+_OUTPUT_THREADS = os.environ.get('OUTPUT_THREADS', '8')
+_OUTPUT_MANDATORY_QUEUE_SIZE = os.environ.get('OUTPUT_MANDATORY_QUEUE_SIZE', '1000')
+_OUTPUT_BACKGROUND_QUEUE_SIZE = os.environ.get('OUTPUT_BACKGROUND_QUEUE_SIZE', '1000')
+# Names of the outputs, these are the same as the fields of OutputConfig
+OUTPUT_NAMES = ('postgres', 'aws', 'file_system', 'snowplow')
+
+# ### Metrics, see common/metrics.py
+# Whether the collector serves its metrics on /metrics. The endpoint is not authenticated, so only enable
+# this if /metrics is not reachable from the internet, e.g. because it is blocked in a reverse proxy.
+_METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'false') == 'true'
+# Port on which the workers serve their metrics. Not served if empty. A worker pool with multiple
+# processes uses the ports WORKER_METRICS_PORT + process number.
+WORKER_METRICS_PORT = os.environ.get('WORKER_METRICS_PORT', '')
+# Address on which the workers serve their metrics. Use 0.0.0.0 to serve them on all interfaces, e.g. to
+# scrape them from outside a container.
+WORKER_METRICS_HOST = os.environ.get('WORKER_METRICS_HOST', '127.0.0.1')
 
 # Cookie settings
 _OBJ_COOKIE = 'obj_user_id'
 # default cookie duration is 1 year, can be overridden by setting `COOKIE_DURATION`
 _OBJ_COOKIE_DURATION = int(os.environ.get('COOKIE_DURATION', 60 * 60 * 24 * 365 * 1))
 
-# Maximum number of events that a worker will process in a single batch. Only relevant in async mode
-WORKER_BATCH_SIZE = 200
-# Time to sleep, if there is no work to do for the workers. Only relevant in async mode
+# Number of events that a worker will process in a single batch. Only relevant in async mode.
+# The batch size adapts to the load, within [WORKER_BATCH_SIZE_MIN, WORKER_BATCH_SIZE_MAX]: it grows while
+# batches are full and take less than WORKER_BATCH_TARGET_SECONDS, and shrinks if batches take longer or
+# run into lock timeouts. WORKER_BATCH_SIZE is the initial batch size.
+WORKER_BATCH_SIZE = int(os.environ.get('WORKER_BATCH_SIZE', '200'))
+WORKER_BATCH_SIZE_MIN = int(os.environ.get('WORKER_BATCH_SIZE_MIN', '20'))
+WORKER_BATCH_SIZE_MAX = int(os.environ.get('WORKER_BATCH_SIZE_MAX', '5000'))
+WORKER_BATCH_TARGET_SECONDS = float(os.environ.get('WORKER_BATCH_TARGET_SECONDS', '1'))
+# Maximum time to wait for a notification of new events, if there is no work to do for the workers. Workers
+# are woken up as soon as events are put on a queue, so this is only a fallback. Only relevant in async mode
 WORKER_SLEEP_SECONDS = 5
 
 
@@ -80,12 +191,29 @@ class FileSystemOutputConfig(NamedTuple):
     path: str
 
 
+class OutputBufferConfig(NamedTuple):
+    max_bytes: int
+    max_seconds: float
+    compression: str
+    file_formats: Tuple[str, ...] = ('json', )
+    parquet_row_group_size: int = 10000
+    parquet_max_bytes: int = 64 * 1024 * 1024
+
+
 class PostgresConfig(NamedTuple):
     hostname: str
     port: int
     database_name: str
     user: str
     password: str
+    pool_min_size: int = 1
+    pool_max_size: int = 10
+    pool_health_check_seconds: int = 30
+    # see POSTGRES_GROUP_COMMIT
+    group_commit: str = 'off'
+    group_commit_max_events: int = 500
+    group_commit_max_delay_ms: int = 20
+    group_commit_max_buffered_events: int = 10000
 
 
 class SnowplowConfig(NamedTuple):
@@ -99,12 +227,27 @@ class SnowplowConfig(NamedTuple):
     schema_payload_data: str
     schema_schema_violations: str
 
+    # see SP_GCP_PUBSUB_MAX_MESSAGES etc.
+    gcp_pubsub_max_messages: int = 100
+    gcp_pubsub_max_bytes: int = 1_000_000
+    gcp_pubsub_max_latency_seconds: float = 0.01
+    gcp_pubsub_timeout_seconds: float = 10
+
 
 class OutputConfig(NamedTuple):
     postgres: Optional[PostgresConfig]
     aws: Optional[AwsOutputConfig]
     file_system: Optional[FileSystemOutputConfig]
     snowplow: Optional[SnowplowConfig]
+    # buffer settings of the aws and file_system outputs
+    buffer: OutputBufferConfig = OutputBufferConfig(max_bytes=64 * 1024 * 1024, max_seconds=60,
+                                                    compression='gzip')
+    # names of the configured outputs that must be written before a response is returned
+    mandatory: Tuple[str, ...] = OUTPUT_NAMES
+    timeout_seconds: float = 10
+    threads: int = 8
+    background_queue_size: int = 1000
+    mandatory_queue_size: int = 1000
 
 
 class CookieConfig(NamedTuple):
@@ -124,12 +267,18 @@ class CollectorConfig(NamedTuple):
     output: OutputConfig
     event_schema: EventSchema
     event_list_schema: EventListSchema
+    # jsonschema validator for event_list_schema
+    event_list_validator: Any
+    # see METRICS_ENABLED
+    metrics_enabled: bool = False
+    # see SCHEMA_VALIDATOR
+    schema_validator: str = 'jsonschema'
 
 
 def get_config_output_aws() -> Optional[AwsOutputConfig]:
     if not _OUTPUT_ENABLE_AWS:
         return None
-    if _AWS_REGION and _AWS_ACCESS_KEY_ID and _AWS_SECRET_ACCESS_KEY and _AWS_BUCKET and _AWS_S3_PREFIX:
+    if not (_AWS_REGION and _AWS_ACCESS_KEY_ID and _AWS_SECRET_ACCESS_KEY and _AWS_BUCKET and _AWS_S3_PREFIX):
         raise ValueError(f'OUTPUT_ENABLE_AWS = true, but not all required values specified. '
                          f'Must specify AWS_REGION, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_BUCKET, '
                          f'and AWS_S3_PREFIX')
@@ -150,18 +299,89 @@ def get_config_output_file_system() -> Optional[FileSystemOutputConfig]:
     return FileSystemOutputConfig(path=_FILESYSTEM_OUTPUT_DIR)
 
 
+def get_config_output_buffer() -> OutputBufferConfig:
+    if _OUTPUT_COMPRESSION not in OUTPUT_COMPRESSIONS:
+        raise ValueError(f'Invalid OUTPUT_COMPRESSION: {_OUTPUT_COMPRESSION}. '
+                         f'Must be one of {OUTPUT_COMPRESSIONS}')
+    file_formats = tuple(name.strip() for name in _OUTPUT_FILE_FORMATS.split(',') if name.strip())
+    invalid_names = [name for name in file_formats if name not in OUTPUT_FILE_FORMAT_NAMES]
+    if not file_formats or invalid_names:
+        raise ValueError(f'Invalid OUTPUT_FILE_FORMATS: {_OUTPUT_FILE_FORMATS}. Must be a comma-separated '
+                         f'list of {OUTPUT_FILE_FORMAT_NAMES}')
+    # pyarrow has its own zstd implementation, the zstandard package is only needed for json
+    if _OUTPUT_COMPRESSION == 'zstd' and 'json' in file_formats:
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            raise ValueError('OUTPUT_COMPRESSION = zstd, but the zstandard package is not installed.')
+    if 'parquet' in file_formats:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError('OUTPUT_FILE_FORMATS contains parquet, '
+                             'but the pyarrow package is not installed.')
+    max_bytes = int(_OUTPUT_BUFFER_MAX_BYTES)
+    max_seconds = float(_OUTPUT_BUFFER_MAX_SECONDS)
+    parquet_row_group_size = int(_OUTPUT_PARQUET_ROW_GROUP_SIZE)
+    parquet_max_bytes = int(_OUTPUT_PARQUET_BUFFER_MAX_BYTES)
+    if max_bytes < 1 or max_seconds <= 0 or parquet_row_group_size < 1 or parquet_max_bytes < 1:
+        raise ValueError('Invalid output buffer settings. Must have OUTPUT_BUFFER_MAX_BYTES >= 1, '
+                         'OUTPUT_BUFFER_MAX_SECONDS > 0, OUTPUT_PARQUET_ROW_GROUP_SIZE >= 1, and '
+                         'OUTPUT_PARQUET_BUFFER_MAX_BYTES >= 1')
+    return OutputBufferConfig(
+        max_bytes=max_bytes,
+        max_seconds=max_seconds,
+        compression=_OUTPUT_COMPRESSION,
+        file_formats=file_formats,
+        parquet_row_group_size=parquet_row_group_size,
+        parquet_max_bytes=parquet_max_bytes
+    )
+
+
 def get_config_postgres() -> Optional[PostgresConfig]:
     if not _OUTPUT_ENABLE_PG:
         return None
     if not _PG_HOSTNAME or not _PG_PORT or not _PG_DATABASE_NAME or not _PG_USER:
         raise ValueError(f'OUTPUT_ENABLE_PG = true, but not all required values specified. '
                          f'Must specify PG_HOSTNAME, PG_PORT, PG_DATABASE_NAME, PG_USER, and PG_PASSWORD')
+    if PG_WRITE_ENGINE not in PG_WRITE_ENGINES:
+        raise ValueError(f'Invalid POSTGRES_WRITE_ENGINE: {PG_WRITE_ENGINE}. Must be one of {PG_WRITE_ENGINES}')
+    if PG_DATA_LAYOUT not in PG_DATA_LAYOUTS:
+        raise ValueError(f'Invalid POSTGRES_DATA_LAYOUT: {PG_DATA_LAYOUT}. Must be one of {PG_DATA_LAYOUTS}')
+    if PG_QUEUE_LAYOUT not in PG_QUEUE_LAYOUTS:
+        raise ValueError(f'Invalid POSTGRES_QUEUE_LAYOUT: {PG_QUEUE_LAYOUT}. '
+                         f'Must be one of {PG_QUEUE_LAYOUTS}')
+    if PG_QUEUE_BUCKET_SECONDS <= 0:
+        raise ValueError(f'Invalid POSTGRES_QUEUE_BUCKET_SECONDS: {PG_QUEUE_BUCKET_SECONDS}. Must be > 0')
+    if _PG_GROUP_COMMIT not in PG_GROUP_COMMIT_MODES:
+        raise ValueError(f'Invalid POSTGRES_GROUP_COMMIT: {_PG_GROUP_COMMIT}. '
+                         f'Must be one of {PG_GROUP_COMMIT_MODES}')
+    group_commit_max_events = int(_PG_GROUP_COMMIT_MAX_EVENTS)
+    group_commit_max_delay_ms = int(_PG_GROUP_COMMIT_MAX_DELAY_MS)
+    group_commit_max_buffered_events = int(_PG_GROUP_COMMIT_MAX_BUFFERED_EVENTS)
+    if group_commit_max_events < 1 or group_commit_max_delay_ms < 0 \
+            or group_commit_max_buffered_events < group_commit_max_events:
+        raise ValueError('Invalid Postgres group commit settings. Must have '
+                         '1 <= POSTGRES_GROUP_COMMIT_MAX_EVENTS <= POSTGRES_GROUP_COMMIT_MAX_BUFFERED_EVENTS '
+                         'and 0 <= POSTGRES_GROUP_COMMIT_MAX_DELAY_MS')
+    pool_min_size = int(_PG_POOL_MIN_SIZE)
+    pool_max_size = int(_PG_POOL_MAX_SIZE)
+    if pool_min_size < 0 or pool_max_size < 1 or pool_min_size > pool_max_size:
+        raise ValueError(f'Invalid Postgres connection pool size. Must have '
+                         f'0 <= POSTGRES_POOL_MIN_SIZE <= POSTGRES_POOL_MAX_SIZE and 1 <= POSTGRES_POOL_MAX_SIZE')
     return PostgresConfig(
         hostname=_PG_HOSTNAME,
         port=int(_PG_PORT),
         database_name=_PG_DATABASE_NAME,
         user=_PG_USER,
-        password=_PG_PASSWORD
+        password=_PG_PASSWORD,
+        pool_min_size=pool_min_size,
+        pool_max_size=pool_max_size,
+        pool_health_check_seconds=int(_PG_POOL_HEALTH_CHECK_SECONDS),
+        group_commit=_PG_GROUP_COMMIT,
+        group_commit_max_events=group_commit_max_events,
+        group_commit_max_delay_ms=group_commit_max_delay_ms,
+        group_commit_max_buffered_events=group_commit_max_buffered_events
     )
 
 
@@ -178,17 +398,44 @@ def get_config_output_snowplow() -> Optional[SnowplowConfig]:
         schema_schema_violations=_SP_SCHEMA_SCHEMA_VIOLATIONS,
         gcp_project=_SP_GCP_PROJECT,
         gcp_pubsub_topic_raw=_SP_GCP_PUBSUB_TOPIC_RAW,
-        gcp_pubsub_topic_bad=_SP_GCP_PUBSUB_TOPIC_BAD
+        gcp_pubsub_topic_bad=_SP_GCP_PUBSUB_TOPIC_BAD,
+        gcp_pubsub_max_messages=int(_SP_GCP_PUBSUB_MAX_MESSAGES),
+        gcp_pubsub_max_bytes=int(_SP_GCP_PUBSUB_MAX_BYTES),
+        gcp_pubsub_max_latency_seconds=int(_SP_GCP_PUBSUB_MAX_LATENCY_MS) / 1000,
+        gcp_pubsub_timeout_seconds=float(_SP_GCP_PUBSUB_TIMEOUT_SECONDS)
     )
 
 
 def get_config_output() -> OutputConfig:
     """ Get the Collector's output settings. Raises an error if none of the outputs are configured. """
+    mandatory: Tuple[str, ...]
+    if _OUTPUT_MANDATORY is None:
+        mandatory = OUTPUT_NAMES
+    else:
+        mandatory = tuple(name.strip() for name in _OUTPUT_MANDATORY.split(',') if name.strip())
+        invalid_names = [name for name in mandatory if name not in OUTPUT_NAMES]
+        if invalid_names:
+            raise ValueError(f'Invalid OUTPUT_MANDATORY: {invalid_names}. Must be a comma-separated list of '
+                             f'{OUTPUT_NAMES}')
+    timeout_seconds = float(_OUTPUT_TIMEOUT_SECONDS)
+    threads = int(_OUTPUT_THREADS)
+    background_queue_size = int(_OUTPUT_BACKGROUND_QUEUE_SIZE)
+    mandatory_queue_size = int(_OUTPUT_MANDATORY_QUEUE_SIZE)
+    if timeout_seconds <= 0 or threads < 1 or background_queue_size < 1 or mandatory_queue_size < 1:
+        raise ValueError('Invalid output settings. Must have OUTPUT_TIMEOUT_SECONDS > 0, '
+                         'OUTPUT_THREADS >= 1, OUTPUT_BACKGROUND_QUEUE_SIZE >= 1, and '
+                         'OUTPUT_MANDATORY_QUEUE_SIZE >= 1')
     output_config = OutputConfig(
         postgres=get_config_postgres(),
         aws=get_config_output_aws(),
         file_system=get_config_output_file_system(),
-        snowplow=get_config_output_snowplow()
+        snowplow=get_config_output_snowplow(),
+        buffer=get_config_output_buffer(),
+        mandatory=mandatory,
+        timeout_seconds=timeout_seconds,
+        threads=threads,
+        background_queue_size=background_queue_size,
+        mandatory_queue_size=mandatory_queue_size
     )
     if not output_config.postgres \
             and not output_config.aws \
@@ -210,8 +457,8 @@ def get_config_event_schema() -> EventSchema:
     return get_event_schema(SCHEMA_EXTENSION_DIRECTORY)
 
 
-def get_config_event_list_schema() -> EventListSchema:
-    return get_event_list_schema()
+def get_config_event_list_schema(event_schema: EventSchema) -> EventListSchema:
+    return get_event_list_schema(event_schema)
 
 
 def get_config_timestamp_validation() -> TimestampValidationConfig:
@@ -226,13 +473,23 @@ _CACHED_COLLECTOR_CONFIG: Optional[CollectorConfig] = None
 def init_collector_config():
     """ Load collector config into cache. """
     global _CACHED_COLLECTOR_CONFIG
+    if SCHEMA_VALIDATOR not in SCHEMA_VALIDATORS:
+        raise ValueError(f'Invalid SCHEMA_VALIDATOR: {SCHEMA_VALIDATOR}. Must be one of {SCHEMA_VALIDATORS}')
+    event_schema = get_config_event_schema()
+    if SCHEMA_VALIDATOR == 'generated':
+        # generate the validators now, instead of when the first request comes in
+        compile_validators(event_schema)
+    event_list_schema = get_config_event_list_schema(event_schema)
     _CACHED_COLLECTOR_CONFIG = CollectorConfig(
         async_mode=_ASYNC_MODE,
         cookie=get_config_cookie(),
         error_reporting=SCHEMA_VALIDATION_ERROR_REPORTING,
         output=get_config_output(),
-        event_schema=get_config_event_schema(),
-        event_list_schema=get_config_event_list_schema()
+        event_schema=event_schema,
+        event_list_schema=event_list_schema,
+        event_list_validator=compile_json_schema_validator(event_list_schema),
+        metrics_enabled=_METRICS_ENABLED,
+        schema_validator=SCHEMA_VALIDATOR
     )
 
 
@@ -1,11 +1,22 @@
 """
 Copyright 2021 Objectiv B.V.
 """
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Tuple, Iterator, Any
+
 import psycopg2
 from psycopg2 import extras
-from psycopg2.extensions import ISOLATION_LEVEL_READ_COMMITTED
+from psycopg2.extensions import ISOLATION_LEVEL_READ_COMMITTED, TRANSACTION_STATUS_IDLE, \
+    TRANSACTION_STATUS_UNKNOWN
 
 from objectiv_backend.common.config import PostgresConfig
+from objectiv_backend.common.json_codec import json_loads
+from objectiv_backend.common.per_process import PerProcess
+
+# Maximum time to wait for a connection, if all connections of the pool are in use
+POOL_TIMEOUT_SECONDS = 5
 
 
 def get_db_connection(pg_config: PostgresConfig):
@@ -13,7 +24,8 @@ def get_db_connection(pg_config: PostgresConfig):
     Give a psycopg2 connection with:
      * read committed isolation level
      * 5 second lock_timeout
-     * uuids enabled.
+     * uuids enabled
+     * json values decoded with json_loads().
     """
     conn = psycopg2.connect(user=pg_config.user,
                             password=pg_config.password,
@@ -29,5 +41,150 @@ def get_db_connection(pg_config: PostgresConfig):
     # than 5 seconds, something is wrong.
     with conn.cursor() as cursor:
         cursor.execute("set lock_timeout='5s';")
+    # make sure the `set` statement above doesn't leave an open transaction
+    conn.commit()
     extras.register_uuid()
+    extras.register_default_json(conn, loads=json_loads)
+    extras.register_default_jsonb(conn, loads=json_loads)
     return conn
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of database connections. Connections are created with get_db_connection(), so
+    the session settings are applied once per connection, instead of once per use.
+
+    Connections that are returned to the pool are checked: broken connections are discarded, and
+    connections with an open transaction are rolled back. Connections that have been idle for longer
+    than pg_config.pool_health_check_seconds are checked with a trivial query before being handed out
+    again. Discarded connections are replaced by new connections when needed.
+    """
+
+    def __init__(self, pg_config: PostgresConfig):
+        self.pg_config = pg_config
+        self._condition = threading.Condition()
+        # idle connections, with the time at which they were returned to the pool
+        self._idle: List[Tuple[Any, float]] = []
+        # number of open connections, both idle and in use
+        self._size = 0
+        for _ in range(pg_config.pool_min_size):
+            self._idle.append((get_db_connection(pg_config), time.time()))
+            self._size += 1
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """
+        Context manager that gives a connection from the pool, and returns it to the pool afterwards.
+        Does not do any transaction management; use `with connection:` for that.
+
+        :raise Exception: if no connection becomes available within POOL_TIMEOUT_SECONDS
+        """
+        conn = self._acquire()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # The connection might be broken. Don't risk handing it out again, a new connection will be
+            # created if needed.
+            discard = True
+            raise
+        finally:
+            self._release(conn, discard=discard)
+
+    def close_all(self):
+        """ Close all idle connections. Connections that are in use are closed when they are returned. """
+        with self._condition:
+            for conn, _ in self._idle:
+                self._close(conn)
+            self._idle = []
+
+    def _acquire(self):
+        deadline = time.time() + POOL_TIMEOUT_SECONDS
+        while True:
+            with self._condition:
+                idle = self._idle.pop() if self._idle else None
+                if idle is None:
+                    if self._size < self.pg_config.pool_max_size:
+                        # reserve a spot for a new connection
+                        self._size += 1
+                    else:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise Exception(f'Timeout: no database connection available in pool, '
+                                            f'max pool size: {self.pg_config.pool_max_size}')
+                        self._condition.wait(timeout=remaining)
+                        continue
+            # The health check and connecting are done without holding the lock, as they can be slow
+            if idle is None:
+                return self._new_connection()
+            conn, returned_at = idle
+            if self._is_healthy(conn, returned_at):
+                return conn
+            with self._condition:
+                self._close(conn)
+
+    def _new_connection(self):
+        """ Create a new connection for a spot that was already reserved in self._size """
+        try:
+            return get_db_connection(self.pg_config)
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+    def _release(self, conn, discard: bool):
+        if not discard and not conn.closed:
+            status = conn.info.transaction_status
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+        with self._condition:
+            if discard or conn.closed:
+                self._close(conn)
+            else:
+                self._idle.append((conn, time.time()))
+            self._condition.notify()
+
+    def _close(self, conn):
+        """ Close the connection and free up its spot. Must be called while holding self._condition """
+        self._size -= 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _is_healthy(self, conn, returned_at: float) -> bool:
+        if conn.closed:
+            return False
+        if time.time() - returned_at < self.pg_config.pool_health_check_seconds:
+            return True
+        try:
+            with conn:
+                with conn.cursor() as cursor:
+                    cursor.execute('select 1;')
+            return True
+        except psycopg2.Error:
+            return False
+
+
+_POOL: PerProcess[ConnectionPool] = PerProcess(ConnectionPool, close=ConnectionPool.close_all)
+
+
+def get_connection_pool(pg_config: PostgresConfig) -> ConnectionPool:
+    """ Give the process-wide connection pool. The pool is created on first use. """
+    return _POOL.get(pg_config)
+
+
+@contextmanager
+def get_pooled_db_connection(pg_config: PostgresConfig) -> Iterator[Any]:
+    """
+    Context manager that gives a connection from the process-wide connection pool. The connection has the
+    same settings as a connection from get_db_connection(), but must not be closed by the caller.
+    """
+    with get_connection_pool(pg_config).connection() as connection:
+        yield connection
@@ -7,30 +7,37 @@ from objectiv_backend.common.types import EventData, ContextData, ContextType
 from objectiv_backend.schema.schema import AbstractGlobalContext
 
 
+def _is_of_type(context: ContextData, context_type: ContextType) -> bool:
+    if context.get('_type') == context_type:
+        return True
+    parent_types = context.get('_types')
+    return bool(parent_types) and context_type in cast(List[ContextType], parent_types)
+
+
 def get_optional_context(event: EventData, context_type: ContextType) -> Optional[ContextData]:
     """ Get the first Context of the given type, or None if there is none. """
-    result = get_contexts(event=event, context_type=context_type)
-    if not result:
-        return None
-    return result[0]
+    for contexts in (get_global_contexts(event), get_location_stack(event)):
+        for context in contexts:
+            if _is_of_type(context, context_type):
+                return context
+    return None
 
 
 def get_context(event: EventData, context_type: ContextType) -> ContextData:
     """ Get the first Context of the given type. """
-    result = get_contexts(event=event, context_type=context_type)
-    if not result:
+    result = get_optional_context(event=event, context_type=context_type)
+    if result is None:
         raise ValueError(f'context-type {context_type} not present in event. data: {event}')
-    return result[0]
+    return result
 
 
 def get_contexts(event: EventData, context_type: ContextType) -> List[ContextData]:
     """ Given all the Contexts of the given type."""
-    contexts = get_global_contexts(event) + get_location_stack(event)
     result = []
-    for context in contexts:
-        _contexts_types = cast(List[ContextType], context.get("_types", []))
-        if context.get("_type") == context_type or context_type in _contexts_types:
-            result.append(context)
+    for contexts in (get_global_contexts(event), get_location_stack(event)):
+        for context in contexts:
+            if _is_of_type(context, context_type):
+                result.append(context)
     return result
 
 
@@ -48,4 +55,3 @@ def add_global_context_to_event(event: EventData, context: AbstractGlobalContext
     """ Add the global context to the event. Returns the modified event """
     event['global_contexts'].append(context)
     return event
-
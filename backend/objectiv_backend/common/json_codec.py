@@ -0,0 +1,113 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+JSON encoding and decoding for the ingest path of the collector and workers.
+
+If the optional orjson package is installed, it is used as backend. Otherwise the json module of the
+standard library is used. Both backends give the same output:
+ * compact separators, and non-ascii characters are not escaped
+ * uuid.UUID values are encoded as their string representation
+ * datetime and date values are encoded in ISO 8601 format
+ * named tuples are encoded as lists
+
+Both backends also decode the same: NaN, Infinity and lone surrogates (e.g. "\\ud800") are not accepted,
+as orjson doesn't support them. None of these can be stored in Postgres, or encoded as utf-8, anyway.
+"""
+import json
+import re
+import uuid
+from datetime import date, datetime
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
+# Name of the backend that is used, either 'orjson' or 'json'
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def _default(obj: Any) -> Any:
+    """ Encode the types that are not natively supported by both backends. """
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, tuple):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def _stdlib_dumps(obj: Any) -> str:
+    return json.dumps(obj, default=_default, separators=(',', ':'), ensure_ascii=False)
+
+
+# Escaped or raw surrogates. Only if these are found, the decoded value is checked for lone surrogates
+_SURROGATE_REGEX = re.compile('\\\\u[dD][89a-fA-F]|[\ud800-\udfff]')
+
+
+def _reject_constant(name: str):
+    raise json.JSONDecodeError(f'{name} is not valid JSON', name, 0)
+
+
+def _check_surrogates(value: Any):
+    """ Raise UnicodeEncodeError if a string in value, or a key of a dict in value, has a lone surrogate. """
+    if isinstance(value, str):
+        value.encode('utf-8')
+    elif isinstance(value, list):
+        for item in value:
+            _check_surrogates(item)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            key.encode('utf-8')
+            _check_surrogates(item)
+
+
+def _stdlib_loads(data: Union[str, bytes]) -> Any:
+    if isinstance(data, (bytes, bytearray)):
+        try:
+            # Like orjson, only accept utf-8. Unlike json.loads(), this rejects encoded surrogates.
+            data = data.decode('utf-8')
+        except UnicodeDecodeError as exc:
+            raise json.JSONDecodeError(f'Invalid utf-8: {exc.reason}', '', exc.start)
+    value = json.loads(data, parse_constant=_reject_constant)
+    if _SURROGATE_REGEX.search(data):
+        try:
+            _check_surrogates(value)
+        except UnicodeEncodeError as exc:
+            raise json.JSONDecodeError('Lone surrogate in string', data, 0) from exc
+    return value
+
+
+def _orjson_dumps(obj: Any) -> str:
+    # orjson natively encodes UUIDs and datetimes the same way as _default(), but it does not support
+    # named tuples or integers that don't fit in 64 bits; those end up at _default() or the fallback.
+    try:
+        return orjson.dumps(obj, default=_default).decode('utf-8')
+    except TypeError:
+        return _stdlib_dumps(obj)
+
+
+def _orjson_loads(data: Union[str, bytes]) -> Any:
+    return orjson.loads(data)
+
+
+def json_dumps(obj: Any) -> str:
+    """
+    Encode obj as a JSON string.
+    :raise TypeError: if obj contains values that cannot be encoded
+    """
+    if orjson is not None:
+        return _orjson_dumps(obj)
+    return _stdlib_dumps(obj)
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    """
+    Decode a JSON string or utf-8 encoded bytes.
+    :raise ValueError: if data is not valid JSON. This is a json.JSONDecodeError for both backends.
+    """
+    if orjson is not None:
+        return _orjson_loads(data)
+    return _stdlib_loads(data)
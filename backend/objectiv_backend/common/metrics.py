@@ -0,0 +1,299 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Counters, gauges, and latency histograms of the collector and workers, in the Prometheus text format.
+
+The collector serves the metrics on /metrics (see METRICS_ENABLED), the workers on WORKER_METRICS_PORT.
+Metrics are kept per process, and every sample has a pid label. With multiple collector processes (e.g.
+gunicorn WORKERS > 1), a scrape is handled by one of the processes, so a scrape doesn't give the totals.
+Use e.g. sum without(pid) (rate(...)) to aggregate the processes.
+
+Recording a value takes a lock and a few dict lookups, so metrics can be recorded on the hot path.
+"""
+import bisect
+import os
+import threading
+import time
+import traceback
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Buckets of latency histograms, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Buckets of histograms of the number of events in a request or batch
+EVENT_COUNT_BUCKETS = (1, 5, 10, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class _Metric(ABC):
+    """ Base class of the metrics. Label values are given as keyword arguments, e.g. stage='parse'. """
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        try:
+            if len(labels) == len(self.label_names):
+                return tuple(str(labels[name]) for name in self.label_names)
+        except KeyError:
+            pass
+        raise ValueError(f'Metric {self.name} has labels {self.label_names}, got {tuple(labels)}')
+
+    def render(self, pid: str) -> List[str]:
+        """ Give the lines of this metric, in the Prometheus text format. """
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for suffix, label_values, extra_labels, value in self._samples():
+            names = self.label_names + ('pid', ) + tuple(name for name, _ in extra_labels)
+            values = label_values + (pid, ) + tuple(value for _, value in extra_labels)
+            lines.append(f'{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}')
+        return lines
+
+    @abstractmethod
+    def _samples(self) -> Iterator[Tuple[str, LabelValues, Tuple[Tuple[str, str], ...], float]]:
+        """ Give tuples: name suffix, label values, extra labels as (name, value) tuples, and value. """
+
+
+class _ValueMetric(_Metric):
+    """ Metric with a single value per combination of label values. """
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def get(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._label_values(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield '', label_values, (), value
+
+
+class Counter(_ValueMetric):
+    """ Value that only goes up, e.g. the number of processed events. """
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_ValueMetric):
+    """ Value that can go up and down, e.g. the number of events on a queue. """
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels: str):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """ Distribution of values, e.g. latencies, counted in buckets. """
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: count per bucket (non-cumulative, the last one is +Inf), and the sum
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[index] += 1
+            self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """ Context manager that observes the time spent in the block, in seconds. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get_count(self, **labels: str) -> int:
+        with self._lock:
+            return sum(self._counts.get(self._label_values(labels), []))
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(counts), self._sums[key]) for key, counts in sorted(self._counts.items())]
+        for label_values, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'), ), counts):
+                cumulative += count
+                yield '_bucket', label_values, (('le', _format_value(bound)), ), cumulative
+            yield '_sum', label_values, (), total
+            yield '_count', label_values, (), cumulative
+
+
+class MetricsRegistry:
+    """ Set of metrics that are rendered together. Thread-safe. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+        self._collect_hooks: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, label_names)
+        self.register(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        metric = Gauge(name, documentation, label_names)
+        self.register(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, label_names, buckets)
+        self.register(metric)
+        return metric
+
+    def add_collect_hook(self, hook: Callable[[], None]):
+        """
+        Add a function that is called before the metrics are rendered, e.g. to set gauges that are
+        expensive to keep up to date. Hooks are never called concurrently. Errors are printed and ignored.
+        """
+        with self._lock:
+            self._collect_hooks.append(hook)
+
+    def render(self) -> str:
+        """ Give all metrics in the Prometheus text format. """
+        with self._lock:
+            for hook in self._collect_hooks:
+                try:
+                    hook()
+                except Exception:
+                    print('Error collecting metrics:')
+                    traceback.print_exc()
+            metrics = list(self._metrics.values())
+        pid = str(os.getpid())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render(pid))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# ### Collector
+# result: ok, nok_events (some events failed validation), data_error (the request was invalid), or error
+# (e.g. a mandatory output failed)
+REQUESTS = REGISTRY.counter(
+    'objectiv_collector_requests_total', 'Number of handled requests, per result.', ['result'])
+REQUEST_SECONDS = REGISTRY.histogram(
+    'objectiv_collector_request_seconds', 'Time to handle a request.')
+REQUEST_EVENTS = REGISTRY.histogram(
+    'objectiv_collector_request_events', 'Number of events per request.', buckets=EVENT_COUNT_BUCKETS)
+EVENTS = REGISTRY.counter(
+    'objectiv_events_total', 'Number of processed events, per result (ok, nok, or queued in async mode).',
+    ['result'])
+# Stages: parse, structure_validation, enrichment (collector), schema_validation, hydration (collector in
+# sync mode, and the entry worker)
+STAGE_SECONDS = REGISTRY.histogram(
+    'objectiv_stage_seconds', 'Time per processing stage, per request or worker batch.', ['stage'])
+OUTPUT_SECONDS = REGISTRY.histogram(
+    'objectiv_output_seconds', 'Time to write the events of a request to an output, per result.',
+    ['output', 'status'])
+OUTPUT_TIMEOUTS = REGISTRY.counter(
+    'objectiv_output_timeouts_total', 'Number of mandatory outputs that did not finish in time.', ['output'])
+OUTPUT_DROPPED = REGISTRY.counter(
+    'objectiv_output_dropped_total', 'Number of background outputs that were not written, because too many '
+    'background writes were pending.', ['output'])
+SNOWPLOW_MESSAGES = REGISTRY.counter(
+    'objectiv_snowplow_messages_total', 'Number of Pub/Sub messages, per channel and result.',
+    ['channel', 'result'])
+
+# ### Workers
+WORKER_BATCH_EVENTS = REGISTRY.histogram(
+    'objectiv_worker_batch_events', 'Number of events processed per batch.', ['worker'],
+    buckets=EVENT_COUNT_BUCKETS)
+WORKER_BATCH_SECONDS = REGISTRY.histogram(
+    'objectiv_worker_batch_seconds', 'Processing time per batch.', ['worker'])
+WORKER_CURRENT_BATCH_SIZE = REGISTRY.gauge(
+    'objectiv_worker_batch_size', 'Current adaptive batch size.', ['worker'])
+WORKER_LOCK_TIMEOUTS = REGISTRY.counter(
+    'objectiv_worker_lock_timeouts_total', 'Number of batches that hit a lock timeout.', ['worker'])
+# Collector in sync mode, and the finalize and pipeline workers
+DUPLICATE_EVENTS = REGISTRY.counter(
+    'objectiv_duplicate_events_total', 'Number of duplicate events written to nok_data, per detection '
+    '(filter: the in-memory filter of recent event ids, or database).', ['detected_by'])
+QUEUE_DEPTH = REGISTRY.gauge(
+    'objectiv_queue_depth', 'Number of events on a queue, at the time of the scrape.', ['queue'])
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Don't log every scrape
+        pass
+
+
+def start_metrics_server(port: int, host: str = '127.0.0.1') -> HTTPServer:
+    """
+    Serve the metrics of this process on http://{host}:{port}/metrics, in a background thread. Used by
+    the workers, the collector serves /metrics itself.
+    """
+    server = HTTPServer((host, port), _Handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    print(f'Serving metrics on {host}:{port}')
+    return server
@@ -0,0 +1,68 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Objects that are shared by all threads of a process, but not with forked processes.
+
+Connection pools, clients with open connections, and buffers with a background thread cannot be used by a
+forked process: the connections would be shared with the parent process, and the threads don't run in the
+fork. A PerProcess tracks the pid of the process that created its object, so that a forked process creates
+its own object instead.
+"""
+import atexit
+import os
+import threading
+from typing import Any, Callable, Generic, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+
+
+class PerProcess(Generic[T]):
+    """
+    Holds a single object per process, that is created on first use. Thread-safe.
+
+    If close is given, it is called with the object when the process exits, but only in the process that
+    created the object. So a forked process never closes, and e.g. flushes, the object of its parent.
+    """
+
+    def __init__(self, factory: Callable[..., T], close: Optional[Callable[[T], Any]] = None):
+        """
+        :param factory: function that creates the object, is called with the arguments of get()
+        :param close: function that releases the object, called at exit, and when the object is replaced
+        """
+        self._factory = factory
+        self._close = close
+        self._lock = threading.Lock()
+        self._value: Optional[T] = None
+        self._args: Tuple[Any, ...] = ()
+        self._pid: Optional[int] = None
+        if close is not None:
+            atexit.register(self._close_at_exit)
+
+    def get(self, *args: Any) -> T:
+        """
+        Give the object of this process. It is created with factory(*args) on first use in the process, and
+        is replaced if get() is called with arguments that are not equal to those of the first call, e.g.
+        after the configuration was changed in a test.
+        """
+        replaced: Optional[T] = None
+        with self._lock:
+            if self._pid != os.getpid() or self._args != args:
+                if self._pid == os.getpid():
+                    replaced = self._value
+                self._value = self._factory(*args)
+                self._args = args
+                self._pid = os.getpid()
+            value = self._value
+        if replaced is not None and self._close is not None:
+            self._close(replaced)
+        return value  # type: ignore
+
+    def _close_at_exit(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            value = self._value
+            self._value = None
+            self._pid = None
+        if value is not None and self._close is not None:
+            self._close(value)
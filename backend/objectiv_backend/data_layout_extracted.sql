@@ -0,0 +1,47 @@
+-- Changes the data table to the 'extracted' layout (POSTGRES_DATA_LAYOUT=extracted):
+--  * value is stored as jsonb instead of json
+--  * event_type, stack_event_types, global_contexts and location_stack are stored in separate columns,
+--    which are filled in by the workers when an event is inserted.
+-- Queries can use these columns directly, instead of extracting them from the json for every row.
+--
+-- This can be run on a newly created database, as well as on an existing database. In the latter case the
+-- extracted columns are filled for the existing rows. Running it multiple times is harmless.
+begin;
+
+do $$
+declare
+    view_definition text;
+begin
+    if (select data_type from information_schema.columns
+        where table_schema = current_schema() and table_name = 'data' and column_name = 'value') = 'json'
+    then
+        -- The type of a column can only be changed if no view depends on it. So we temporarily drop the
+        -- view, and recreate it with the same definition afterwards.
+        view_definition := pg_get_viewdef('data_with_sessions');
+        drop view data_with_sessions;
+        alter table data alter column value type jsonb using value::jsonb;
+        execute 'create view data_with_sessions as ' || view_definition;
+        grant select on data_with_sessions to obj_reader_role;
+    end if;
+end $$;
+
+alter table data
+    add column if not exists event_type text,
+    add column if not exists stack_event_types jsonb,
+    add column if not exists global_contexts jsonb,
+    add column if not exists location_stack jsonb;
+
+update data
+set event_type = value->>'_type',
+    stack_event_types = value->'_types',
+    global_contexts = value->'global_contexts',
+    location_stack = value->'location_stack'
+where event_type is null;
+
+alter table data
+    alter column event_type set not null,
+    alter column stack_event_types set not null,
+    alter column global_contexts set not null,
+    alter column location_stack set not null;
+
+commit;
@@ -0,0 +1,54 @@
+-- Replaces the data and nok_data tables by tables that are range-partitioned by day
+-- (POSTGRES_DATA_PARTITIONED=true). Partitions are named <table>_pYYYYMMDD, and are created and archived by
+-- the db_partitions tool. Rows for which no partition exists end up in the default partitions
+-- (data_default and nok_data_default); db_partitions moves them to the right partition when it creates it.
+--
+-- A partitioned table can only have a unique constraint that includes the partition key, so the primary key
+-- of the data table becomes (event_id, day). Duplicate events with a different day are detected by
+-- insert_events_into_data().
+--
+-- Existing tables can only be replaced if they are empty. Running this multiple times is harmless. The
+-- columns are copied from the existing tables, so this works with all data layouts.
+begin;
+
+do $$
+declare
+    view_definition text;
+begin
+    if (select relkind from pg_class where oid = 'data'::regclass) = 'p' then
+        raise notice 'Table data is already partitioned';
+        return;
+    end if;
+    if exists (select from data) or exists (select from nok_data) then
+        raise exception 'Cannot partition the data and nok_data tables, as they are not empty';
+    end if;
+
+    -- A table can only be dropped if no view depends on it. So we temporarily drop the view, and recreate it
+    -- with the same definition afterwards.
+    view_definition := pg_get_viewdef('data_with_sessions');
+    drop view data_with_sessions;
+
+    create table data_partitioned (like data including defaults including constraints)
+        partition by range (day);
+    drop table data;
+    alter table data_partitioned rename to data;
+    alter table data add constraint data_pkey primary key (event_id, day);
+    -- Within a day-partition this index is of little use, but it keeps queries on the default partition fast
+    create index on data(day);
+    create table data_default partition of data default;
+
+    create table nok_data_partitioned (like nok_data including defaults including constraints)
+        partition by range (day);
+    drop table nok_data;
+    alter table nok_data_partitioned rename to nok_data;
+    create table nok_data_default partition of nok_data default;
+
+    execute 'create view data_with_sessions as ' || view_definition;
+
+    -- same permissions as in create_tables.sql
+    grant select, insert on data, nok_data to obj_collector_role;
+    grant insert on data, nok_data to obj_worker_role;
+    grant select on data, data_with_sessions to obj_reader_role;
+end $$;
+
+commit;
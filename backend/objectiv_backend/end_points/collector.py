@@ -1,24 +1,30 @@
-import json
+import copy
 import urllib.parse
-from datetime import datetime
 
 import flask
 import time
+from functools import lru_cache
 from urllib.parse import urlparse, parse_qs
-from typing import List
+from typing import List, Dict, Callable, Tuple, Optional
 
 from flask import Response, Request
 
 from objectiv_backend.common.config import get_collector_config
 from objectiv_backend.common.types import EventData, EventDataList, EventList
-from objectiv_backend.common.db import get_db_connection
-from objectiv_backend.common.event_utils import add_global_context_to_event, get_contexts
+from objectiv_backend.common.db import get_pooled_db_connection
+from objectiv_backend.common.json_codec import json_dumps, json_loads
+from objectiv_backend.common.metrics import EVENTS, REQUEST_EVENTS, REQUEST_SECONDS, REQUESTS, STAGE_SECONDS
+from objectiv_backend.common.event_utils import add_global_context_to_event, get_optional_context
 from objectiv_backend.end_points.common import get_json_response, get_cookie_id
-from objectiv_backend.end_points.extra_output import events_to_json, write_data_to_fs_if_configured, \
-    write_data_to_s3_if_configured, write_data_to_snowplow_if_configured
+from objectiv_backend.end_points.extra_output import write_events_to_fs_if_configured, \
+    write_events_to_s3_if_configured, write_data_to_snowplow_if_configured
+from objectiv_backend.end_points.group_commit import write_events_group_commit, TABLE_DATA, TABLE_NOK_DATA, \
+    TABLE_QUEUE_ENTRY
+from objectiv_backend.end_points.output_dispatch import dispatch_outputs, OutputTiming
 from objectiv_backend.schema.validate_events import validate_structure_event_list, EventError
 from objectiv_backend.workers.pg_queues import PostgresQueues, ProcessingStage
 from objectiv_backend.workers.pg_storage import insert_events_into_nok_data
+from objectiv_backend.workers.recent_event_ids import get_recent_event_ids
 from objectiv_backend.workers.worker_entry import process_events_entry
 from objectiv_backend.workers.worker_finalize import insert_events_into_data
 
@@ -28,11 +34,41 @@ from objectiv_backend.schema.schema import HttpContext, CookieIdContext, Marketi
 DATA_MAX_SIZE_BYTES = 1_000_000
 DATA_MAX_EVENT_COUNT = 1_000
 
+# Number of urls for which the MarketingContexts are cached, see _get_marketing_context_fields()
+MARKETING_CONTEXT_CACHE_SIZE = 1024
+
+# for now, we only support utm, but other mappings are possible
+# all mappings that result in a valid MarketingContext will be added
+_MARKETING_MAPPINGS = {
+    'utm': {
+        'source': 'utm_source',
+        'medium': 'utm_medium',
+        'campaign': 'utm_campaign',
+        'term': 'utm_term',
+        'content': 'utm_content'
+    }
+}
+
 
 def collect() -> Response:
     """
     Endpoint that accepts event data from the tracker and stores it for further processing.
     """
+    start = time.perf_counter()
+    result = 'error'
+    try:
+        response, result = _collect()
+        return response
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - start)
+        REQUESTS.inc(result=result)
+
+
+def _collect() -> Tuple[Response, str]:
+    """
+    Handle a request, see collect().
+    :return: tuple: the response, and the result for the REQUESTS metric
+    """
     current_millis = round(time.time() * 1000)
     try:
         event_data: EventList = _get_event_data(flask.request)
@@ -40,21 +76,30 @@ def collect() -> Response:
         transport_time: int = event_data['transport_time']
     except ValueError as exc:
         print(f'Data problem: {exc}')  # todo: real error logging
-        return _get_collector_response(error_count=1, event_count=-1, data_error=exc.__str__())
+        return _get_collector_response(error_count=1, event_count=-1, data_error=exc.__str__()), 'data_error'
+    REQUEST_EVENTS.observe(len(events))
 
     # Do all the enrichment steps that can only be done in this phase
-    add_enriched_contexts(events)
+    with STAGE_SECONDS.time(stage='enrichment'):
+        add_enriched_contexts(events)
 
-    set_time_in_events(events, current_millis, transport_time)
+        set_time_in_events(events, current_millis, transport_time)
 
     if not get_collector_config().async_mode:
         ok_events, nok_events, event_errors = process_events_entry(events=events, current_millis=current_millis)
-        print(f'ok_events: {len(ok_events)}, nok_events: {len(nok_events)}')
-        write_sync_events(ok_events=ok_events, nok_events=nok_events, event_errors=event_errors)
-        return _get_collector_response(error_count=len(nok_events), event_count=len(events), event_errors=event_errors)
+        timings = write_sync_events(ok_events=ok_events, nok_events=nok_events, event_errors=event_errors)
+        EVENTS.inc(len(ok_events), result='ok')
+        EVENTS.inc(len(nok_events), result='nok')
+        print(f'ok_events: {len(ok_events)}, nok_events: {len(nok_events)}, '
+              f'outputs: {", ".join(str(timing) for timing in timings)}')
+        response = _get_collector_response(
+            error_count=len(nok_events), event_count=len(events), event_errors=event_errors)
+        return response, 'ok' if not nok_events else 'nok_events'
     else:
-        write_async_events(events=events)
-        return _get_collector_response(error_count=0, event_count=len(events))
+        timings = write_async_events(events=events)
+        EVENTS.inc(len(events), result='queued')
+        print(f'events: {len(events)}, outputs: {", ".join(str(timing) for timing in timings)}')
+        return _get_collector_response(error_count=0, event_count=len(events)), 'ok'
 
 
 def _get_event_data(request: Request) -> EventList:
@@ -73,11 +118,12 @@ def _get_event_data(request: Request) -> EventList:
     :param request: Request from which to parse the data
     :return: the parsed data, an EventList (structure as sent by the tracker)
     """
+    start = time.perf_counter()
     post_data = request.data
     if len(post_data) > DATA_MAX_SIZE_BYTES:
         # if it's more than a megabyte, we'll refuse to process
         raise ValueError(f'Data size exceeds limit')
-    event_data: EventList = json.loads(post_data)
+    event_data: EventList = json_loads(post_data)
     if not isinstance(event_data, dict):
         raise ValueError('Parsed post data is not a dict')
     if 'events' not in event_data:
@@ -86,7 +132,9 @@ def _get_event_data(request: Request) -> EventList:
         raise ValueError('events is not a list')
     if len(event_data['events']) > DATA_MAX_EVENT_COUNT:
         raise ValueError('Events exceeds limit')
-    error_info = validate_structure_event_list(event_data=event_data)
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage='parse')
+    with STAGE_SECONDS.time(stage='structure_validation'):
+        error_info = validate_structure_event_list(event_data=event_data)
     if error_info:
         raise ValueError(f'List of Events not structured well: {error_info[0].info}')
 
@@ -107,7 +155,7 @@ def _get_collector_response(
             event_errors = []
 
     status = 200 if error_count == 0 else 400
-    msg = json.dumps({
+    msg = json_dumps({
         "status": f"{status}",
         "error_count": error_count,
         "event_count": event_count,
@@ -121,12 +169,14 @@ def _get_collector_response(
 
 def add_enriched_contexts(events: EventDataList):
     """
-    Enrich the list of events
+    Enrich the list of events. The data that comes from the request is the same for all events, so it's
+    determined once per request.
     """
 
     add_cookie_id_contexts(events)
+    http_context = get_http_context(flask.request)
     for event in events:
-        add_http_context_to_event(event=event, request=flask.request)
+        add_http_context_to_event(event=event, request=flask.request, http_context=http_context)
         add_marketing_context_to_event(event=event)
 
 
@@ -196,7 +246,20 @@ def _get_remote_address(request: Request) -> str:
     return 'unknown'
 
 
-def add_http_context_to_event(event: EventData, request: Request):
+def get_http_context(request: Request) -> HttpContext:
+    """
+    Create an HttpContext based on the data in the request.
+    :param request: original http request
+    """
+    return HttpContext(
+        id='http_context',
+        remote_address=_get_remote_address(request),
+        referrer=request.headers.get('Referer', ''),
+        user_agent=request.headers.get('User-Agent', '')
+    )
+
+
+def add_http_context_to_event(event: EventData, request: Request, http_context: Optional[HttpContext] = None):
     """
         Create or enrich an HttpContext based on the data in the current request. If an HttpContext is already
         present, the remote address is added to the existing context. Otherwise, a new context is created and
@@ -204,26 +267,21 @@ def add_http_context_to_event(event: EventData, request: Request):
 
         :param event - event to add context to
         :param request - request object, used to extract extra context from.
+        :param http_context - HttpContext of the request, as given by get_http_context(). If not set, it's
+            created from the request. Every event gets its own copy of the context.
     """
-
-    remote_address = _get_remote_address(request)
+    if http_context is None:
+        http_context = get_http_context(request)
 
     # check if there is a pre-existing http_context
     # if so, use that.
-    contexts = get_contexts(event, 'HttpContext')
-    if contexts:
-        tracker_http_context = contexts[0]
-        tracker_http_context['remote_address'] = remote_address
+    tracker_http_context = get_optional_context(event, 'HttpContext')
+    if tracker_http_context:
+        tracker_http_context['remote_address'] = http_context['remote_address']
     else:
-        # if a pre-existing context cannot be found, we create one from scratch
-        http_context = {
-            'id': 'http_context',
-            'remote_address': remote_address,
-            'referrer': request.headers.get('Referer', ''),
-            'user_agent': request.headers.get('User-Agent', '')
-        }
-
-        add_global_context_to_event(event, HttpContext(**http_context))
+        # if a pre-existing context cannot be found, we use the one from the request. The context is copied,
+        # as it's changed per event later on (e.g. hydration adds _types).
+        add_global_context_to_event(event, copy.copy(http_context))
 
 
 def add_marketing_context_to_event(event: EventData) -> None:
@@ -233,31 +291,30 @@ def add_marketing_context_to_event(event: EventData) -> None:
     :param event: EventData
     :return:
     """
-    path_contexts = get_contexts(event, 'PathContext')
+    path_context = get_optional_context(event, 'PathContext')
 
-    if not path_contexts:
+    if not path_context:
         # without a PathContext, we have no query_string
         return
-    else:
-        path_context = path_contexts[0]
 
-    query_string = urlparse(str(path_context.get('id', ''))).query
-    parsed_qs = parse_qs(query_string)
+    for marketing_context_fields in _get_marketing_context_fields(str(path_context.get('id', ''))):
+        add_global_context_to_event(event, MarketingContext(**marketing_context_fields))
 
-    # for now, we only support utm, but other mappings are possible
-    # all mappings that result in a valid MarketingContext will be added
-    mappings = {
-        'utm': {
-            'source': 'utm_source',
-            'medium': 'utm_medium',
-            'campaign': 'utm_campaign',
-            'term': 'utm_term',
-            'content': 'utm_content'
-        }
-    }
 
-    for mapping_type in mappings:
-        mapping = mappings[mapping_type]
+@lru_cache(maxsize=MARKETING_CONTEXT_CACHE_SIZE)
+def _get_marketing_context_fields(url: str) -> Tuple[Dict[str, str], ...]:
+    """
+    Give the fields of the MarketingContexts that can be generated from the query string of the url.
+    The results are cached, as the events in a request, and of a visitor, mostly have the same url. Don't
+    modify the returned dicts.
+    """
+    query_string = urlparse(url).query
+    if not query_string:
+        return ()
+    parsed_qs = parse_qs(query_string)
+
+    result = []
+    for mapping_type, mapping in _MARKETING_MAPPINGS.items():
         marketing_context_fields = {}
         for field, mapped_field in mapping.items():
 
@@ -273,71 +330,100 @@ def add_marketing_context_to_event(event: EventData) -> None:
         if len(marketing_context_fields) > 1:
             # if no fields are set (other than id), no point in trying
             try:
-                add_global_context_to_event(event, MarketingContext(**marketing_context_fields))
+                MarketingContext(**marketing_context_fields)
+                result.append(marketing_context_fields)
             except TypeError as e:
                 # couldn't create a marketing context for this mapping, no problem, as this is not a mandatory context
                 #
                 # This way, the MarketingContext class decides whether sufficient / appropriate arguments are supplied
                 # to create a valid instance (that adheres to the schema), no need to implement that logic here.
                 pass
+    return tuple(result)
 
 
-def write_sync_events(ok_events: EventDataList, nok_events: EventDataList, event_errors: List[EventError] = None):
+def write_sync_events(ok_events: EventDataList,
+                      nok_events: EventDataList,
+                      event_errors: List[EventError] = None) -> List[OutputTiming]:
     """
     Write the events to the following sinks, if configured:
         * postgres
-        * aws
+        * snowplow
         * file system
+        * aws
+    The sinks are written concurrently, see dispatch_outputs().
+    :return: the timing of each sink
+    :raise OutputError: if a mandatory sink fails, or does not finish in time
     """
     output_config = get_collector_config().output
-    # todo: add exception handling. if one output fails, continue to next if configured.
-    if output_config.postgres:
-        connection = get_db_connection(output_config.postgres)
-        try:
-            with connection:
-                insert_events_into_data(connection, events=ok_events)
-                insert_events_into_nok_data(connection, events=nok_events)
-        finally:
-            connection.close()
+    writers: Dict[str, Callable[[], None]] = {}
+    pg_config = output_config.postgres
+    if pg_config and pg_config.group_commit != 'off':
+        writers['postgres'] = lambda: write_events_group_commit(
+            pg_config, {TABLE_DATA: ok_events, TABLE_NOK_DATA: nok_events})
+    elif pg_config:
+        def write_postgres():
+            recent_event_ids = get_recent_event_ids()
+            with get_pooled_db_connection(pg_config) as connection:
+                with connection:
+                    inserted_event_ids = insert_events_into_data(
+                        connection, events=ok_events, recent_event_ids=recent_event_ids)
+                    insert_events_into_nok_data(connection, events=nok_events)
+                # only add the events to the filter once they are committed
+                recent_event_ids.add(inserted_event_ids)
+        writers['postgres'] = write_postgres
 
     if output_config.snowplow:
-        write_data_to_snowplow_if_configured(events=ok_events, channel='good')
-        write_data_to_snowplow_if_configured(events=nok_events, channel='bad', event_errors=event_errors)
+        def write_snowplow():
+            write_data_to_snowplow_if_configured(events=ok_events, channel='good')
+            write_data_to_snowplow_if_configured(events=nok_events, channel='bad', event_errors=event_errors)
+        writers['snowplow'] = write_snowplow
 
-    if not output_config.file_system and not output_config.aws:
-        return
-    for prefix, events in ('OK', ok_events), ('NOK', nok_events):
-        if events:
-            data = events_to_json(events)
-            moment = datetime.utcnow()
-            write_data_to_fs_if_configured(data=data, prefix=prefix, moment=moment)
-            write_data_to_s3_if_configured(data=data, prefix=prefix, moment=moment)
+    _add_file_writers(writers, [('OK', ok_events), ('NOK', nok_events)])
+    return dispatch_outputs(writers, output_config)
 
 
-def write_async_events(events: EventDataList):
+def write_async_events(events: EventDataList) -> List[OutputTiming]:
     """
     Write the events to the following sinks, if configured:
         * postgres - To the entry queue
-        * aws - to the 'RAW' prefix
         * file system - to the 'RAW' directory
+        * aws - to the 'RAW' prefix
+    The sinks are written concurrently, see dispatch_outputs().
+    :return: the timing of each sink
+    :raise OutputError: if a mandatory sink fails, or does not finish in time
     """
     output_config = get_collector_config().output
-    # todo: add exception handling. if one output fails, continue to next if configured.
-    if output_config.postgres:
-        connection = get_db_connection(output_config.postgres)
-        try:
-            with connection:
-                pg_queue = PostgresQueues(connection=connection)
-                pg_queue.put_events(queue=ProcessingStage.ENTRY, events=events)
-        finally:
-            connection.close()
-
-    if not output_config.file_system and not output_config.aws:
-        return
-    prefix = 'RAW'
-    if events:
-        data = events_to_json(events)
-        moment = datetime.utcnow()
-        write_data_to_fs_if_configured(data=data, prefix=prefix, moment=moment)
-        write_data_to_s3_if_configured(data=data, prefix=prefix, moment=moment)
-
+    writers: Dict[str, Callable[[], None]] = {}
+    pg_config = output_config.postgres
+    if pg_config and pg_config.group_commit != 'off':
+        writers['postgres'] = lambda: write_events_group_commit(pg_config, {TABLE_QUEUE_ENTRY: events})
+    elif pg_config:
+        def write_postgres():
+            with get_pooled_db_connection(pg_config) as connection:
+                with connection:
+                    pg_queue = PostgresQueues(connection=connection)
+                    pg_queue.put_events(queue=ProcessingStage.ENTRY, events=events)
+        writers['postgres'] = write_postgres
+
+    _add_file_writers(writers, [('RAW', events)])
+    return dispatch_outputs(writers, output_config)
+
+
+def _add_file_writers(writers: Dict[str, Callable[[], None]],
+                      prefixed_events: List[Tuple[str, EventDataList]]):
+    """
+    Add writers for the file system and aws sinks to writers, if configured. These sinks buffer the events,
+    see output_buffer.py
+    :param prefixed_events: list of tuples: prefix, events. Nothing is written for empty event lists.
+    """
+    output_config = get_collector_config().output
+    if output_config.file_system:
+        def write_file_system():
+            for prefix, events in prefixed_events:
+                write_events_to_fs_if_configured(events=events, prefix=prefix)
+        writers['file_system'] = write_file_system
+    if output_config.aws:
+        def write_aws():
+            for prefix, events in prefixed_events:
+                write_events_to_s3_if_configured(events=events, prefix=prefix)
+        writers['aws'] = write_aws
@@ -1,77 +1,149 @@
 """
 Copyright 2021 Objectiv B.V.
 
-Functions to write data to S3 and the local filesystem.
+Functions to write data to S3, the local filesystem, and Snowplow.
 
 This is experimental code, and not ready for production use.
 """
-import json
+import os
+import threading
 from datetime import datetime
-from io import BytesIO
-
-from typing import List
+from typing import List, Dict, Any, Optional, Tuple
 
 
 import boto3
-from botocore.exceptions import ClientError
 
-from objectiv_backend.common.config import get_collector_config
+from objectiv_backend.common.config import get_collector_config, AwsOutputConfig, FileSystemOutputConfig
+from objectiv_backend.common.per_process import PerProcess
 from objectiv_backend.common.types import EventDataList
+from objectiv_backend.end_points.output_buffer import OutputBuffer, WriteObject, create_output_buffer, \
+    FileFormat
 from objectiv_backend.schema.validate_events import EventError
 
 
-def events_to_json(events: EventDataList) -> str:
+# Output buffers per output and file format
+_BUFFERS: PerProcess[Dict[Tuple[str, str], OutputBuffer]] = PerProcess(dict)
+_BUFFERS_LOCK = threading.Lock()
+_S3_CLIENT: PerProcess[Any] = PerProcess(
+    lambda aws_config: boto3.client(
+        service_name='s3',
+        region_name=aws_config.region,
+        aws_access_key_id=aws_config.access_key_id,
+        aws_secret_access_key=aws_config.secret_access_key)
+)
+
+# Directory or S3 prefix of the Parquet files
+_PARQUET_DIRECTORY = 'parquet'
+
+
+def get_s3_client(aws_config: AwsOutputConfig) -> Any:
+    """ Give the process-wide boto3 S3 client. """
+    return _S3_CLIENT.get(aws_config)
+
+
+def write_object_to_fs(fs_config: FileSystemOutputConfig, prefix: str, name: str, data: bytes) -> None:
+    """
+    Write data to the file {path}/{prefix}/{name}. The data is written to a temporary file first, so that
+    readers never see a partially written file.
+    """
+    directory = os.path.join(fs_config.path, prefix)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    with open(f'{path}.tmp', 'wb') as of:
+        of.write(data)
+    os.replace(f'{path}.tmp', path)
+
+
+def write_object_to_s3(aws_config: AwsOutputConfig, prefix: str, name: str, moment: datetime, data: bytes,
+                       s3_client: Any = None, datestamp: bool = True) -> None:
+    """
+    Write data to the object {s3_prefix}/{datestamp}/{prefix}/{name} in the configured bucket.
+    :param s3_client: client to use, by default the process-wide client, see get_s3_client()
+    :param datestamp: if False, the object is {s3_prefix}/{prefix}/{name}. Used if the prefix already
+        contains the day.
+    """
+    if s3_client is None:
+        s3_client = get_s3_client(aws_config)
+    if datestamp:
+        object_name = f'{aws_config.s3_prefix}/{moment.strftime("%Y/%m/%d")}/{prefix}/{name}'
+    else:
+        object_name = f'{aws_config.s3_prefix}/{prefix}/{name}'
+    s3_client.put_object(Bucket=aws_config.bucket, Key=object_name, Body=data)
+
+
+def _get_file_format(file_format: str) -> Optional[FileFormat]:
+    buffer_config = get_collector_config().output.buffer
+    if file_format == 'parquet':
+        # only import if needed, avoids having to install pyarrow if it's not used
+        from objectiv_backend.end_points.parquet_output import ParquetFormat
+        return ParquetFormat(compression=buffer_config.compression,
+                             row_group_size=buffer_config.parquet_row_group_size,
+                             max_bytes=buffer_config.parquet_max_bytes)
+    # default: json
+    return None
+
+
+def _get_buffer(output: str, file_format: str, write_object: WriteObject) -> OutputBuffer:
+    buffers = _BUFFERS.get()
+    with _BUFFERS_LOCK:
+        key = (output, file_format)
+        if key not in buffers:
+            buffers[key] = create_output_buffer(write_object=write_object,
+                                                config=get_collector_config().output.buffer,
+                                                file_format=_get_file_format(file_format))
+        return buffers[key]
+
+
+def _append_events(output: str, write_object: WriteObject, events: EventDataList, prefix: str):
     """
-    Convert list of events to a string with on each line a json object representing a single event.
-    Note that the returned string is not a json list; This format makes it suitable as raw input to AWS
-    Athena.
+    Add events to the buffers of output, one per configured file format. Parquet files are written to
+    parquet/{prefix}/day={day}, see parquet_output.py
     """
-    return json.dumps(events)
+    for file_format in get_collector_config().output.buffer.file_formats:
+        output_buffer = _get_buffer(output, file_format, write_object)
+        if file_format == 'parquet':
+            from objectiv_backend.end_points.parquet_output import split_events_by_day
+            for day, day_events in split_events_by_day(events).items():
+                output_buffer.append(f'{_PARQUET_DIRECTORY}/{prefix}/day={day}', day_events)
+        else:
+            output_buffer.append(prefix, events)
 
 
-def write_data_to_fs_if_configured(data: str, prefix: str, moment: datetime) -> None:
+def write_events_to_fs_if_configured(events: EventDataList, prefix: str) -> None:
     """
-    Write data to disk, if file_system output is configured. If file_system output is not configured, then
-    this function returns directly.
-    :param data: data to write
-    :param prefix: directory prefix, added to path after the configured path/ and before /filename.json
-    :param moment: timestamp that the data arrived
+    Add events to the file system output buffers, if file_system output is configured. If file_system
+    output is not configured, then this function returns directly. See output_buffer.py
+    :param events: events to write
+    :param prefix: directory prefix, added to path after the configured path/ and before /filename
+    :raise Exception: if a buffer was full, and writing it failed
     """
     fs_config = get_collector_config().output.file_system
     if not fs_config:
         return
-    timestamp = moment.timestamp()
-    path = f'{fs_config.path}/{prefix}/{timestamp}.json'
-    with open(path, 'w') as of:
-        of.write(data)
+    _append_events(
+        'file_system',
+        lambda prefix_, name, moment, data: write_object_to_fs(fs_config, prefix_, name, data),
+        events=events,
+        prefix=prefix)
 
 
-def write_data_to_s3_if_configured(data: str, prefix: str, moment: datetime) -> None:
+def write_events_to_s3_if_configured(events: EventDataList, prefix: str) -> None:
     """
-    Write data to AWS S3, if S3 output is configured. if aws s3 output is not configured, then this
-    function returns directly.
-    :param data: data to write
+    Add events to the AWS S3 output buffers, if S3 output is configured. If S3 output is not configured,
+    then this function returns directly. See output_buffer.py
+    :param events: events to write
     :param prefix: prefix, included in the keyname after the configured path/ and datestamp/ and
-        before /filename.json
-    :param moment: timestamp that the data arrived
+        before /filename. Parquet files are partitioned by day, and don't get the datestamp.
+    :raise Exception: if a buffer was full, and writing it failed
     """
     aws_config = get_collector_config().output.aws
     if not aws_config:
         return
 
-    timestamp = moment.timestamp()
-    datestamp = moment.strftime('%Y/%m/%d')
-    object_name = f'{aws_config.s3_prefix}/{datestamp}/{prefix}/{timestamp}.json'
-    file_obj = BytesIO(data.encode('utf-8'))
-    s3_client = boto3.client(
-        service_name='s3',
-        region_name=aws_config.region,
-        aws_access_key_id=aws_config.access_key_id,
-        aws_secret_access_key=aws_config.secret_access_key)
-    try:
-        s3_client.upload_fileobj(file_obj, aws_config.bucket, object_name)
-    except ClientError as e:
-        print(f'Error uploading to s3: {e} ')
+    def write_object(prefix_: str, name: str, moment: datetime, data: bytes):
+        is_parquet = prefix_.startswith(f'{_PARQUET_DIRECTORY}/')
+        write_object_to_s3(aws_config, prefix_, name, moment, data, datestamp=not is_parquet)
+    _append_events('aws', write_object, events=events, prefix=prefix)
 
 
 def write_data_to_snowplow_if_configured(events: EventDataList, channel: str = 'good', event_errors: List[EventError] = None) -> None:
@@ -0,0 +1,187 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Group commit for the collector (POSTGRES_GROUP_COMMIT).
+
+Without group commit every request writes its events to Postgres in its own transaction, which typically
+contains only a few events. With group commit, requests add their events to a process-wide buffer. A
+background thread writes the buffered events of many requests in a single transaction, once enough events
+are buffered or the oldest events have waited long enough, whichever comes first. This reduces the number
+of commits, and gives insert_events_into_data() larger batches to work with.
+
+Group commit only combines requests that are handled concurrently by the same process. So it helps with
+a threaded server (e.g. gunicorn with THREADS > 1), or in 'no_wait' mode.
+"""
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from objectiv_backend.common.config import PostgresConfig
+from objectiv_backend.common.db import get_pooled_db_connection
+from objectiv_backend.common.per_process import PerProcess
+from objectiv_backend.common.types import EventDataList
+from objectiv_backend.workers.pg_queues import PostgresQueues, ProcessingStage
+from objectiv_backend.workers.pg_storage import insert_events_into_data, insert_events_into_nok_data
+from objectiv_backend.workers.recent_event_ids import get_recent_event_ids
+
+# Maximum time to wait for space in the buffer, if the buffer is full
+BUFFER_TIMEOUT_SECONDS = 5
+
+# Tables to which events can be written through the buffer
+TABLE_DATA = 'data'
+TABLE_NOK_DATA = 'nok_data'
+TABLE_QUEUE_ENTRY = 'queue_entry'
+
+
+class GroupCommitBuffer:
+    """
+    Thread-safe buffer that collects events per table, and writes them with a background thread.
+
+    Every call to add() gives a Future, that is resolved once the added events are committed, or that
+    gives the exception if writing failed. The memory use is bounded: add() blocks if the buffer already
+    contains max_buffered_events events.
+    """
+
+    def __init__(self,
+                 write: Callable[[Dict[str, EventDataList]], None],
+                 max_events: int,
+                 max_delay_seconds: float,
+                 max_buffered_events: int):
+        """
+        :param write: function that writes a dict with per table a list of events in one transaction
+        :param max_events: write once this number of events is buffered
+        :param max_delay_seconds: write once the oldest buffered events have waited this long
+        :param max_buffered_events: maximum number of buffered events
+        """
+        self._write = write
+        self.max_events = max_events
+        self.max_delay_seconds = max_delay_seconds
+        self.max_buffered_events = max_buffered_events
+        self._condition = threading.Condition()
+        self._pending: List[Tuple[Dict[str, EventDataList], Future]] = []
+        self._pending_count = 0
+        # time at which the oldest pending events were added
+        self._oldest: Optional[float] = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+        self._thread.start()
+
+    def add(self, events_per_table: Dict[str, EventDataList]) -> Future:
+        """
+        Add events to the buffer.
+        :param events_per_table: dict with per table a list of events, see the TABLE_ constants
+        :return: Future that is resolved once the events are committed
+        :raise Exception: if the buffer is closed, or remains full for BUFFER_TIMEOUT_SECONDS
+        """
+        count = sum(len(events) for events in events_per_table.values())
+        deadline = time.monotonic() + BUFFER_TIMEOUT_SECONDS
+        with self._condition:
+            # An empty buffer always accepts the events, even if there are more than max_buffered_events
+            while self._pending_count and self._pending_count + count > self.max_buffered_events:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._closed:
+                    break
+                self._condition.wait(timeout=remaining)
+            if self._closed:
+                raise Exception('Group commit buffer is closed')
+            if self._pending_count and self._pending_count + count > self.max_buffered_events:
+                raise Exception(f'Timeout: group commit buffer is full, '
+                                f'max buffered events: {self.max_buffered_events}')
+            future: Future = Future()
+            self._pending.append((events_per_table, future))
+            self._pending_count += count
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._condition.notify_all()
+        return future
+
+    def close(self):
+        """ Write all buffered events, and stop the background thread. """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and self._pending_count < self.max_events:
+                    if self._oldest is None:
+                        self._condition.wait()
+                        continue
+                    remaining = self._oldest + self.max_delay_seconds - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(timeout=remaining)
+                if self._closed and not self._pending:
+                    return
+                pending = self._pending
+                self._pending = []
+                self._pending_count = 0
+                self._oldest = None
+                # wake up requests that are waiting for space in the buffer
+                self._condition.notify_all()
+            self._flush(pending)
+
+    def _flush(self, pending: List[Tuple[Dict[str, EventDataList], Future]]):
+        events_per_table: Dict[str, EventDataList] = {}
+        for request_events, _ in pending:
+            for table, events in request_events.items():
+                events_per_table.setdefault(table, []).extend(events)
+        try:
+            self._write(events_per_table)
+        except Exception as exc:
+            count = sum(len(events) for events in events_per_table.values())
+            print(f'Group commit of {count} events from {len(pending)} requests failed:')
+            traceback.print_exc()
+            for _, future in pending:
+                future.set_exception(exc)
+        else:
+            for _, future in pending:
+                future.set_result(None)
+
+
+def write_events_per_table(pg_config: PostgresConfig, events_per_table: Dict[str, EventDataList]):
+    """ Write events to the data, nok_data, and queue_entry tables, in a single transaction. """
+    recent_event_ids = get_recent_event_ids()
+    with get_pooled_db_connection(pg_config) as connection:
+        with connection:
+            inserted_event_ids = insert_events_into_data(
+                connection, events=events_per_table.get(TABLE_DATA, []), recent_event_ids=recent_event_ids)
+            insert_events_into_nok_data(connection, events=events_per_table.get(TABLE_NOK_DATA, []))
+            PostgresQueues(connection=connection).put_events(
+                queue=ProcessingStage.ENTRY, events=events_per_table.get(TABLE_QUEUE_ENTRY, []))
+        # only add the events to the filter once they are committed
+        recent_event_ids.add(inserted_event_ids)
+
+
+_BUFFER: PerProcess[GroupCommitBuffer] = PerProcess(
+    lambda pg_config: GroupCommitBuffer(
+        write=lambda events_per_table: write_events_per_table(pg_config, events_per_table),
+        max_events=pg_config.group_commit_max_events,
+        max_delay_seconds=pg_config.group_commit_max_delay_ms / 1000,
+        max_buffered_events=pg_config.group_commit_max_buffered_events
+    ),
+    close=GroupCommitBuffer.close
+)
+
+
+def get_group_commit_buffer(pg_config: PostgresConfig) -> GroupCommitBuffer:
+    """
+    Give the process-wide group commit buffer. The buffer is created on first use, and is flushed when the
+    process exits.
+    """
+    return _BUFFER.get(pg_config)
+
+
+def write_events_group_commit(pg_config: PostgresConfig, events_per_table: Dict[str, EventDataList]):
+    """
+    Add events to the process-wide group commit buffer. In 'wait' mode, this waits till the events are
+    committed.
+    :raise Exception: if the buffer is full, or in 'wait' mode if writing the events failed
+    """
+    future = get_group_commit_buffer(pg_config).add(events_per_table)
+    if pg_config.group_commit == 'wait':
+        future.result()
@@ -0,0 +1,11 @@
+"""
+Copyright 2021 Objectiv B.V.
+"""
+from flask import Response
+
+from objectiv_backend.common.metrics import REGISTRY, CONTENT_TYPE
+
+
+def metrics() -> Response:
+    """ Endpoint that returns the metrics of this process, in the Prometheus text format. """
+    return Response(REGISTRY.render(), status=200, content_type=CONTENT_TYPE)
@@ -0,0 +1,235 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Buffer for the S3 and filesystem outputs.
+
+Writing a file or object per request gives huge numbers of tiny files, which are slow to query (e.g. with
+Athena) and expensive to store on S3. Instead, the events are appended to a buffer per prefix ('OK', 'NOK',
+'RAW'), as newline-delimited json. The json is compressed as it is appended, so a buffer only holds the
+compressed data in memory. A buffer is written as a single file or object once it holds max_bytes of
+json, or once the oldest event in it has waited max_seconds. Other file formats (e.g. Parquet, see
+parquet_output.py) can be used by giving the buffer a FileFormat.
+
+Buffered events are lost if the process crashes. On a normal exit the buffers are written, by the process
+that created them: a forked process inherits the buffered events of its parent, but doesn't write them.
+"""
+import atexit
+import os
+import threading
+import time
+import traceback
+import uuid
+import zlib
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from objectiv_backend.common.config import OutputBufferConfig
+from objectiv_backend.common.json_codec import json_dumps
+from objectiv_backend.common.types import EventDataList
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # type: ignore
+
+# File extension per compression
+COMPRESSION_EXTENSIONS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+    'none': ''
+}
+
+# Signature of the function that writes a buffer: prefix, name, moment of the oldest event, data
+WriteObject = Callable[[str, str, datetime, bytes], None]
+
+
+class _NoCompression:
+    """ Same interface as the compressors of zlib and zstandard, but doesn't compress. """
+
+    def compress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b''
+
+
+def _make_compressor(compression: str) -> Any:
+    if compression == 'gzip':
+        # wbits=31 gives the gzip format
+        return zlib.compressobj(wbits=31)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise Exception('zstd compression requires the zstandard package')
+        return zstandard.ZstdCompressor().compressobj()
+    return _NoCompression()
+
+
+def events_to_ndjson(events: EventDataList) -> bytes:
+    """ Give the events as newline-delimited json: a json object per line. """
+    return b''.join(json_dumps(event).encode('utf-8') + b'\n' for event in events)
+
+
+class Chunk(ABC):
+    """ Events that will be written as a single file or object. """
+
+    def __init__(self):
+        # number of bytes of uncompressed data appended, as counted by the FileFormat
+        self.size = 0
+        self.started = time.monotonic()
+        self.moment = datetime.utcnow()
+
+    @abstractmethod
+    def append(self, data: Any):
+        """ Append data, as given by FileFormat.encode() """
+
+    @abstractmethod
+    def finish(self) -> bytes:
+        """ Give the content of the file. Can only be called once, nothing can be appended afterwards. """
+
+
+class FileFormat(ABC):
+    """ Format of the files that are written by an OutputBuffer. """
+    extension = ''
+    # Chunk.size at which a file is written. If None, OutputBufferConfig.max_bytes: the size of the json
+    max_bytes: Optional[int] = None
+
+    @abstractmethod
+    def encode(self, events: EventDataList) -> Any:
+        """ Encode events, so they can be appended to a Chunk. This is called without holding any lock. """
+
+    @abstractmethod
+    def new_chunk(self) -> Chunk:
+        """ Give a new, empty, chunk. """
+
+
+class _JsonChunk(Chunk):
+    """ Compressed newline-delimited json. """
+
+    def __init__(self, compression: str):
+        super().__init__()
+        self._compressor = _make_compressor(compression)
+        self._parts: List[bytes] = []
+
+    def append(self, data: bytes):
+        self.size += len(data)
+        compressed = self._compressor.compress(data)
+        if compressed:
+            self._parts.append(compressed)
+
+    def finish(self) -> bytes:
+        self._parts.append(self._compressor.flush())
+        return b''.join(self._parts)
+
+
+class JsonFormat(FileFormat):
+    """ Newline-delimited json, compressed as it is appended. """
+
+    def __init__(self, compression: str):
+        self.compression = compression
+        self.extension = '.json' + COMPRESSION_EXTENSIONS[compression]
+
+    def encode(self, events: EventDataList) -> bytes:
+        return events_to_ndjson(events)
+
+    def new_chunk(self) -> Chunk:
+        return _JsonChunk(self.compression)
+
+
+class OutputBuffer:
+    """
+    Thread-safe buffer that writes events per prefix, as files in the given file format. See the module
+    docstring.
+    """
+
+    def __init__(self, write_object: WriteObject, config: OutputBufferConfig,
+                 file_format: Optional[FileFormat] = None):
+        """
+        :param write_object: function that writes a file or object
+        :param config: size, age, and compression settings
+        :param file_format: format of the files, by default json compressed with config.compression
+        """
+        self._write_object = write_object
+        self.config = config
+        self.file_format = file_format or JsonFormat(config.compression)
+        self.max_bytes = self.file_format.max_bytes or config.max_bytes
+        self._lock = threading.Lock()
+        self._chunks: Dict[str, Chunk] = {}
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='output-buffer', daemon=True)
+        self._thread.start()
+
+    def append(self, prefix: str, events: EventDataList):
+        """
+        Add events to the buffer of prefix. If the buffer is full, it is written by the calling thread.
+        :raise Exception: if writing a full buffer failed. The events of that buffer are lost.
+        """
+        if not events:
+            return
+        data = self.file_format.encode(events)
+        finished: List[Tuple[str, Chunk]] = []
+        with self._lock:
+            chunk = self._chunks.get(prefix)
+            if chunk is None:
+                chunk = self._chunks[prefix] = self.file_format.new_chunk()
+            chunk.append(data)
+            if chunk.size >= self.max_bytes:
+                finished.append((prefix, self._chunks.pop(prefix)))
+        self._write_chunks(finished)
+
+    def flush(self, max_age_seconds: Optional[float] = None):
+        """
+        Write the buffers, or only the buffers that are older than max_age_seconds.
+        :raise Exception: if writing a buffer failed. The events of that buffer are lost.
+        """
+        now = time.monotonic()
+        with self._lock:
+            finished = [(prefix, chunk) for prefix, chunk in self._chunks.items()
+                        if max_age_seconds is None or now - chunk.started >= max_age_seconds]
+            for prefix, _ in finished:
+                del self._chunks[prefix]
+        self._write_chunks(finished)
+
+    def close(self):
+        """ Stop the background thread, and write all buffers. """
+        self._closed.set()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        """ Write buffers that are older than max_seconds, until close() is called. """
+        interval = min(self.config.max_seconds, 1)
+        while not self._closed.wait(timeout=interval):
+            try:
+                self.flush(max_age_seconds=self.config.max_seconds)
+            except Exception:
+                # already printed by _write_chunks()
+                pass
+
+    def _write_chunks(self, finished: List[Tuple[str, Chunk]]):
+        errors = []
+        for prefix, chunk in finished:
+            # The name must be unique, as multiple processes can write to the same directory or bucket
+            name = f'{chunk.moment.timestamp()}-{uuid.uuid4().hex}{self.file_format.extension}'
+            try:
+                self._write_object(prefix, name, chunk.moment, chunk.finish())
+            except Exception as exc:
+                print(f'Error writing {chunk.size} bytes of events to output buffer {prefix}:')
+                traceback.print_exc()
+                errors.append(exc)
+        if errors:
+            raise errors[0]
+
+
+def _close_in_process(output_buffer: OutputBuffer, pid: int):
+    """ Close the buffer, if this is process pid. Otherwise this is a fork, and the parent closes it. """
+    if os.getpid() == pid:
+        output_buffer.close()
+
+
+def create_output_buffer(write_object: WriteObject, config: OutputBufferConfig,
+                         file_format: Optional[FileFormat] = None) -> OutputBuffer:
+    """ Create a buffer, which is written when the process that created it exits. """
+    output_buffer = OutputBuffer(write_object=write_object, config=config, file_format=file_format)
+    atexit.register(_close_in_process, output_buffer, os.getpid())
+    return output_buffer
@@ -0,0 +1,171 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Write the events of a request to the configured outputs concurrently.
+
+Each output is written by a function that is run on a pool of threads. The request waits for the mandatory
+outputs only (see OUTPUT_MANDATORY), so the latency of a request is that of the slowest mandatory output,
+instead of the sum of all outputs. A failing output does not stop the other outputs.
+
+Mandatory and background outputs have separate thread pools, so that a slow background output cannot
+delay the mandatory outputs of later requests. At most OUTPUT_BACKGROUND_QUEUE_SIZE background writes can
+be pending per process; if there are more, the write is dropped and counted in the OUTPUT_DROPPED metric.
+
+The timeout of a mandatory output starts when its write starts, so time spent waiting for a thread does not
+count. Waiting for a thread is limited by the same timeout, and at most OUTPUT_MANDATORY_QUEUE_SIZE mandatory
+writes can be pending, so requests fail instead of hanging if the threads are all busy with writes that
+hang. A write that did not start in time is cancelled. Python threads cannot be cancelled though: a
+mandatory write that exceeds the timeout keeps running, and can still succeed after the request failed.
+E.g. the events of a timed out Postgres write can be committed, in which case the tracker's retry of the
+request is stored as duplicate events in nok_data.
+"""
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from objectiv_backend.common.config import OutputConfig
+from objectiv_backend.common.metrics import OUTPUT_SECONDS, OUTPUT_TIMEOUTS, OUTPUT_DROPPED
+from objectiv_backend.common.per_process import PerProcess
+
+
+class OutputError(Exception):
+    """ A mandatory output failed, or did not finish in time. """
+
+
+class OutputTiming(NamedTuple):
+    output: str
+    # one of: 'ok', 'error', 'timeout', 'background' for outputs that are not waited for, or 'dropped' for
+    # outputs that were not written because too many writes were pending
+    status: str
+    # time it took to write the output, None if it did not finish before the response
+    seconds: Optional[float]
+
+    def __str__(self):
+        if self.seconds is None:
+            return f'{self.output} {self.status}'
+        return f'{self.output} {self.status} {self.seconds * 1000:.1f} ms'
+
+
+class _BoundedExecutor:
+    """ Thread pool that refuses new tasks, if max_pending tasks are already queued or running. """
+
+    def __init__(self, threads: int, max_pending: int, thread_name_prefix: str):
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=thread_name_prefix)
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def try_submit(self, function: Callable, *args) -> Optional[Future]:
+        """ Submit function(*args), or return None if there are too many pending tasks. """
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            future = self._executor.submit(function, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+_MANDATORY_EXECUTOR: PerProcess[_BoundedExecutor] = PerProcess(
+    lambda threads, max_pending: _BoundedExecutor(threads, max_pending, thread_name_prefix='output'))
+_BACKGROUND_EXECUTOR: PerProcess[_BoundedExecutor] = PerProcess(
+    lambda threads, max_pending: _BoundedExecutor(threads, max_pending,
+                                                  thread_name_prefix='output-background'))
+
+
+class _OutputTask:
+    """ Write to an output, and record when the write started. """
+
+    def __init__(self, output: str, write: Callable[[], None]):
+        self.output = output
+        self.write = write
+        self.started = threading.Event()
+        self.start = 0.0
+        # set by the dispatcher, if the request didn't wait for the write to finish
+        self.timed_out = False
+
+    def run(self) -> Tuple[float, Optional[Exception]]:
+        """
+        Run write, and record its timing in the OUTPUT_SECONDS metric. Errors are printed and returned
+        instead of raised, so that the caller can decide whether the error is fatal.
+        """
+        self.start = time.perf_counter()
+        self.started.set()
+        error: Optional[Exception] = None
+        try:
+            self.write()
+        except Exception as exc:
+            print(f'Error writing to output {self.output}:')
+            traceback.print_exc()
+            error = exc
+        seconds = time.perf_counter() - self.start
+        OUTPUT_SECONDS.observe(seconds, output=self.output, status='ok' if error is None else 'error')
+        if self.timed_out and error is None:
+            print(f'Output {self.output} finished after the request timed out, in {seconds:.1f} s')
+        return seconds, error
+
+
+def dispatch_outputs(writers: Dict[str, Callable[[], None]],
+                     output_config: OutputConfig) -> List[OutputTiming]:
+    """
+    Run the writers concurrently, and wait till the mandatory ones are finished.
+    :param writers: dict with per output name a function that writes to that output
+    :param output_config: output configuration, with the mandatory outputs, timeout, and thread pool sizes
+    :return: the timing of each output, in the order of writers
+    :raise OutputError: if a mandatory output fails, does not get a thread within
+        output_config.timeout_seconds, does not finish within output_config.timeout_seconds after it started,
+        or is dropped because too many mandatory writes are pending. Other outputs are still written.
+    """
+    mandatory_executor = _MANDATORY_EXECUTOR.get(output_config.threads, output_config.mandatory_queue_size)
+    background_executor = _BACKGROUND_EXECUTOR.get(output_config.threads, output_config.background_queue_size)
+    tasks: Dict[str, _OutputTask] = {}
+    futures: Dict[str, Optional[Future]] = {}
+    for output, write in writers.items():
+        tasks[output] = _OutputTask(output, write)
+        executor = mandatory_executor if output in output_config.mandatory else background_executor
+        futures[output] = executor.try_submit(tasks[output].run)
+        if futures[output] is None:
+            OUTPUT_DROPPED.inc(output=output)
+    submitted = time.perf_counter()
+
+    timings: List[OutputTiming] = []
+    # per failed mandatory output: its name, status, and error if any
+    failed: List[Tuple[str, str, Optional[Exception]]] = []
+    for output in writers:
+        task = tasks[output]
+        future = futures[output]
+        if future is None:
+            if output in output_config.mandatory:
+                failed.append((output, 'dropped', None))
+            timings.append(OutputTiming(output=output, status='dropped', seconds=None))
+            continue
+        if output in output_config.mandatory:
+            # Waiting for a thread doesn't count towards the timeout of the write, but has its own timeout.
+            # A write that didn't start yet is cancelled; if it just started, it's timed out below.
+            started = task.started.wait(timeout=max(submitted + output_config.timeout_seconds
+                                                    - time.perf_counter(), 0))
+            if started or not future.cancel():
+                task.started.wait()
+                remaining = task.start + output_config.timeout_seconds - time.perf_counter()
+                wait([future], timeout=max(remaining, 0))
+        if future.cancelled() or not future.done():
+            if output in output_config.mandatory:
+                task.timed_out = True
+                OUTPUT_TIMEOUTS.inc(output=output)
+                failed.append((output, 'timeout', None))
+                timings.append(OutputTiming(output=output, status='timeout', seconds=None))
+            else:
+                timings.append(OutputTiming(output=output, status='background', seconds=None))
+            continue
+        seconds, error = future.result()
+        if error is not None and output in output_config.mandatory:
+            failed.append((output, 'error', error))
+        status = 'ok' if error is None else 'error'
+        timings.append(OutputTiming(output=output, status=status, seconds=seconds))
+
+    if failed:
+        message = ', '.join(f'{output}: {error if error else status}' for output, status, error in failed)
+        raise OutputError(f'Writing to mandatory outputs failed - {message}') from failed[0][2]
+    return timings
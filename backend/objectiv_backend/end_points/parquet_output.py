@@ -0,0 +1,235 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Parquet file format for the S3 and filesystem outputs (OUTPUT_FILE_FORMATS=parquet).
+
+The events are flattened into columns, so that analyses over archived data (e.g. with bach or Athena) can
+read only the columns they need, instead of parsing the json of every event. Contexts are stored as a list
+of structs, with the properties that are specific to a context type as a json string. The files are
+partitioned by the day of the events, using Hive-style directory names (day=YYYY-MM-DD).
+
+The size of a buffered file is counted as the size of its events in Arrow columns, which is smaller than
+their json. So Parquet files have their own size limit (OUTPUT_PARQUET_BUFFER_MAX_BYTES).
+
+This requires the optional pyarrow package.
+"""
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from objectiv_backend.common.json_codec import json_dumps
+from objectiv_backend.common.types import EventDataList, EventData
+from objectiv_backend.end_points.output_buffer import Chunk, FileFormat
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None  # type: ignore
+
+# Partition for events without a valid time, as used by Hive
+DAY_UNKNOWN = '__HIVE_DEFAULT_PARTITION__'
+
+# Context fields that get their own column in the context structs
+_CONTEXT_FIELDS = frozenset(['_type', '_types', 'id'])
+
+
+@lru_cache(maxsize=None)
+def get_parquet_schema() -> Any:
+    """ Give the pyarrow schema of the Parquet files. """
+    context_type = pyarrow.struct([
+        ('_type', pyarrow.string()),
+        ('_types', pyarrow.list_(pyarrow.string())),
+        ('id', pyarrow.string()),
+        # all other fields of the context, as a json object
+        ('properties', pyarrow.string())
+    ])
+    return pyarrow.schema([
+        ('event_id', pyarrow.string()),
+        ('event_type', pyarrow.string()),
+        ('event_types', pyarrow.list_(pyarrow.string())),
+        ('time', pyarrow.timestamp('ms')),
+        ('cookie_id', pyarrow.string()),
+        ('global_contexts', pyarrow.list_(context_type)),
+        ('location_stack', pyarrow.list_(context_type))
+    ])
+
+
+def _get_time(event: EventData) -> Optional[int]:
+    """ Give the time of the event in milliseconds since the epoch, or None if it's not valid. """
+    millis = event.get('time')
+    if isinstance(millis, int) and not isinstance(millis, bool):
+        return millis
+    return None
+
+
+def get_event_day(event: EventData) -> str:
+    """ Give the day (YYYY-MM-DD, UTC) of the event, or DAY_UNKNOWN if the event has no valid time. """
+    millis = _get_time(event)
+    if millis is None:
+        return DAY_UNKNOWN
+    try:
+        return datetime.fromtimestamp(millis / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+    except (OverflowError, OSError, ValueError):
+        return DAY_UNKNOWN
+
+
+def split_events_by_day(events: EventDataList) -> Dict[str, EventDataList]:
+    """ Give a dict with per day (see get_event_day()) the events of that day. """
+    result: Dict[str, EventDataList] = {}
+    for event in events:
+        result.setdefault(get_event_day(event), []).append(event)
+    return result
+
+
+def _to_str(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def _to_str_list(value: Any) -> Optional[List[str]]:
+    return [str(item) for item in value] if isinstance(value, list) else None
+
+
+def _to_array(values: List[Any], arrow_type: Any) -> Any:
+    """
+    Convert values to a pyarrow array of arrow_type, which must be string or list of strings. Valid events
+    only contain values of the right type, so we first try to convert the values as is. Only if that fails
+    (e.g. for NOK events), all values are converted to the right type first.
+    """
+    is_list = pyarrow.types.is_list(arrow_type)
+    # pyarrow would convert a string to a list of characters
+    if not is_list or all(value is None or isinstance(value, list) for value in values):
+        try:
+            return pyarrow.array(values, type=arrow_type)
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+            pass
+    convert = _to_str_list if is_list else _to_str
+    return pyarrow.array([convert(value) for value in values], type=arrow_type)
+
+
+def _contexts_to_array(contexts_per_event: List[Any]) -> Any:
+    """
+    Give a pyarrow array with per event a list of context structs. The array is built from the columns of
+    the structs, which is a lot faster than letting pyarrow convert a list of dicts per event.
+    """
+    context_type = get_parquet_schema().field('global_contexts').type.value_type
+    offsets = [0]
+    nulls = []
+    types: List[Any] = []
+    types_lists: List[Any] = []
+    ids: List[Any] = []
+    properties: List[str] = []
+    for contexts in contexts_per_event:
+        # Events that failed validation (the NOK events) might not have valid contexts. We store what we
+        # can, and don't fail.
+        if not isinstance(contexts, list):
+            offsets.append(offsets[-1])
+            nulls.append(True)
+            continue
+        for context in contexts:
+            if not isinstance(context, dict):
+                types.append(None)
+                types_lists.append(None)
+                ids.append(None)
+                properties.append(json_dumps(context))
+                continue
+            types.append(context.get('_type'))
+            types_lists.append(context.get('_types'))
+            ids.append(context.get('id'))
+            if context.keys() <= _CONTEXT_FIELDS:
+                properties.append('{}')
+            else:
+                properties.append(json_dumps({key: value for key, value in context.items()
+                                              if key not in _CONTEXT_FIELDS}))
+        offsets.append(offsets[-1] + len(contexts))
+        nulls.append(False)
+    structs = pyarrow.StructArray.from_arrays(
+        [_to_array(values, field.type)
+         for values, field in zip([types, types_lists, ids, properties], context_type)],
+        fields=list(context_type))
+    return pyarrow.ListArray.from_arrays(pyarrow.array(offsets, type=pyarrow.int32()), structs,
+                                         mask=pyarrow.array(nulls, type=pyarrow.bool_()))
+
+
+def _get_cookie_id(event: EventData) -> Any:
+    contexts = event.get('global_contexts')
+    if not isinstance(contexts, list):
+        return None
+    for context in contexts:
+        if isinstance(context, dict) and context.get('_type') == 'CookieIdContext':
+            return context.get('cookie_id')
+    return None
+
+
+def events_to_record_batch(events: EventDataList) -> Any:
+    """ Flatten the events into a pyarrow RecordBatch, with the schema of get_parquet_schema() """
+    schema = get_parquet_schema()
+    arrays = [
+        _to_array([event.get('id') for event in events], schema.field('event_id').type),
+        _to_array([event.get('_type') for event in events], schema.field('event_type').type),
+        _to_array([event.get('_types') for event in events], schema.field('event_types').type),
+        pyarrow.array([_get_time(event) for event in events], type=schema.field('time').type),
+        _to_array([_get_cookie_id(event) for event in events], schema.field('cookie_id').type),
+        _contexts_to_array([event.get('global_contexts') for event in events]),
+        _contexts_to_array([event.get('location_stack') for event in events])
+    ]
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class _ParquetChunk(Chunk):
+    """
+    Parquet file that is written in memory. Appended events are written as a row group once there are
+    row_group_size of them, the remaining events when the chunk is finished.
+    """
+
+    def __init__(self, compression: str, row_group_size: int):
+        super().__init__()
+        self.row_group_size = row_group_size
+        self._sink = pyarrow.BufferOutputStream()
+        self._writer = pyarrow.parquet.ParquetWriter(self._sink, get_parquet_schema(),
+                                                     compression=compression)
+        self._batches: List[Any] = []
+        self._row_count = 0
+
+    def append(self, data: Any):
+        # size in memory, counting the json of the events would take about as long as converting them
+        self.size += data.nbytes
+        self._batches.append(data)
+        self._row_count += data.num_rows
+        if self._row_count >= self.row_group_size:
+            self._write_batches()
+
+    def finish(self) -> bytes:
+        self._write_batches()
+        self._writer.close()
+        return self._sink.getvalue().to_pybytes()
+
+    def _write_batches(self):
+        if self._batches:
+            table = pyarrow.Table.from_batches(self._batches)
+            self._writer.write_table(table, row_group_size=self.row_group_size)
+            self._batches = []
+            self._row_count = 0
+
+
+class ParquetFormat(FileFormat):
+    """ Parquet files, see the module docstring. """
+    extension = '.parquet'
+
+    def __init__(self, compression: str, row_group_size: int, max_bytes: Optional[int] = None):
+        """
+        :param compression: compression of the column chunks, one of OUTPUT_COMPRESSIONS
+        :param row_group_size: number of events per row group
+        :param max_bytes: size of the buffered Arrow columns at which a file is written
+        """
+        if pyarrow is None:
+            raise Exception('Parquet output requires the pyarrow package')
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.max_bytes = max_bytes
+
+    def encode(self, events: EventDataList) -> Any:
+        return events_to_record_batch(events)
+
+    def new_chunk(self) -> Chunk:
+        return _ParquetChunk(compression=self.compression, row_group_size=self.row_group_size)
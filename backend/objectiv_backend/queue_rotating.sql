@@ -0,0 +1,65 @@
+-- Replaces the queue_entry and queue_finalize tables by tables that are list-partitioned on a bucket number
+-- (POSTGRES_QUEUE_LAYOUT=rotating). Partitions are named <table>_b<bucket>, for the buckets 0 up to and
+-- including 3; the number of buckets must match QUEUE_BUCKET_COUNT in workers/pg_queues.py.
+--
+-- Events are put in the bucket of the current time period (POSTGRES_QUEUE_BUCKET_SECONDS), the buckets are
+-- used in rotation. Events are still consumed from the parent table, in insert order. Consumed events leave
+-- dead rows behind, which are normally cleaned up by vacuum. Instead, the workers truncate a bucket once it
+-- is no longer written to and all its events are consumed, which takes constant time. Autovacuum is disabled
+-- on the buckets for that reason.
+--
+-- Events that are on the queues are moved to the new tables. Running this multiple times is harmless.
+begin;
+
+do $$
+declare
+    queue_table text;
+    bucket int;
+begin
+    foreach queue_table in array array['queue_entry', 'queue_finalize'] loop
+        if (select relkind from pg_class where oid = queue_table::regclass) = 'p' then
+            raise notice 'Table % is already partitioned', queue_table;
+            continue;
+        end if;
+        -- Make sure no events are put on or taken from the queue while it is replaced
+        execute format('lock table %I in access exclusive mode', queue_table);
+
+        execute format('create table %I (like %I including defaults including constraints, '
+                       'bucket smallint not null) partition by list (bucket)',
+                       queue_table || '_rotating', queue_table);
+        for bucket in 0..3 loop
+            execute format('create table %I partition of %I for values in (%s) '
+                           'with (autovacuum_enabled = false)',
+                           queue_table || '_b' || bucket, queue_table || '_rotating', bucket);
+        end loop;
+        -- Events are consumed in insert order, so that is what the buckets are indexed on
+        execute format('create index on %I (insert_order)', queue_table || '_rotating');
+        execute format('insert into %I (event_id, insert_order, value, bucket) '
+                       'select event_id, insert_order, value, 0 from %I',
+                       queue_table || '_rotating', queue_table);
+
+        -- The sequence of insert_order is owned by the old table, keep it for the new table
+        execute format('alter sequence %I owned by none', queue_table || '_insert_order_seq');
+        execute format('drop table %I', queue_table);
+        execute format('alter table %I rename to %I', queue_table || '_rotating', queue_table);
+        execute format('alter sequence %I owned by %I.insert_order',
+                       queue_table || '_insert_order_seq', queue_table);
+
+        -- Events are put directly in a bucket, and the workers truncate the buckets
+        for bucket in 0..3 loop
+            if queue_table = 'queue_entry' then
+                execute format('grant select, update, insert on %I to obj_collector_role',
+                               queue_table || '_b' || bucket);
+            end if;
+            execute format('grant select, update, insert, delete, truncate on %I to obj_worker_role',
+                           queue_table || '_b' || bucket);
+        end loop;
+    end loop;
+
+    -- same permissions as in create_tables.sql
+    grant select, update, insert on queue_entry to obj_collector_role;
+    grant select, update, delete on queue_entry to obj_worker_role;
+    grant select, update, insert, delete on queue_finalize to obj_worker_role;
+end $$;
+
+commit;
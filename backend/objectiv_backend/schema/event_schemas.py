@@ -7,14 +7,28 @@ import os
 import re
 import sys
 from copy import deepcopy
-from typing import Set, List, Dict, Any, Optional, Tuple
+from typing import Set, List, Dict, Any, Optional, Tuple, FrozenSet
 import pkgutil
 
+import jsonschema
+
 from objectiv_backend.common.types import EventType, ContextType, EventListSchema
 
 MAX_HIERARCHY_DEPTH = 100
 
 
+def compile_json_schema_validator(schema: Dict[str, Any]) -> Any:
+    """
+    Check the given json-schema against its meta-schema, and give a validator object for it. The
+    validator can be used to validate any number of instances without re-checking the schema.
+
+    :raises jsonschema.SchemaError: if the schema itself is not a valid json-schema
+    """
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema)
+
+
 class EventSubSchema:
     """
     Immutable sub-schema containing events, their inheritance hierarchy and required contexts for events.
@@ -31,7 +45,9 @@ class EventSubSchema:
         # _compiled_* fields are derived fields that need to be calculated after self.schema is set.
         self._compiled_list_event_types: List[EventType] = []
         self._compiled_all_parents_and_required_contexts: \
-            Dict[EventType, Tuple[Set[EventType], Set[ContextType]]] = {}
+            Dict[EventType, Tuple[FrozenSet[EventType], FrozenSet[ContextType]]] = {}
+        self._compiled_sorted_parent_event_types: Dict[EventType, Tuple[EventType, ...]] = {}
+        self._compiled_validators: Dict[EventType, Any] = {}
 
     def get_extended_schema(self, event_schema: Dict[str, Any]) -> 'EventSubSchema':
         """
@@ -63,9 +79,10 @@ class EventSubSchema:
 
     def _compile(self):
         """
-        1) Pre calculate the return values of list_event_types(), get_all_parent_event_types(), and
-        get_all_required_contexts.
+        1) Pre calculate the return values of list_event_types(), get_all_parent_event_types(),
+        get_sorted_parent_event_types(), and get_all_required_contexts.
         2) Makes sure the event hierarchy has no cycles
+        3) Pre calculate the json-schema validators that are returned by get_event_validator()
         Must be called after the schema has changed.
         """
         # pre-calculate all values
@@ -73,12 +90,20 @@ class EventSubSchema:
         self._compiled_all_parents_and_required_contexts = {}
         for event_type in self._compiled_list_event_types:
             self._compile_parents_and_contexts(event_type)
+        self._compiled_sorted_parent_event_types = {
+            event_type: tuple(sorted(event_types))
+            for event_type, (event_types, _) in self._compiled_all_parents_and_required_contexts.items()
+        }
+        self._compiled_validators = {}
+        for event_type in self._compiled_list_event_types:
+            self._compiled_validators[event_type] = \
+                compile_json_schema_validator(self.get_event_schema(event_type))
 
     def _compile_parents_and_contexts(
             self,
             event_type: EventType,
             count=MAX_HIERARCHY_DEPTH
-    ) -> Tuple[Set[EventType], Set[ContextType]]:
+    ) -> Tuple[FrozenSet[EventType], FrozenSet[ContextType]]:
         """
         For a given event-type give:
         1) all event-types that this type is, i.e. the type itself and all its parents
@@ -109,7 +134,7 @@ class EventSubSchema:
             event_types |= parent_event_types
             context_types |= parent_context_types
 
-        result = event_types, context_types
+        result = frozenset(event_types), frozenset(context_types)
         self._compiled_all_parents_and_required_contexts[event_type] = result
         return result
 
@@ -117,7 +142,7 @@ class EventSubSchema:
         """ Give a alphabetically sorted list of all event-types. """
         return self._compiled_list_event_types
 
-    def get_all_parent_event_types(self, event_type: EventType) -> Set[EventType]:
+    def get_all_parent_event_types(self, event_type: EventType) -> FrozenSet[EventType]:
         """
         Given an event_type, give a set with that event_type and all its parent event_types.
         :param event_type: event type. Must be a valid event_type
@@ -127,7 +152,16 @@ class EventSubSchema:
             raise ValueError(f'Not a valid event_type {event_type}')
         return self._compiled_all_parents_and_required_contexts[event_type][0]
 
-    def get_all_required_contexts(self, event_type: EventType) -> Set[ContextType]:
+    def get_sorted_parent_event_types(self, event_type: EventType) -> Tuple[EventType, ...]:
+        """
+        Same as get_all_parent_event_types(), but as an alphabetically sorted tuple.
+        :param event_type: event type. Must be a valid event_type
+        """
+        if not self.is_valid_event_type(event_type):
+            raise ValueError(f'Not a valid event_type {event_type}')
+        return self._compiled_sorted_parent_event_types[event_type]
+
+    def get_all_required_contexts(self, event_type: EventType) -> FrozenSet[ContextType]:
         """
         Get all contexts that are required by the given event. This includes context types that are
         required by the type's parent events.
@@ -165,6 +199,13 @@ class EventSubSchema:
         }
         return schema
 
+    def get_event_validator(self, event_type: EventType) -> Optional[Any]:
+        """
+        Give the pre-compiled json-schema validator for the json-schema returned by get_event_schema(), or
+        None if the event type doesn't exist.
+        """
+        return self._compiled_validators.get(event_type)
+
 
 class ContextSubSchema:
     """
@@ -179,9 +220,11 @@ class ContextSubSchema:
         """
         self.schema: Dict[str, Any] = {}
         # _compiled_* fields are derived fields that need to be calculated after self.schema is set.
-        self._compiled_list_context_types = []
-        self._compiled_all_parent_context_types = {}
-        self._compiled_all_child_context_types = {}
+        self._compiled_list_context_types: List[ContextType] = []
+        self._compiled_all_parent_context_types: Dict[ContextType, FrozenSet[ContextType]] = {}
+        self._compiled_sorted_parent_context_types: Dict[ContextType, Tuple[ContextType, ...]] = {}
+        self._compiled_all_child_context_types: Dict[ContextType, FrozenSet[ContextType]] = {}
+        self._compiled_validators: Dict[ContextType, Any] = {}
 
     CONTEXT_NAME_REGEX = r'^[A-Z][a-zA-Z0-9]*Context$'
 
@@ -225,8 +268,9 @@ class ContextSubSchema:
     def _compile(self):
         """
         1) Pre calculate the return values of list_context_types(), get_all_parent_context_types(),
-            and get_all_child_context_types().
+            get_sorted_parent_context_types(), and get_all_child_context_types().
         2) Makes sure the event hierarchy has no cycles, and all parent-reference exist.
+        3) Pre calculate the json-schema validators that are returned by get_context_validator()
         Must be called after the schema has changed.
         """
         self._compiled_list_context_types = sorted(self.schema.keys())
@@ -235,6 +279,10 @@ class ContextSubSchema:
         # Calculate parent relations, and do some basic checks on graph
         for context_type in self._compiled_list_context_types:
             self._compile_parent_context_types(context_type)
+        self._compiled_sorted_parent_context_types = {
+            context_type: tuple(sorted(context_types))
+            for context_type, context_types in self._compiled_all_parent_context_types.items()
+        }
 
         # Calculate child relations based on parent relations
         for context_type in self._compiled_list_context_types:
@@ -242,11 +290,16 @@ class ContextSubSchema:
             for ct in self._compiled_list_context_types:
                 if context_type in self._compiled_all_parent_context_types[ct]:
                     children.add(ct)
-            self._compiled_all_child_context_types[context_type] = children
+            self._compiled_all_child_context_types[context_type] = frozenset(children)
+
+        self._compiled_validators = {}
+        for context_type in self._compiled_list_context_types:
+            self._compiled_validators[context_type] = \
+                compile_json_schema_validator(self.get_context_schema(context_type))
 
     def _compile_parent_context_types(self,
                                       context_type: ContextType,
-                                      count=MAX_HIERARCHY_DEPTH) -> Set[ContextType]:
+                                      count=MAX_HIERARCHY_DEPTH) -> FrozenSet[ContextType]:
         """
         * Give the parent context-types of the given context-type (including the given type itself).
         * Fill self._compiled_all_parent_context_types for the explored context_types.
@@ -267,24 +320,30 @@ class ContextSubSchema:
         parents: List[ContextType] = self.schema[context_type].get('parents', [])
         for parent in parents:
             result |= self._compile_parent_context_types(parent, count=count-1)
-        self._compiled_all_parent_context_types[context_type] = result
-        return result
+        self._compiled_all_parent_context_types[context_type] = frozenset(result)
+        return self._compiled_all_parent_context_types[context_type]
 
     def list_context_types(self) -> List[ContextType]:
         """ Give a alphabetically sorted list of all context-types. """
         return self._compiled_list_context_types
 
-    def get_all_parent_context_types(self, context_type: ContextType) -> Set[ContextType]:
+    def get_all_parent_context_types(self, context_type: ContextType) -> FrozenSet[ContextType]:
         """
         Given a context_type, give a set with that context_type and all its parent context_types
         """
-        return self._compiled_all_parent_context_types.get(context_type, {context_type})
+        return self._compiled_all_parent_context_types.get(context_type, frozenset([context_type]))
+
+    def get_sorted_parent_context_types(self, context_type: ContextType) -> Tuple[ContextType, ...]:
+        """
+        Same as get_all_parent_context_types(), but as an alphabetically sorted tuple.
+        """
+        return self._compiled_sorted_parent_context_types.get(context_type, (context_type, ))
 
-    def get_all_child_context_types(self, context_type: ContextType) -> Set[ContextType]:
+    def get_all_child_context_types(self, context_type: ContextType) -> FrozenSet[ContextType]:
         """
         Given a context_type, give a set with that context_type and all its child context_types
         """
-        return self._compiled_all_child_context_types.get(context_type, set())
+        return self._compiled_all_child_context_types.get(context_type, frozenset())
 
     def get_context_schema(self, context_type: ContextType) -> Optional[Dict[str, Any]]:
         """
@@ -313,6 +372,13 @@ class ContextSubSchema:
         }
         return schema
 
+    def get_context_validator(self, context_type: ContextType) -> Optional[Any]:
+        """
+        Give the pre-compiled json-schema validator for the json-schema returned by get_context_schema(),
+        or None if the context type doesn't exist.
+        """
+        return self._compiled_validators.get(context_type)
+
 
 class EventSchema:
     """
@@ -327,6 +393,9 @@ class EventSchema:
         self.version = {}
         self.events = EventSubSchema()
         self.contexts = ContextSubSchema()
+        # _compiled_* fields are derived fields that need to be calculated after events and contexts are set.
+        self._compiled_context_type_masks: Dict[ContextType, int] = {}
+        self._compiled_required_context_masks: Dict[EventType, int] = {}
 
     def get_extended_schema(self, schema: Dict[str, Any]) -> 'EventSchema':
         """
@@ -343,12 +412,12 @@ class EventSchema:
             * adding properties to an existing context
             * adding sub-properties to an existing context (e.g. a "minimum" field for an integer)
         """
-        events = deepcopy(self.events)
-        contexts = deepcopy(self.contexts)
         version = deepcopy(self.version)
 
-        events = events.get_extended_schema(schema['events'])
-        contexts = contexts.get_extended_schema(schema['contexts'])
+        # The sub schemas leave self unmodified, and give new objects with freshly compiled values (such
+        # as the json-schema validators), so there is no need to copy them first.
+        events = self.events.get_extended_schema(schema['events'])
+        contexts = self.contexts.get_extended_schema(schema['contexts'])
         version.update(schema['version'])
         # todo: separate version merging, and do some validation on this
         # extension_name = event_schema['name']
@@ -364,15 +433,39 @@ class EventSchema:
         result.events = events
         result.contexts = contexts
         result.version = version
+        result._compile()
         return result
 
+    def _compile(self):
+        """
+        Pre calculate the bitmasks that are returned by get_context_type_mask() and
+        get_required_contexts_mask(). Every context type gets a bit. The mask of a context type has the bits
+        of the type and all its parent types set, the mask of an event type the bits of all its required
+        context types. So an event has all required contexts, if the union of the masks of its contexts
+        contains the required mask.
+        Must be called after events or contexts have changed.
+        """
+        bits = {context_type: 1 << i for i, context_type in enumerate(self.contexts.list_context_types())}
+        self._compiled_context_type_masks = {}
+        for context_type in self.contexts.list_context_types():
+            mask = 0
+            for parent_type in self.contexts.get_all_parent_context_types(context_type):
+                mask |= bits[parent_type]
+            self._compiled_context_type_masks[context_type] = mask
+        self._compiled_required_context_masks = {}
+        for event_type in self.events.list_event_types():
+            mask = 0
+            for context_type in self.events.get_all_required_contexts(event_type):
+                mask |= bits[context_type]
+            self._compiled_required_context_masks[event_type] = mask
+
     @staticmethod
     def _validate_events_required_contexts(events: EventSubSchema, contexts: ContextSubSchema):
         """
         Check that all 'requiredContexts' defined in events schema exist in the contexts schema.
         :raise ValueError: in case a required context is missing.
         """
-        all_required_contexts = set()
+        all_required_contexts: Set[ContextType] = set()
         for event_type in events.list_event_types():
             all_required_contexts |= events.get_all_required_contexts(event_type)
         all_contexts = contexts.list_context_types()
@@ -394,7 +487,7 @@ class EventSchema:
         """ Give a alphabetically sorted list of all event-types. """
         return self.events.list_event_types()
 
-    def get_all_parent_event_types(self, event_type: EventType) -> Set[EventType]:
+    def get_all_parent_event_types(self, event_type: EventType) -> FrozenSet[EventType]:
         """
         Given an event_type, give a set with that event_type and all its parent event_types.
         :param event_type: event type. Must be a valid event_type
@@ -402,19 +495,39 @@ class EventSchema:
         """
         return self.events.get_all_parent_event_types(event_type=event_type)
 
-    def get_all_required_contexts(self, event_type: EventType) -> Set[ContextType]:
+    def get_sorted_parent_event_types(self, event_type: EventType) -> Tuple[EventType, ...]:
+        return self.events.get_sorted_parent_event_types(event_type=event_type)
+
+    def get_all_required_contexts(self, event_type: EventType) -> FrozenSet[ContextType]:
         return self.events.get_all_required_contexts(event_type=event_type)
 
+    def get_required_contexts_mask(self, event_type: EventType) -> int:
+        """
+        Give the bitmask of all contexts that are required by the given event type, see _compile().
+        :param event_type: event type. Must be a valid event_type
+        """
+        return self._compiled_required_context_masks[event_type]
+
+    def get_context_type_mask(self, context_type: ContextType) -> int:
+        """
+        Give the bitmask of the given context type and all its parent types, see _compile(). Unknown
+        context types have a mask of 0, they cannot be required by an event.
+        """
+        return self._compiled_context_type_masks.get(context_type, 0)
+
     def is_valid_event_type(self, event_type: EventType) -> bool:
         return self.events.is_valid_event_type(event_type=event_type)
 
     def list_context_types(self) -> List[ContextType]:
         return self.contexts.list_context_types()
 
-    def get_all_parent_context_types(self, context_type: ContextType) -> Set[ContextType]:
+    def get_all_parent_context_types(self, context_type: ContextType) -> FrozenSet[ContextType]:
         return self.contexts.get_all_parent_context_types(context_type=context_type)
 
-    def get_all_child_context_types(self, context_type: ContextType) -> Set[ContextType]:
+    def get_sorted_parent_context_types(self, context_type: ContextType) -> Tuple[ContextType, ...]:
+        return self.contexts.get_sorted_parent_context_types(context_type=context_type)
+
+    def get_all_child_context_types(self, context_type: ContextType) -> FrozenSet[ContextType]:
         return self.contexts.get_all_child_context_types(context_type=context_type)
 
     def get_context_schema(self, context_type: ContextType) -> Optional[Dict[str, Any]]:
@@ -423,12 +536,51 @@ class EventSchema:
     def get_event_schema(self, event_type: EventType) -> Optional[Dict[str, Any]]:
         return self.events.get_event_schema(event_type=event_type)
 
+    def get_context_validator(self, context_type: ContextType) -> Optional[Any]:
+        return self.contexts.get_context_validator(context_type=context_type)
 
-def get_event_list_schema() -> EventListSchema:
-    data = pkgutil.get_data(__name__, "event_list.json5")
-    schema_json = json5.loads(data)
+    def get_event_validator(self, event_type: EventType) -> Optional[Any]:
+        return self.events.get_event_validator(event_type=event_type)
 
-    return schema_json
+
+def get_event_list_schema(event_schema: EventSchema) -> EventListSchema:
+    """
+    Give a json-schema to validate the structure of a list of events, as sent by the tracker.
+
+    The schema is based on schema/event_list.json5. The AbstractEvent type in there is replaced by the
+    properties of the AbstractEvent in the given event_schema. Those properties are not checked in
+    depth: contexts only need to be objects.
+    :param event_schema: schema that contains the AbstractEvent definition
+    """
+    data = pkgutil.get_data(__name__, "event_list.json5")
+    event_list_schema = json5.loads(data)
+
+    # we use AbstractEvent as the blueprint for what an event should look like
+    abstract_event = event_schema.events.schema['AbstractEvent']
+
+    # list of properties for an event (can be nested)
+    items: Dict[str, dict] = {}
+    for property_name, property_desc in abstract_event['properties'].items():
+        property_desc = deepcopy(property_desc)
+        if 'items' in property_desc and re.match('^Abstract.*?Context$', property_desc['items']['type']):
+            # we don't want to go into the validation / schema of contexts here
+            # so a simple object will suffice
+            property_desc['items']['type'] = 'object'
+        items[property_name] = property_desc
+
+    # we want a schema for a list of events (the base_schema only specifies a single event)
+    # the schema wants a list of abstract events. As that is not a valid JSON type,
+    # we replace that type with the more generic 'object' type, and the actual definition of
+    # an abstract event
+    if 'events' in event_list_schema['properties'] and \
+            'items' in event_list_schema['properties']['events'] and \
+            'type' in event_list_schema['properties']['events']['items'] and \
+            event_list_schema['properties']['events']['items']['type'] == 'AbstractEvent':
+        event_list_schema['properties']['events']['items'] = {
+            'type': 'object',
+            'items': items
+        }
+    return event_list_schema
 
 
 def get_event_schema(schema_extensions_directory: Optional[str]) -> EventSchema:
@@ -0,0 +1,284 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Generate plain Python validation functions from the event schema (SCHEMA_VALIDATOR=generated).
+
+The json-schemas of the events and contexts (see EventSchema.get_event_schema() and get_context_schema())
+only use a few keywords: type, properties, required, items and pattern. Like generate_classes.py turns the
+schema into classes, this turns those json-schemas into Python functions with the checks written out, so
+validating an event doesn't need to interpret the json-schemas with jsonschema. Per event type and per
+context type a function is generated, and is_valid_event() combines them: the event properties, each
+context's properties and whether it's an AbstractGlobalContext or AbstractLocationContext, and the
+required contexts of the event type.
+
+The generated code only tells whether an event is valid. For invalid events the jsonschema validation is
+done to get the errors, so the errors are the same with both validators. The json-schema of a type that
+uses any other keyword is checked with its jsonschema validator instead.
+
+Run as a script to print the generated code for the configured schema:
+    python -m objectiv_backend.schema.generate_validators
+"""
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, NamedTuple
+
+from objectiv_backend.common.types import ContextType, EventType
+from objectiv_backend.schema.event_schemas import EventSchema
+
+# Python expressions per json-schema type, for the value in `{v}`. These follow the type checker of
+# jsonschema: booleans are not numbers, and floats without a fractional part are integers.
+_TYPE_CHECKS = {
+    'string': 'isinstance({v}, str)',
+    'integer': '(isinstance({v}, int) and not isinstance({v}, bool) '
+               'or isinstance({v}, float) and {v}.is_integer())',
+    'number': '(isinstance({v}, numbers.Number) and not isinstance({v}, bool))',
+    'boolean': 'isinstance({v}, bool)',
+    'null': '{v} is None',
+    'object': 'isinstance({v}, dict)',
+    'array': 'isinstance({v}, list)',
+}
+
+# Keywords that don't affect validation
+_ANNOTATION_KEYWORDS = frozenset(['description', 'optional', 'title'])
+_SUPPORTED_KEYWORDS = frozenset(['type', 'properties', 'required', 'items', 'pattern']) | _ANNOTATION_KEYWORDS
+
+_MODULE_HEADER = '''\
+import numbers
+import re
+'''
+
+# Checks the event type, the contexts, and the required contexts. The per type functions are generated
+# above this.
+_IS_VALID_EVENT = '''\
+def is_valid_event(event):
+    if not isinstance(event, dict):
+        return False
+    event_type = event.get('_type')
+    if not isinstance(event_type, str):
+        return False
+    validate_event = EVENT_VALIDATORS.get(event_type)
+    if validate_event is None or not validate_event(event):
+        return False
+    mask = 0
+    for contexts, validators in ((event.get('global_contexts'), _GLOBAL_CONTEXT_VALIDATORS),
+                                 (event.get('location_stack'), _LOCATION_CONTEXT_VALIDATORS)):
+        if not isinstance(contexts, list):
+            return False
+        for context in contexts:
+            if not isinstance(context, dict):
+                return False
+            context_type = context.get('_type')
+            if not isinstance(context_type, str):
+                return False
+            validate_context = validators.get(context_type)
+            if validate_context is None or not validate_context(context):
+                return False
+            mask |= _CONTEXT_TYPE_MASKS[context_type]
+    required_mask = _REQUIRED_CONTEXT_MASKS[event_type]
+    return mask & required_mask == required_mask
+'''
+
+
+class GeneratedValidators(NamedTuple):
+    # Python source of the generated module
+    source: str
+    # Function that gives True if the event passes validate_event_adheres_to_schema() without errors
+    is_valid_event: Callable[[Any], bool]
+    # Per event type, function that checks an event against the json-schema of the type
+    event_validators: Dict[EventType, Callable[[Any], bool]]
+    # Per context type, function that checks a context against the json-schema of the type
+    context_validators: Dict[ContextType, Callable[[Any], bool]]
+
+
+class _UnsupportedSchema(Exception):
+    """ Raised if a json-schema uses a keyword that the generator doesn't support. """
+    pass
+
+
+def _indent(lines: List[str], level: int = 1) -> List[str]:
+    return [' ' * 4 * level + line for line in lines]
+
+
+def _get_checks(schema: Any, variable: str, depth: int, patterns: List[str]) -> List[str]:
+    """
+    Generate the statements that return False if the value in variable doesn't adhere to the json-schema.
+    :param schema: json-schema
+    :param variable: name of the variable with the value to check
+    :param depth: nesting depth, used to generate unique names for the variables of nested values
+    :param patterns: regular expressions of the `pattern` keywords, the generated code refers to
+        _PATTERN_<index in this list>. Patterns are added to this list.
+    :raises _UnsupportedSchema: if the schema uses a keyword that is not supported
+    """
+    if not isinstance(schema, dict):
+        raise _UnsupportedSchema(f'Schema is not an object: {schema}')
+    unsupported = set(schema.keys()) - _SUPPORTED_KEYWORDS
+    if unsupported:
+        raise _UnsupportedSchema(f'Unsupported keywords: {sorted(unsupported)}')
+    lines: List[str] = []
+    # the type that the value must have, if the schema allows a single type
+    known_type = None
+
+    if 'type' in schema:
+        types = schema['type'] if isinstance(schema['type'], list) else [schema['type']]
+        if not types or not all(isinstance(t, str) and t in _TYPE_CHECKS for t in types):
+            raise _UnsupportedSchema(f'Unsupported type: {schema["type"]}')
+        conditions = [_TYPE_CHECKS[t].format(v=variable) for t in types]
+        if len(conditions) == 1:
+            lines += [f'if not {conditions[0]}:', '    return False']
+        else:
+            lines += [f'if not ({" or ".join(conditions)}):', '    return False']
+        if len(types) == 1:
+            known_type = types[0]
+
+    if 'pattern' in schema:
+        if not isinstance(schema['pattern'], str):
+            raise _UnsupportedSchema(f'Unsupported pattern: {schema["pattern"]}')
+        if schema['pattern'] not in patterns:
+            patterns.append(schema['pattern'])
+        pattern_name = f'_PATTERN_{patterns.index(schema["pattern"])}'
+        if known_type == 'string':
+            lines += [f'if not {pattern_name}.search({variable}):', '    return False']
+        else:
+            lines += [f'if isinstance({variable}, str) and not {pattern_name}.search({variable}):',
+                      '    return False']
+
+    object_lines: List[str] = []
+    required = schema.get('required', [])
+    if not isinstance(required, list) or not all(isinstance(name, str) for name in required):
+        raise _UnsupportedSchema(f'Unsupported required: {required}')
+    for name in required:
+        object_lines += [f'if {name!r} not in {variable}:', '    return False']
+    properties = schema.get('properties', {})
+    if not isinstance(properties, dict):
+        raise _UnsupportedSchema(f'Unsupported properties: {properties}')
+    for name, property_schema in properties.items():
+        property_variable = f'value{depth}'
+        property_lines = _get_checks(property_schema, property_variable, depth + 1, patterns)
+        if property_lines and name in required:
+            # the presence of required properties has been checked above
+            object_lines += [f'{property_variable} = {variable}[{name!r}]'] + property_lines
+        elif property_lines:
+            object_lines += [f'if {name!r} in {variable}:',
+                             f'    {property_variable} = {variable}[{name!r}]']
+            object_lines += _indent(property_lines)
+    if object_lines and known_type == 'object':
+        lines += object_lines
+    elif object_lines:
+        lines += [f'if isinstance({variable}, dict):'] + _indent(object_lines)
+
+    if 'items' in schema:
+        item_variable = f'item{depth}'
+        # `items` can also be a list of schemas in older drafts, only a single schema is supported
+        item_lines = _get_checks(schema['items'], item_variable, depth + 1, patterns)
+        if item_lines and known_type == 'array':
+            lines += [f'for {item_variable} in {variable}:'] + _indent(item_lines)
+        elif item_lines:
+            lines += [f'if isinstance({variable}, list):',
+                      f'    for {item_variable} in {variable}:']
+            lines += _indent(item_lines, level=2)
+    return lines
+
+
+def _get_function(name: str, schema: Any, patterns: List[str]) -> List[str]:
+    """ Generate a function that gives whether its argument adheres to the json-schema. """
+    if not name.isidentifier():
+        raise _UnsupportedSchema(f'Not a valid function name: {name}')
+    checks = _get_checks(schema, 'instance', 0, patterns)
+    return [f'def {name}(instance):'] + _indent(checks) + ['    return True', '', '']
+
+
+def _get_dict(name: str, items: Dict[str, str]) -> List[str]:
+    """ Generate a dict with string keys and the given expressions as values. """
+    return [f'{name} = {{'] + [f'    {key!r}: {value},' for key, value in items.items()] + ['}']
+
+
+def generate_validators_source(event_schema: EventSchema) -> str:
+    """
+    Generate the source of a Python module with the validation functions for the event schema, see the
+    module docstring.
+    For a type with a json-schema that isn't supported, the generated code refers to
+    `_JSONSCHEMA_EVENT_VALIDATORS[type]` or `_JSONSCHEMA_CONTEXT_VALIDATORS[type]`, which
+    compile_validators() fills with the is_valid() methods of the jsonschema validators.
+    """
+    patterns: List[str] = []
+    functions: List[str] = []
+
+    def add_function(function_name: str, schema: Dict[str, Any], fallback: str) -> str:
+        try:
+            functions.extend(_get_function(function_name, schema, patterns))
+            return function_name
+        except _UnsupportedSchema:
+            return fallback
+
+    context_validators: Dict[str, str] = {}
+    for context_type in event_schema.list_context_types():
+        context_schema = event_schema.get_context_schema(context_type)
+        assert context_schema is not None  # help out mypy, we only use listed context types
+        context_validators[context_type] = add_function(
+            function_name=f'_validate_context_{context_type}',
+            schema=context_schema,
+            fallback=f'_JSONSCHEMA_CONTEXT_VALIDATORS[{context_type!r}]')
+    event_validators: Dict[str, str] = {}
+    for event_type in event_schema.list_event_types():
+        event_schema_type = event_schema.get_event_schema(event_type)
+        assert event_schema_type is not None  # help out mypy, we only use listed event types
+        event_validators[event_type] = add_function(
+            function_name=f'_validate_event_{event_type}',
+            schema=event_schema_type,
+            fallback=f'_JSONSCHEMA_EVENT_VALIDATORS[{event_type!r}]')
+
+    def get_validators(abstract_type: ContextType) -> Dict[str, str]:
+        return {context_type: function for context_type, function in context_validators.items()
+                if abstract_type in event_schema.get_all_parent_context_types(context_type)}
+
+    lines = [_MODULE_HEADER]
+    lines += [f'_PATTERN_{i} = re.compile({pattern!r})' for i, pattern in enumerate(patterns)]
+    lines += ['', '']
+    lines += functions
+    lines += _get_dict('EVENT_VALIDATORS', event_validators)
+    lines += _get_dict('CONTEXT_VALIDATORS', context_validators)
+    lines += _get_dict('_GLOBAL_CONTEXT_VALIDATORS', get_validators('AbstractGlobalContext'))
+    lines += _get_dict('_LOCATION_CONTEXT_VALIDATORS', get_validators('AbstractLocationContext'))
+    lines += _get_dict('_CONTEXT_TYPE_MASKS',
+                       {context_type: str(event_schema.get_context_type_mask(context_type))
+                        for context_type in context_validators})
+    lines += _get_dict('_REQUIRED_CONTEXT_MASKS',
+                       {event_type: str(event_schema.get_required_contexts_mask(event_type))
+                        for event_type in event_validators})
+    lines += ['', '', _IS_VALID_EVENT]
+    return '\n'.join(lines)
+
+
+@lru_cache(maxsize=16)
+def compile_validators(event_schema: EventSchema) -> GeneratedValidators:
+    """
+    Generate the validation functions for the event schema, and compile them. The result is cached per
+    EventSchema object.
+    """
+    source = generate_validators_source(event_schema)
+    namespace: Dict[str, Any] = {
+        '_JSONSCHEMA_CONTEXT_VALIDATORS': {
+            context_type: event_schema.get_context_validator(context_type).is_valid  # type: ignore
+            for context_type in event_schema.list_context_types()
+        },
+        '_JSONSCHEMA_EVENT_VALIDATORS': {
+            event_type: event_schema.get_event_validator(event_type).is_valid  # type: ignore
+            for event_type in event_schema.list_event_types()
+        }
+    }
+    exec(compile(source, '<generated validators>', 'exec'), namespace)
+    return GeneratedValidators(
+        source=source,
+        is_valid_event=namespace['is_valid_event'],
+        event_validators=namespace['EVENT_VALIDATORS'],
+        context_validators=namespace['CONTEXT_VALIDATORS']
+    )
+
+
+def main():
+    # imported here, as the config imports this module
+    from objectiv_backend.common.config import get_collector_config
+    print(generate_validators_source(get_collector_config().event_schema))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,18 +4,17 @@ Copyright 2021 Objectiv B.V.
 import argparse
 import json
 import sys
-from typing import List, Any, Dict, NamedTuple
+from typing import List, Any, Dict, NamedTuple, Set, Optional, Callable
 import uuid
-import re
 
-import jsonschema
-from jsonschema import ValidationError
+from jsonschema.exceptions import best_match
 
 from objectiv_backend.schema.event_schemas import EventSchema, get_event_schema
+from objectiv_backend.schema.generate_validators import compile_validators
 from objectiv_backend.common.config import \
     get_config_timestamp_validation, get_collector_config
 
-from objectiv_backend.common.types import EventData
+from objectiv_backend.common.types import EventData, ContextType, EventDataList, EventType, ContextData
 
 
 class ErrorInfo(NamedTuple):
@@ -43,36 +42,24 @@ def get_event_list_schema() -> Dict[str, Any]:
 
     :return: a dictionary containing a JSON schema like string to validate an array of events
     """
-    event_schema = get_collector_config().event_schema
-    events = event_schema.events.schema
-
-    # we use AbstractEvent as the blueprint for what an event should look like
-    abstract_event = events['AbstractEvent']
-
-    # # list of properties for an event (can be nested)
-    items: Dict[str, dict] = {}
-    for property_name, property_desc in abstract_event['properties'].items():
-
-        if 'items' in property_desc and re.match('^Abstract.*?Context$', property_desc['items']['type']):
-            # we don't want to go into the validation / schema of contexts here
-            # so a simple object will suffice
-            property_desc['items']['type'] = 'object'
-        items[property_name] = property_desc
-
-    # we want a schema for a list of events (the base_schema only specifies a single event)
-    # the schema wants a list of abstract events. As that is not a valid JSON type,
-    # we replace that type with the more generic 'object' type, and the actual definition of
-    # an abstract event
-    event_list_schema = get_collector_config().event_list_schema
-    if 'events' in event_list_schema['properties'] and \
-            'items' in event_list_schema['properties']['events'] and \
-            'type' in event_list_schema['properties']['events']['items'] and \
-            event_list_schema['properties']['events']['items']['type'] == 'AbstractEvent':
-        event_list_schema['properties']['events']['items'] = {
-            'type': 'object',
-            'items': items
-        }
-    return event_list_schema
+    return get_collector_config().event_list_schema
+
+
+def _is_well_formed_event_list(event_data: Any) -> bool:
+    """
+    Fast structural check for the common case: a dict with an integer 'transport_time' and a list of
+    objects as 'events'.
+    Any data for which this returns True, also validates against the event-list schema. So for such data
+    the full jsonschema validation can be skipped. If this returns False the data might still be valid,
+    and the full validation must be done. This must be kept in sync with schema/event_list.json5.
+    """
+    if type(event_data) is not dict:
+        return False
+    transport_time = event_data.get('transport_time')
+    events = event_data.get('events')
+    return type(transport_time) is int and \
+        type(events) is list and \
+        all(type(event) is dict for event in events)
 
 
 def validate_structure_event_list(event_data: Any) -> List[ErrorInfo]:
@@ -84,11 +71,12 @@ def validate_structure_event_list(event_data: Any) -> List[ErrorInfo]:
     validate_event_adheres_to_schema on each individual event.
     :return: list of found errors. Empty list indicates not errors
     """
-    try:
-        event_list_schema = get_event_list_schema()
-        jsonschema.validate(instance=event_data, schema=event_list_schema)
-    except ValidationError as exc:
-        return [ErrorInfo(event_data, f'Overall structure does not adhere to schema: {exc}')]
+    if _is_well_formed_event_list(event_data):
+        return []
+    validator = get_collector_config().event_list_validator
+    error = best_match(validator.iter_errors(event_data))
+    if error:
+        return [ErrorInfo(event_data, f'Overall structure does not adhere to schema: {error}')]
     return []
 
 
@@ -106,8 +94,7 @@ def validate_event_list(event_schema: EventSchema, event_data: Any) -> List[Erro
     if errors:
         return errors
 
-    for event in event_data['events']:
-        errors_event = validate_event_adheres_to_schema(event_schema, event)
+    for errors_event in validate_events_adhere_to_schema(event_schema, event_data['events']):
         errors.extend(errors_event)
     return errors
 
@@ -127,6 +114,10 @@ def validate_event_adheres_to_schema(event_schema: EventSchema, event: EventData
     :param event: Structural correct event.
     :return: list of found errors
     """
+    is_valid_event = _get_generated_validator(event_schema)
+    if is_valid_event is not None and is_valid_event(event):
+        return []
+
     event_name = event['_type']
     if not event_schema.is_valid_event_type(event_name):
         return [ErrorInfo(event, f'Unknown event: {event_name}')]
@@ -143,6 +134,127 @@ def validate_event_adheres_to_schema(event_schema: EventSchema, event: EventData
     return errors
 
 
+def validate_events_adhere_to_schema(event_schema: EventSchema,
+                                     events: EventDataList) -> List[List[ErrorInfo]]:
+    """
+    Validate that the events adhere to the EventSchema. Gives the same result as calling
+    validate_event_adheres_to_schema() on every event, but is faster for lists of many events of a few
+    types, which is what a tracker normally sends:
+        - events are grouped by type, so the validator is only looked up once per type
+        - contexts are grouped by type, and contexts that are equal are only validated once. The events of
+            a payload mostly have the same global contexts, and share part of their location stack.
+        - whether a context type is a global or location context is only determined once per type
+
+    This assumes that the events at least have the correct structure, see
+    validate_event_adheres_to_schema().
+    :param event_schema:
+    :param events: Structural correct events.
+    :return: per event, the list of found errors
+    """
+    is_valid_event = _get_generated_validator(event_schema)
+    if is_valid_event is None:
+        return _validate_events_adhere_to_schema(event_schema, events)
+    # Only the events that the generated code rejects are validated with jsonschema, to get the errors
+    results: List[List[ErrorInfo]] = [[] for _ in events]
+    invalid_indices = [i for i, event in enumerate(events) if not is_valid_event(event)]
+    if invalid_indices:
+        invalid_results = _validate_events_adhere_to_schema(
+            event_schema, [events[i] for i in invalid_indices])
+        for i, errors in zip(invalid_indices, invalid_results):
+            results[i] = errors
+    return results
+
+
+def _get_generated_validator(event_schema: EventSchema) -> Optional[Callable[[Any], bool]]:
+    """
+    Give the generated function that checks whether an event is valid, if SCHEMA_VALIDATOR is 'generated',
+    otherwise None. See schema/generate_validators.py
+    """
+    if get_collector_config().schema_validator != 'generated':
+        return None
+    return compile_validators(event_schema).is_valid_event
+
+
+def _validate_events_adhere_to_schema(event_schema: EventSchema,
+                                      events: EventDataList) -> List[List[ErrorInfo]]:
+    """ Implementation of validate_events_adhere_to_schema() using jsonschema. """
+    results: List[List[ErrorInfo]] = [[] for _ in events]
+
+    # Validate the events themselves, per type
+    events_per_type: Dict[EventType, List[int]] = {}
+    for i, event in enumerate(events):
+        event_name = event['_type']
+        if event_schema.is_valid_event_type(event_name):
+            events_per_type.setdefault(event_name, []).append(i)
+        else:
+            results[i] = [ErrorInfo(event, f'Unknown event: {event_name}')]
+    for event_type, indices in events_per_type.items():
+        validator = event_schema.get_event_validator(event_type=event_type)
+        assert validator is not None  # help out mypy, the event-type has already been checked
+        for i in indices:
+            error = best_match(validator.iter_errors(events[i]))
+            if error:
+                results[i].append(ErrorInfo(events[i], f'event validation failed {error}'))
+
+    # Validate the distinct contexts, per type. The error messages are stored per context key, the
+    # ErrorInfo objects are created per context, so they refer to the context in the event.
+    valid_indices = sorted(i for indices in events_per_type.values() for i in indices)
+    context_keys: Dict[int, Any] = {}
+    contexts_per_type: Dict[ContextType, Dict[Any, ContextData]] = {}
+    for i in valid_indices:
+        event = events[i]
+        for context in event['global_contexts'] + event['location_stack']:
+            key = _get_context_key(context)
+            context_keys[id(context)] = key
+            contexts_per_type.setdefault(context['_type'], {})[key] = context
+    context_messages: Dict[Any, List[str]] = {}
+    validators = {}
+    for context_type, contexts in contexts_per_type.items():
+        validator = validators[context_type] = event_schema.get_context_validator(context_type)
+        for key, context in contexts.items():
+            error = best_match(validator.iter_errors(context)) if validator else None
+            context_messages[key] = [f'context validation failed: {error}'] if error else []
+    parent_types = {context_type: event_schema.get_all_parent_context_types(context_type)
+                    for context_type in contexts_per_type}
+
+    # Combine the errors per event, in the same order as validate_event_adheres_to_schema()
+    for i in valid_indices:
+        event = events[i]
+        errors = results[i]
+        for contexts, abstract_type, message in (
+                (event['global_contexts'], 'AbstractGlobalContext', 'Not an instance of GlobalContext'),
+                (event['location_stack'], 'AbstractLocationContext', 'Not an instance of LocationContext')):
+            for context in contexts:
+                context_type = context['_type']
+                if not validators[context_type]:
+                    print(f'Unknown context {context_type}, ignoring')
+                if abstract_type not in parent_types[context_type]:
+                    errors.append(ErrorInfo(context, message))
+                for context_message in context_messages[context_keys[id(context)]]:
+                    errors.append(ErrorInfo(context, context_message))
+        errors.extend(_validate_required_contexts(event_schema, event))
+    return results
+
+
+# Types of context values that are compared by _get_context_key()
+_SCALAR_TYPES = frozenset([str, int, float, bool, type(None)])
+
+
+def _get_context_key(context: ContextData) -> Any:
+    """
+    Give a key for the context, that is equal for contexts that have the same validation result. For
+    contexts with only scalar values that's the tuple of the field names, and the types and values of the
+    fields, otherwise it's the id of the context.
+    """
+    key = []
+    for name, value in context.items():
+        value_type = type(value)
+        if value_type not in _SCALAR_TYPES:
+            return id(context)
+        key.append((name, value_type, value))
+    return tuple(key)
+
+
 def _validate_required_contexts(event_schema: EventSchema, event: EventData) -> List[ErrorInfo]:
     """
     Validate that all of the event's required contexts are present
@@ -152,8 +264,20 @@ def _validate_required_contexts(event_schema: EventSchema, event: EventData) ->
     event_name = event['_type']
     global_contexts = event['global_contexts']
     location_stack = event['location_stack']
-    required_context_types = event_schema.get_all_required_contexts(event_name)
-    actual_types = set()
+    # fast path: check the bitmasks of the context types, see EventSchema._compile()
+    required_mask = event_schema.get_required_contexts_mask(event_name)
+    get_context_type_mask = event_schema.get_context_type_mask
+    actual_mask = 0
+    for context in global_contexts:
+        actual_mask |= get_context_type_mask(context['_type'])
+    for context in location_stack:
+        actual_mask |= get_context_type_mask(context['_type'])
+    if required_mask & actual_mask == required_mask:
+        return []
+
+    # Determine the missing contexts for the error message
+    required_context_types = set(event_schema.get_all_required_contexts(event_name))
+    actual_types: Set[ContextType] = set()
     for context in global_contexts:
         actual_types |= event_schema.get_all_parent_context_types(context['_type'])
     for context in location_stack:
@@ -201,24 +325,25 @@ def _validate_context_item(event_schema: EventSchema, context) -> List[ErrorInfo
     context_type = context['_type']
     # theoretically we could generate some json schema with if-then that we could just validate, without
     # having to select the right sub-schema here, but that would be very complex and not very readable.
-    schema = event_schema.get_context_schema(context_type)
-    if not schema:
+    validator = event_schema.get_context_validator(context_type)
+    if not validator:
         print(f'Unknown context {context_type}, ignoring')
         return []
-    try:
-        jsonschema.validate(instance=context, schema=schema)
-    except ValidationError as exc:
-        return [ErrorInfo(context, f'context validation failed: {exc}')]
+    # best_match() gives the same error that jsonschema.validate() would raise, but here we use the
+    # validator that was compiled when the schema was loaded.
+    error = best_match(validator.iter_errors(context))
+    if error:
+        return [ErrorInfo(context, f'context validation failed: {error}')]
     return []
 
 
 def _validate_event_item(event_schema: EventSchema, event) -> List[ErrorInfo]:
     event_type = event['_type']
-    schema = event_schema.get_event_schema(event_type=event_type)
-    try:
-        jsonschema.validate(instance=event, schema=schema)
-    except ValidationError as exc:
-        return [ErrorInfo(event, f'event validation failed {exc}')]
+    validator = event_schema.get_event_validator(event_type=event_type)
+    assert validator is not None  # help out mypy, the event-type has already been checked
+    error = best_match(validator.iter_errors(event))
+    if error:
+        return [ErrorInfo(event, f'event validation failed {error}')]
 
     return []
 
@@ -0,0 +1,110 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Snowplow CollectorPayload, and an encoder for the Thrift binary protocol.
+
+The generated Thrift module (schema/ttypes.py) is large and slow to import, and the generic Thrift
+serialization is slow, as it writes every field through the protocol object. The collector only needs to
+write a single struct, so we define the struct here, and write the binary protocol bytes directly.
+encode_collector_payload() gives exactly the same bytes as the generic Thrift code; this is verified in
+the tests with encode_collector_payload_generic().
+
+Thrift schema: https://github.com/snowplow/snowplow/blob/master/2-collectors/thrift-schemas/collector-payload-1/src/main/thrift/collector-payload.thrift
+"""
+import struct
+from typing import List, NamedTuple, Optional
+
+# Thrift binary protocol types
+_TYPE_STOP = 0
+_TYPE_I64 = 10
+_TYPE_STRING = 11
+_TYPE_LIST = 15
+
+# Field header: type (byte) and field id (i16)
+_FIELD_HEADER = struct.Struct('>bh')
+# List header: element type (byte) and size (i32)
+_LIST_HEADER = struct.Struct('>bi')
+_I32 = struct.Struct('>i')
+_I64 = struct.Struct('>q')
+_STOP = bytes([_TYPE_STOP])
+
+
+class CollectorPayload(NamedTuple):
+    """
+    Same fields as the CollectorPayload struct in the Thrift schema. Fields that are None are not written.
+    timestamp and body are always written, as the Snowplow pipeline needs them.
+    """
+    schema: Optional[str] = None
+    ipAddress: Optional[str] = None
+    timestamp: int = 0
+    encoding: Optional[str] = None
+    collector: Optional[str] = None
+    userAgent: Optional[str] = None
+    refererUri: Optional[str] = None
+    path: Optional[str] = None
+    querystring: Optional[str] = None
+    body: str = ''
+    headers: Optional[List[str]] = None
+    contentType: Optional[str] = None
+    hostname: Optional[str] = None
+    networkUserId: Optional[str] = None
+
+
+# Fields with their Thrift type and field id. The generic code writes the fields ordered by field id.
+_FIELDS = (
+    ('ipAddress', _TYPE_STRING, 100),
+    ('timestamp', _TYPE_I64, 200),
+    ('encoding', _TYPE_STRING, 210),
+    ('collector', _TYPE_STRING, 220),
+    ('userAgent', _TYPE_STRING, 300),
+    ('refererUri', _TYPE_STRING, 310),
+    ('path', _TYPE_STRING, 320),
+    ('querystring', _TYPE_STRING, 330),
+    ('body', _TYPE_STRING, 340),
+    ('headers', _TYPE_LIST, 350),
+    ('contentType', _TYPE_STRING, 360),
+    ('hostname', _TYPE_STRING, 400),
+    ('networkUserId', _TYPE_STRING, 410),
+    ('schema', _TYPE_STRING, 31337),
+)
+
+
+def _encode_string(value: str) -> bytes:
+    data = value.encode('utf-8')
+    return _I32.pack(len(data)) + data
+
+
+def encode_collector_payload(payload: CollectorPayload) -> bytes:
+    """ Serialize payload with the Thrift binary protocol. """
+    parts: List[bytes] = []
+    for name, field_type, field_id in _FIELDS:
+        value = getattr(payload, name)
+        if value is None:
+            continue
+        parts.append(_FIELD_HEADER.pack(field_type, field_id))
+        if field_type == _TYPE_STRING:
+            parts.append(_encode_string(value))
+        elif field_type == _TYPE_I64:
+            parts.append(_I64.pack(value))
+        else:
+            # list of strings: element type (byte), and number of elements (i32)
+            parts.append(_LIST_HEADER.pack(_TYPE_STRING, len(value)))
+            parts.extend(_encode_string(item) for item in value)
+    parts.append(_STOP)
+    return b''.join(parts)
+
+
+def encode_collector_payload_generic(payload: CollectorPayload) -> bytes:
+    """
+    Serialize payload with the generated Thrift code and the generic binary protocol. This is slow, and
+    only used to verify encode_collector_payload().
+    """
+    # only import if needed, the generated module is large
+    from thrift.protocol import TBinaryProtocol
+    from thrift.transport import TTransport
+    from objectiv_backend.snowplow.schema import ttypes
+
+    transport = TTransport.TMemoryBuffer()
+    protocol = TBinaryProtocol.TBinaryProtocol(transport)
+    ttypes.CollectorPayload(**payload._asdict()).write(protocol)  # type: ignore
+    return transport.getvalue()
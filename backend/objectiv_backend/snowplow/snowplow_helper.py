@@ -1,22 +1,18 @@
-from typing import Dict, List
+from typing import Dict, List, Any
 
 import base64
-import json
+from concurrent.futures import wait
 from datetime import datetime
 from urllib.parse import urlparse
 
-
-from objectiv_backend.snowplow.schema.ttypes import CollectorPayload  # type: ignore
-
-from google.cloud import pubsub_v1
-
-from thrift.protocol import TBinaryProtocol
-from thrift.transport import TTransport
-
 from objectiv_backend.common.config import SnowplowConfig
-from objectiv_backend.common.event_utils import get_context
+from objectiv_backend.common.event_utils import get_optional_context
+from objectiv_backend.common.json_codec import json_dumps, json_loads
+from objectiv_backend.common.metrics import SNOWPLOW_MESSAGES
+from objectiv_backend.common.per_process import PerProcess
 from objectiv_backend.common.types import EventDataList, EventData
 from objectiv_backend.schema.validate_events import EventError, ErrorInfo
+from objectiv_backend.snowplow.collector_payload import CollectorPayload, encode_collector_payload
 
 
 def make_snowplow_custom_context(snowplow_event: Dict, config: SnowplowConfig) -> str:
@@ -25,7 +21,7 @@ def make_snowplow_custom_context(snowplow_event: Dict, config: SnowplowConfig) -
         'schema': snowplow_contexts_schema,
         'data': [snowplow_event]
     }
-    outer_event_json = json.dumps(outer_event)
+    outer_event_json = json_dumps(outer_event)
     return str(base64.b64encode(outer_event_json.encode('UTF-8')), 'UTF-8')
 
 
@@ -42,20 +38,9 @@ def objectiv_event_to_snowplow_payload(event: EventData, config: SnowplowConfig)
     snowplow_payload_data_schema = config.schema_payload_data
     snowplow_collector_payload_schema = config.schema_collector_payload
 
-    try:
-        http_context = get_context(event, 'HttpContext')
-    except ValueError:
-        http_context = {}
-
-    try:
-        cookie_context = get_context(event, 'CookieIdContext')
-    except ValueError:
-        cookie_context = {}
-
-    try:
-        path_context = get_context(event, 'PathContext')
-    except ValueError:
-        path_context = {}
+    http_context = get_optional_context(event, 'HttpContext') or {}
+    cookie_context = get_optional_context(event, 'CookieIdContext') or {}
+    path_context = get_optional_context(event, 'PathContext') or {}
 
     query_string = urlparse(str(path_context.get('id', ''))).query
 
@@ -77,19 +62,19 @@ def objectiv_event_to_snowplow_payload(event: EventData, config: SnowplowConfig)
     }
     return CollectorPayload(
         schema=snowplow_collector_payload_schema,
-        ipAddress=http_context.get('remote_address', ''),
+        ipAddress=str(http_context.get('remote_address', '')),
         timestamp=int(datetime.now().timestamp() * 1000),
         encoding='UTF-8',
         collector='objectiv_collector',
-        userAgent=http_context.get('user_agent', ''),
-        refererUri=http_context.get('referrer', ''),
+        userAgent=str(http_context.get('user_agent', '')),
+        refererUri=str(http_context.get('referrer', '')),
         path='/com.snowplowanalytics.snowplow/tp2',
         querystring=query_string,
-        body=json.dumps(payload),
+        body=json_dumps(payload),
         headers=[],
         contentType='application/json',
         hostname='',
-        networkUserId=cookie_context.get('id', '')
+        networkUserId=str(cookie_context.get('id', ''))
     )
 
 
@@ -100,11 +85,7 @@ def payload_to_thrift(payload: CollectorPayload) -> bytes:
     :param payload: CollectorPayload - class instance representing Thrift message
     :return: serialized string
     """
-    transport = TTransport.TMemoryBuffer()
-    protocol = TBinaryProtocol.TBinaryProtocol(transport)
-    payload.write(protocol)
-
-    return transport.getvalue()
+    return encode_collector_payload(payload)
 
 
 def snowplow_schema_violation(payload: CollectorPayload, config: SnowplowConfig,
@@ -122,7 +103,7 @@ def snowplow_schema_violation(payload: CollectorPayload, config: SnowplowConfig,
             })
 
     parameters = []
-    data = json.loads(payload.body)['data'][0]
+    data = json_loads(payload.body)['data'][0]
     for key, value in data.items():
         parameters.append({
             "name": key,
@@ -133,7 +114,7 @@ def snowplow_schema_violation(payload: CollectorPayload, config: SnowplowConfig,
     event = {}
     if 'cx' in data:
         context_container_encoded = data['cx']
-        context_container_decoded = json.loads(base64.b64decode(context_container_encoded).decode('utf-8'))
+        context_container_decoded = json_loads(base64.b64decode(context_container_encoded))
         contexts = context_container_decoded['data']
         for context in contexts:
             if 'schema' in context and context['schema'] == config.schema_objectiv_taxonomy and 'data' in context:
@@ -201,9 +182,39 @@ def snowplow_schema_violation(payload: CollectorPayload, config: SnowplowConfig,
     }
 
 
+def _create_publisher(config: SnowplowConfig) -> Any:
+    # only import when publishing, the google cloud libraries are slow to import
+    from google.cloud import pubsub_v1
+    batch_settings = pubsub_v1.types.BatchSettings(
+        max_messages=config.gcp_pubsub_max_messages,
+        max_bytes=config.gcp_pubsub_max_bytes,
+        max_latency=config.gcp_pubsub_max_latency_seconds
+    )
+    return pubsub_v1.PublisherClient(batch_settings=batch_settings)
+
+
+# Creating a publisher is expensive, and a publisher batches the messages that are published from all threads
+_PUBLISHER: PerProcess[Any] = PerProcess(_create_publisher)
+
+
+def get_publisher(config: SnowplowConfig) -> Any:
+    """ Give the process-wide pubsub_v1.PublisherClient, with the batch settings of config. """
+    return _PUBLISHER.get(config)
+
+
 def write_data_to_pubsub(events: EventDataList, config: SnowplowConfig,
                          channel: str = 'good',
-                         event_errors: List[EventError] = None) -> None:
+                         event_errors: List[EventError] = None,
+                         publisher: Any = None) -> None:
+    """
+    Publish the events to the raw topic (channel 'good'), or as schema violations to the bad topic (channel
+    'bad'). The messages are batched by the publisher, this waits till all messages are published.
+    :param publisher: publisher to use, by default the process-wide publisher, see get_publisher()
+    :raise Exception: if publishing fails for any of the messages, or takes longer than
+        config.gcp_pubsub_timeout_seconds
+    """
+    if not events:
+        return
 
     project = config.gcp_project
     if channel == 'good':
@@ -213,26 +224,36 @@ def write_data_to_pubsub(events: EventDataList, config: SnowplowConfig,
         # not ok events get sent to the bad topic
         topic = config.gcp_pubsub_topic_bad
 
-    publisher = pubsub_v1.PublisherClient()
+    if publisher is None:
+        publisher = get_publisher(config)
     topic_path = f'projects/{project}/topics/{topic}'
 
+    # index the errors on event_id. If there are multiple errors for an event, the last one is used
+    errors_by_event_id: Dict[Any, EventError] = {ee.event_id: ee for ee in event_errors or []}
+
+    futures = []
     for event in events:
         payload: CollectorPayload = objectiv_event_to_snowplow_payload(event=event, config=config)
         if channel == 'good':
             data = payload_to_thrift(payload)
         else:
-            event_error = None
-            # try to find errors for the current event_id
-            if event_errors:
-                for ee in event_errors:
-                    if ee.event_id == event['id']:
-                        event_error = ee
+            event_error = errors_by_event_id.get(event['id'])
             failed_event = snowplow_schema_violation(payload=payload, config=config, event_error=event_error)
 
             # serialize (json) and encode to bytestring for publishing
-            data = json.dumps(failed_event, separators=(',', ':')).encode('utf-8')
-
-        publisher.publish(topic_path, data)
+            data = json_dumps(failed_event).encode('utf-8')
+
+        futures.append(publisher.publish(topic_path, data))
+
+    done, not_done = wait(futures, timeout=config.gcp_pubsub_timeout_seconds)
+    errors = [future.exception() for future in done if future.exception() is not None]
+    failed = len(errors) + len(not_done)
+    SNOWPLOW_MESSAGES.inc(len(futures) - failed, channel=channel, result='published')
+    if failed:
+        SNOWPLOW_MESSAGES.inc(failed, channel=channel, result='failed')
+        first_error = errors[0] if errors else 'timeout'
+        raise Exception(f'Publishing to {topic_path} failed for {failed} of {len(futures)} messages, '
+                        f'first error: {first_error}')
 
 
 def write_data_to_kinesis(events: EventDataList) -> None:
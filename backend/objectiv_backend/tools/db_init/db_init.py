@@ -3,6 +3,16 @@ Tool that connects to the database and creates the needed tables as defined in c
 If a duplicate-table error is encounterd, then the script will assume that the databse is already
 initialized correctly and exit successfully.
 
+If partitioning is configured (POSTGRES_DATA_PARTITIONED), the data and nok_data tables are replaced by
+tables that are partitioned by day as defined in data_partitioned.sql, and partitions are created for the
+coming days. This is only possible if the tables are still empty.
+
+If the 'extracted' data layout is configured (POSTGRES_DATA_LAYOUT), the data table is changed to that
+layout as defined in data_layout_extracted.sql. This is done for new as well as for existing databases.
+
+If the 'rotating' queue layout is configured (POSTGRES_QUEUE_LAYOUT), the queue tables are replaced by
+tables that are partitioned in buckets as defined in queue_rotating.sql. Events on the queues are kept.
+
 This assumes that the user and database already exist.
 
 Copyright 2021 Objectiv B.V.
@@ -10,21 +20,24 @@ Copyright 2021 Objectiv B.V.
 import argparse
 import os
 import sys
+from datetime import datetime
 from time import sleep
 
 import psycopg2
 
-from objectiv_backend.common.config import get_config_postgres
+from objectiv_backend.common.config import get_config_postgres, PG_DATA_LAYOUT, PG_DATA_PARTITIONED, \
+    PG_QUEUE_LAYOUT
 from objectiv_backend.common.db import get_db_connection
+from objectiv_backend.tools.db_partitions.db_partitions import maintain_partitions
 
 _MAX_RETRIES = 5
 _POSTGRES_DUPLICATE_TABLE_ERROR = '42P07'
 
 
-def get_sql() -> str:
-    """ get content of ../../create_tables.sql as string """
+def get_sql(name: str = 'create_tables.sql') -> str:
+    """ get content of ../../<name> as string """
     dirname = os.path.dirname(__file__)
-    filename = os.path.join(dirname, '../../create_tables.sql')
+    filename = os.path.join(dirname, '../../', name)
     with open(filename) as f:
         return f.read()
 
@@ -56,9 +69,18 @@ def main():
                         help="Instead of running sql to setup schema, print it to stdout")
     args = parser.parse_args(sys.argv[1:])
     sql = get_sql()
+    partitioned_sql = get_sql('data_partitioned.sql') if PG_DATA_PARTITIONED else None
+    layout_sql = get_sql('data_layout_extracted.sql') if PG_DATA_LAYOUT == 'extracted' else None
+    queue_sql = get_sql('queue_rotating.sql') if PG_QUEUE_LAYOUT == 'rotating' else None
 
     if args.print:
         print(sql)
+        if partitioned_sql:
+            print(partitioned_sql)
+        if layout_sql:
+            print(layout_sql)
+        if queue_sql:
+            print(queue_sql)
         exit(0)
 
     connection = get_connection_with_retries(args.retry)
@@ -67,10 +89,21 @@ def main():
             cursor.execute(sql)
             print('Succesfully initialized database.')
         except psycopg2.Error as error:
-            if error.pgcode == _POSTGRES_DUPLICATE_TABLE_ERROR:
-                print('Got "duplicate table error", assuming database is already initialized')
-                exit(0)
-            raise
+            if error.pgcode != _POSTGRES_DUPLICATE_TABLE_ERROR:
+                raise
+            print('Got "duplicate table error", assuming database is already initialized')
+            connection.rollback()
+        if partitioned_sql:
+            cursor.execute(partitioned_sql)
+            print('Data tables are partitioned by day.')
+        if layout_sql:
+            cursor.execute(layout_sql)
+            print('Data table has the extracted layout.')
+        if queue_sql:
+            cursor.execute(queue_sql)
+            print('Queue tables have the rotating layout.')
+    if PG_DATA_PARTITIONED:
+        maintain_partitions(connection, today=datetime.utcnow().date())
 
 
 if __name__ == '__main__':
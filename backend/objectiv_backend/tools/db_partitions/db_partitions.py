@@ -0,0 +1,177 @@
+"""
+Tool to maintain the day-partitions of the data and nok_data tables, if these tables are partitioned
+(POSTGRES_DATA_PARTITIONED, see data_partitioned.sql).
+
+ * Creates partitions for today and the coming days, so events are not written to the default partitions.
+   If a default partition contains rows for a day, those rows are moved to the new partition.
+ * Optionally archives partitions that are older than a retention period: the partitions are detached,
+   and moved to an archive schema, or dropped.
+
+This is meant to be run periodically, e.g. daily from a cron job.
+
+Copyright 2021 Objectiv B.V.
+"""
+import argparse
+import re
+import sys
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+from psycopg2 import sql
+
+from objectiv_backend.common.config import get_config_postgres
+from objectiv_backend.common.db import get_db_connection
+
+PARTITIONED_TABLES = ('data', 'nok_data')
+# Number of days, after today, for which partitions are created by default
+DEFAULT_DAYS_AHEAD = 7
+DEFAULT_ARCHIVE_SCHEMA = 'archive'
+
+_PARTITION_NAME_FORMAT = '{table_name}_p{day:%Y%m%d}'
+_PARTITION_NAME_REGEX = r'^{table_name}_p(\d{{4}})(\d{{2}})(\d{{2}})$'
+
+
+def partition_name(table_name: str, day: date) -> str:
+    """ Give the name of the partition of table_name that contains the rows for day. """
+    return _PARTITION_NAME_FORMAT.format(table_name=table_name, day=day)
+
+
+def parse_partition_day(table_name: str, name: str) -> Optional[date]:
+    """ Give the day of a partition of table_name, or None if name is not a day-partition of the table. """
+    match = re.match(_PARTITION_NAME_REGEX.format(table_name=re.escape(table_name)), name)
+    if match is None:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+
+
+def get_partition_days(connection, table_name: str) -> List[date]:
+    """ Give the days for which table_name has a partition, sorted. """
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            select child.relname
+            from pg_inherits
+            inner join pg_class as child on child.oid = pg_inherits.inhrelid
+            where pg_inherits.inhparent = %s::regclass
+        ''', (table_name, ))
+        names = [row[0] for row in cursor.fetchall()]
+    days = [parse_partition_day(table_name, name) for name in names]
+    return sorted(day for day in days if day is not None)
+
+
+def create_partition(connection, table_name: str, day: date):
+    """
+    Create the partition of table_name for day, in its own transaction. Rows for day that are in the
+    default partition are moved to the new partition.
+    """
+    partition = sql.Identifier(partition_name(table_name, day))
+    table = sql.Identifier(table_name)
+    default_partition = sql.Identifier(f'{table_name}_default')
+    with connection:
+        with connection.cursor() as cursor:
+            # Create the partition as a separate table first, so we can move rows from the default partition
+            # before attaching it. Attaching fails if the default partition contains rows for the day, so
+            # until then no rows can be inserted in the default partition. The lock conflicts with inserts,
+            # but not with reads, and is released at commit.
+            cursor.execute(
+                sql.SQL('lock table {default_partition} in share row exclusive mode')
+                .format(default_partition=default_partition)
+            )
+            cursor.execute(
+                sql.SQL('create table {partition} (like {table} including defaults including constraints)')
+                .format(partition=partition, table=table)
+            )
+            cursor.execute(
+                sql.SQL('''
+                    with moved as (
+                        delete from {default_partition} where day = %s returning *
+                    )
+                    insert into {partition} select * from moved
+                ''').format(default_partition=default_partition, partition=partition),
+                (day, )
+            )
+            if cursor.rowcount:
+                print(f'Moved {cursor.rowcount} rows from {table_name}_default to the new partition')
+            cursor.execute(
+                sql.SQL('alter table {table} attach partition {partition} for values from (%s) to (%s)')
+                .format(table=table, partition=partition),
+                (day, day + timedelta(days=1))
+            )
+
+
+def archive_partition(connection, table_name: str, day: date, archive_schema: Optional[str]):
+    """
+    Detach the partition of table_name for day, in its own transaction. The detached table is moved to
+    archive_schema, or dropped if archive_schema is None.
+    """
+    partition = sql.Identifier(partition_name(table_name, day))
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                sql.SQL('alter table {table} detach partition {partition}')
+                .format(table=sql.Identifier(table_name), partition=partition)
+            )
+            if archive_schema is None:
+                cursor.execute(sql.SQL('drop table {partition}').format(partition=partition))
+            else:
+                schema = sql.Identifier(archive_schema)
+                cursor.execute(sql.SQL('create schema if not exists {schema}').format(schema=schema))
+                cursor.execute(
+                    sql.SQL('alter table {partition} set schema {schema}')
+                    .format(partition=partition, schema=schema)
+                )
+
+
+def maintain_partitions(connection,
+                        today: date,
+                        days_ahead: int = DEFAULT_DAYS_AHEAD,
+                        retention_days: Optional[int] = None,
+                        archive_schema: Optional[str] = DEFAULT_ARCHIVE_SCHEMA):
+    """
+    Make sure all partitioned tables have partitions from today up to and including today + days_ahead.
+    If retention_days is set, partitions for days before today - retention_days are archived, see
+    archive_partition().
+    """
+    for table_name in PARTITIONED_TABLES:
+        existing_days = set(get_partition_days(connection, table_name))
+        for day in (today + timedelta(days=offset) for offset in range(days_ahead + 1)):
+            if day not in existing_days:
+                print(f'Creating partition {partition_name(table_name, day)}')
+                create_partition(connection, table_name, day)
+        if retention_days is None:
+            continue
+        first_day = today - timedelta(days=retention_days)
+        for day in sorted(existing_days):
+            if day < first_day:
+                action = f'Archiving to schema {archive_schema}' if archive_schema else 'Dropping'
+                print(f'{action}: partition {partition_name(table_name, day)}')
+                archive_partition(connection, table_name, day, archive_schema)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create and archive partitions of the data tables')
+    parser.add_argument('--days-ahead', type=int, default=DEFAULT_DAYS_AHEAD,
+                        help='Number of days after today for which partitions are created')
+    parser.add_argument('--retention-days', type=int, default=None,
+                        help='Archive partitions for days that are more than this number of days ago. '
+                             'By default no partitions are archived')
+    parser.add_argument('--archive-schema', default=DEFAULT_ARCHIVE_SCHEMA,
+                        help='Schema to move archived partitions to')
+    parser.add_argument('--drop', action='store_true',
+                        help='Drop archived partitions, instead of moving them to the archive schema')
+    args = parser.parse_args(sys.argv[1:])
+
+    pg_config = get_config_postgres()
+    if pg_config is None:
+        raise Exception('Missing Postgres configuration')
+    connection = get_db_connection(pg_config)
+    maintain_partitions(connection,
+                        # The day column is in UTC, see pg_storage.py
+                        today=datetime.utcnow().date(),
+                        days_ahead=args.days_ahead,
+                        retention_days=args.retention_days,
+                        archive_schema=None if args.drop else args.archive_schema)
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
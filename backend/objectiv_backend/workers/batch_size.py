@@ -0,0 +1,111 @@
+"""
+Copyright 2021 Objectiv B.V.
+"""
+import threading
+import time
+from typing import Callable
+
+from psycopg2.errors import LockNotAvailable
+
+from objectiv_backend.common.config import WORKER_BATCH_SIZE, WORKER_BATCH_SIZE_MIN, WORKER_BATCH_SIZE_MAX, \
+    WORKER_BATCH_TARGET_SECONDS
+from objectiv_backend.common.metrics import WORKER_BATCH_EVENTS, WORKER_BATCH_SECONDS, WORKER_LOCK_TIMEOUTS, \
+    WORKER_CURRENT_BATCH_SIZE
+
+# Factor by which the batch size grows after a full batch that was faster than the target duration
+_GROWTH_FACTOR = 2
+# Factor by which the batch size shrinks after a lock timeout
+_CONTENTION_FACTOR = 0.5
+
+
+class AdaptiveBatchSize:
+    """
+    Batch size for a queue worker, that adapts to the queue depth and transaction latency.
+
+    * A full batch means the queue holds at least as many events as the batch size. If the batch was
+      also processed faster than the target duration, the batch size grows, so a backlog is processed
+      with fewer and larger transactions.
+    * If a batch took longer than the target duration, e.g. because of lock waits, the batch size
+      shrinks proportionally.
+    * If a batch hit a lock timeout, the batch size is halved.
+
+    The batch size always stays within [min_size, max_size]. Thread-safe, so it can be shared by all
+    consumers of a queue within a process.
+    """
+
+    def __init__(self,
+                 name: str = 'worker',
+                 initial_size: int = WORKER_BATCH_SIZE,
+                 min_size: int = WORKER_BATCH_SIZE_MIN,
+                 max_size: int = WORKER_BATCH_SIZE_MAX,
+                 target_seconds: float = WORKER_BATCH_TARGET_SECONDS):
+        if min_size < 1 or min_size > max_size:
+            raise ValueError(f'Invalid batch size bounds. Must have 1 <= min_size <= max_size, '
+                             f'min_size: {min_size}, max_size: {max_size}')
+        if target_seconds <= 0:
+            raise ValueError(f'Invalid target duration, must be positive: {target_seconds}')
+        # name of the worker, used as label of the worker metrics
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self._size = self._bound(initial_size)
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def record_batch(self, batch_size: int, event_count: int, duration: float):
+        """
+        Adapt the batch size after a batch was processed successfully.
+        :param batch_size: the batch size that was used for the batch
+        :param event_count: number of events that was actually processed
+        :param duration: processing time of the batch in seconds
+        """
+        with self._lock:
+            if duration > self.target_seconds:
+                self._size = self._bound(int(batch_size * self.target_seconds / duration))
+            elif event_count >= batch_size:
+                self._size = self._bound(max(self._size, batch_size * _GROWTH_FACTOR))
+            # Otherwise the queue is (nearly) empty and processed in time: no reason to change anything
+
+    def record_lock_timeout(self):
+        """ Shrink the batch size after a batch failed because of a lock timeout. """
+        with self._lock:
+            self._size = self._bound(int(self._size * _CONTENTION_FACTOR))
+
+    def _bound(self, size: int) -> int:
+        return min(self.max_size, max(self.min_size, size))
+
+
+def run_batch(batch_size: AdaptiveBatchSize, process: Callable[[int], int]) -> int:
+    """
+    Call process with the current batch size, and adapt the batch size based on the result. The number of
+    events and processing time of batches that contain events are recorded in the worker metrics.
+
+    A lock timeout is not fatal: process is expected to have rolled back its transaction, so the events
+    stay on the queue and will be retried with a smaller batch.
+    :param batch_size: batch size to use and adapt
+    :param process: function that processes a batch of at most the given number of events in a single
+        transaction, and returns the number of processed events.
+    :return: number of processed events
+    """
+    size = batch_size.size
+    start = time.time()
+    try:
+        event_count = process(size)
+    except LockNotAvailable:
+        batch_size.record_lock_timeout()
+        WORKER_LOCK_TIMEOUTS.inc(worker=batch_size.name)
+        WORKER_CURRENT_BATCH_SIZE.set(batch_size.size, worker=batch_size.name)
+        print(f'Lock timeout while processing batch of size {size}, batch size is now {batch_size.size}')
+        return 0
+    duration = time.time() - start
+    batch_size.record_batch(batch_size=size, event_count=event_count, duration=duration)
+    WORKER_CURRENT_BATCH_SIZE.set(batch_size.size, worker=batch_size.name)
+    # Empty batches are only polls of an empty queue, so they would skew the statistics of the batches
+    if event_count:
+        WORKER_BATCH_EVENTS.observe(event_count, worker=batch_size.name)
+        WORKER_BATCH_SECONDS.observe(duration, worker=batch_size.name)
+    return event_count
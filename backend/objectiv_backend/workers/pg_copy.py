@@ -0,0 +1,119 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Functions to bulk load rows into Postgres tables with `COPY ... FROM STDIN`.
+
+Compared to multi-row insert statements, COPY transfers all rows in a single statement and skips
+parsing of large SQL strings. The rows are serialized in COPY's text format while they are streamed to
+the database, so a batch never needs to be fully materialized as a single string.
+"""
+import io
+from typing import Iterable, Sequence, List, Any, Iterator
+
+from psycopg2 import sql
+
+# Size of the chunks in which data is sent to the database
+_COPY_BUFFER_SIZE = 65536
+
+
+def _escape_copy_text(value: Any) -> str:
+    """ Give the representation of value in Postgres' COPY text format. """
+    text = str(value)
+    if '\\' in text:
+        text = text.replace('\\', '\\\\')
+    if '\t' in text or '\n' in text or '\r' in text:
+        text = text.replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return text
+
+
+class _CopyRowsFile(io.TextIOBase):
+    """
+    Read-only file-like object that gives the rows in Postgres' COPY text format. Rows are only
+    serialized when they are read.
+    """
+
+    def __init__(self, rows: Iterable[Sequence[Any]]):
+        self._rows: Iterator[Sequence[Any]] = iter(rows)
+        self._pending = ''
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:  # type: ignore
+        chunks = [self._pending]
+        length = len(self._pending)
+        while size < 0 or length < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            line = '\t'.join([_escape_copy_text(value) for value in row]) + '\n'
+            chunks.append(line)
+            length += len(line)
+        data = ''.join(chunks)
+        if size < 0:
+            size = length
+        result, self._pending = data[:size], data[size:]
+        return result
+
+
+def copy_rows(cursor, table_name: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]):
+    """
+    Load rows into the table with `COPY ... FROM STDIN`.
+    Does not do any transaction management.
+    :param cursor: psycopg2 cursor
+    :param table_name: table to load the rows into
+    :param columns: names of the columns, in the same order as the values in each row
+    :param rows: iterable of rows. Values are converted to strings, and must not be None
+    """
+    query = sql.SQL('copy {table} ({columns}) from stdin').format(
+        table=sql.Identifier(table_name),
+        columns=sql.SQL(', ').join(sql.Identifier(column) for column in columns)
+    )
+    cursor.copy_expert(query, _CopyRowsFile(rows), size=_COPY_BUFFER_SIZE)
+
+
+def copy_rows_on_conflict_do_nothing(cursor,
+                                     table_name: str,
+                                     columns: Sequence[str],
+                                     rows: Iterable[Sequence[Any]],
+                                     returning: str) -> List[Any]:
+    """
+    Load rows into the table, skipping rows that conflict with existing rows. Equivalent to an
+    `insert ... on conflict do nothing returning ...` of all rows, but the rows are loaded with
+    `COPY ... FROM STDIN` into a temporary staging table first. The staging table is created once per
+    database session, and is emptied on commit.
+
+    Does not do any transaction management. The same locking considerations apply as for a regular
+    `insert ... on conflict do nothing`, see insert_events_into_data()
+
+    :param cursor: psycopg2 cursor
+    :param table_name: table to load the rows into
+    :param columns: names of the columns, in the same order as the values in each row
+    :param rows: iterable of rows. Values are converted to strings, and must not be None
+    :param returning: name of the column to return for the inserted rows
+    :return: list with the value of the `returning` column for all rows that were actually inserted.
+    """
+    staging_table_name = f'staging_{table_name}'
+    staging_table = sql.Identifier(staging_table_name)
+    column_list = sql.SQL(', ').join(sql.Identifier(column) for column in columns)
+    cursor.execute(
+        sql.SQL('create temporary table if not exists {staging} (like {table}) on commit delete rows')
+        .format(staging=staging_table, table=sql.Identifier(table_name))
+    )
+    # The staging table might already contain rows, if this is called multiple times in one transaction
+    cursor.execute(sql.SQL('delete from {staging}').format(staging=staging_table))
+    copy_rows(cursor, table_name=staging_table_name, columns=columns, rows=rows)
+    cursor.execute(
+        sql.SQL('''
+            insert into {table} ({columns})
+            select {columns} from {staging}
+            on conflict do nothing
+            returning {returning}
+        ''').format(
+            table=sql.Identifier(table_name),
+            columns=column_list,
+            staging=staging_table,
+            returning=sql.Identifier(returning)
+        )
+    )
+    return [row[0] for row in cursor.fetchall()]
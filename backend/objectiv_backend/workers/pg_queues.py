@@ -1,15 +1,23 @@
 """
 Copyright 2021 Objectiv B.V.
 """
-import json
-import uuid
+import select
+import time
 from enum import Enum
-from typing import List, Tuple
+from typing import List, Iterable, Callable, Sequence, Any
 
-import psycopg2
+from psycopg2.errors import LockNotAvailable
 from psycopg2.extras import execute_values
 
+from objectiv_backend.common.config import PG_WRITE_ENGINE, PG_QUEUE_LAYOUT, PG_QUEUE_BUCKET_SECONDS
+from objectiv_backend.common.json_codec import json_dumps
 from objectiv_backend.common.types import EventDataList
+from objectiv_backend.workers.pg_copy import copy_rows
+
+# Number of buckets of a queue with the 'rotating' layout. Must match queue_rotating.sql
+QUEUE_BUCKET_COUNT = 4
+# Maximum time to wait for consumers of a bucket to finish their transaction, before it can be truncated
+_TRUNCATE_LOCK_TIMEOUT = '2s'
 
 
 class ProcessingStage(Enum):
@@ -27,14 +35,34 @@ class PostgresQueues:
 
     This class assumes that the postgres connection has the isolation level ISOLATION_LEVEL_READ_COMMITTED
     set.
+
+    When events are put on a queue, a notification is sent on the queue's channel. Consumers can use
+    listen() and wait_for_notification() to wake up as soon as there is work, instead of polling.
+
+    With the 'rotating' queue layout (see PG_QUEUE_LAYOUT), events are put in the bucket of the current time
+    period. Buckets must be truncated with truncate_drained_buckets() once their events are consumed.
     """
 
-    def __init__(self, connection):
+    def __init__(self,
+                 connection,
+                 write_engine: str = PG_WRITE_ENGINE,
+                 queue_layout: str = PG_QUEUE_LAYOUT,
+                 bucket_seconds: float = PG_QUEUE_BUCKET_SECONDS,
+                 clock: Callable[[], float] = time.time):
         """
         Create a new PostgresQueues object
         :param connection: psycopg2 database connection, must have ISOLATION_LEVEL_READ_COMMITTED set.
+        :param write_engine: 'insert' or 'copy', see PG_WRITE_ENGINE
+        :param queue_layout: 'table' or 'rotating', see PG_QUEUE_LAYOUT
+        :param bucket_seconds: period during which events are put in the same bucket, if queue_layout is
+            'rotating'. See PG_QUEUE_BUCKET_SECONDS
+        :param clock: function that gives the current time, in seconds since the epoch
         """
         self.connection = connection
+        self.write_engine = write_engine
+        self.queue_layout = queue_layout
+        self.bucket_seconds = bucket_seconds
+        self._clock = clock
 
     @staticmethod
     def _queue_to_table(queue: ProcessingStage):
@@ -44,6 +72,54 @@ class PostgresQueues:
             return 'queue_finalize'
         raise Exception('Implementation incomplete')
 
+    @staticmethod
+    def _queue_to_channel(queue: ProcessingStage):
+        # We use the table name as channel name
+        return PostgresQueues._queue_to_table(queue)
+
+    @staticmethod
+    def _bucket_to_table(queue: ProcessingStage, bucket: int):
+        return f'{PostgresQueues._queue_to_table(queue)}_b{bucket}'
+
+    def get_current_bucket(self) -> int:
+        """ Give the bucket in which events are put at this moment, with the 'rotating' queue layout. """
+        return int(self._clock() // self.bucket_seconds) % QUEUE_BUCKET_COUNT
+
+    def listen(self, queues: Iterable[ProcessingStage]):
+        """
+        Start listening for notifications on the channels of the given queues. Unlike the other methods
+        this commits the current transaction, as listening only starts after a commit.
+        """
+        with self.connection.cursor() as cursor:
+            for queue in queues:
+                cursor.execute(f'listen {self._queue_to_channel(queue)};')
+        self.connection.commit()
+
+    def wait_for_notification(self, timeout: float) -> bool:
+        """
+        Wait till a notification arrives on any of the channels that we listen() to, or till the timeout
+        expires. Must be called outside a transaction.
+
+        Notifications that arrived before this call, e.g. while processing the previous batch, are also
+        taken into account. So no notifications are missed between checking a queue and calling this.
+        :param timeout: maximum time to wait in seconds
+        :return: True if there were notifications, False if the timeout expired
+        """
+        if not self.connection.notifies:
+            readable, _, _ = select.select([self.connection], [], [], timeout)
+            if not readable:
+                return False
+            self.connection.poll()
+        notified = bool(self.connection.notifies)
+        self.connection.notifies.clear()
+        return notified
+
+    def get_queue_depth(self, queue: ProcessingStage) -> int:
+        """ Give the number of events on a queue, including events that are being processed. """
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'select count(*) from {self._queue_to_table(queue)};')
+            return cursor.fetchone()[0]
+
     def get_events(self, queue: ProcessingStage, max_items: int) -> EventDataList:
         """
         Get a list of events from a queue for processing.
@@ -53,27 +129,32 @@ class PostgresQueues:
         :return: list of events with id, at most max_items, but can be less.
         """
         table_name = self._queue_to_table(queue)
+        # We select on insert_order, which is unique, instead of on event_id. Multiple queue entries can
+        # have the same event_id (e.g. an event sent twice by a tracker). Deleting on event_id could then
+        # delete (and wait for) rows that are locked by another transaction, which can deadlock.
         query = f'''
             delete from {table_name}
-            where event_id in (
-                select event_id
+            where insert_order in (
+                select insert_order
                 from {table_name}
                 order by insert_order asc
                 limit %s
                 for update skip locked
             )
-            returning event_id, value;
+            returning value;
         '''
-        with self.connection.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor) as cursor:
+        with self.connection.cursor() as cursor:
             cursor.execute(query, (max_items, ))
-            events_with_id: EventDataList = cursor.fetchall()
-        return events_with_id
+            # psycopg2 parses the json values into dicts
+            events: EventDataList = [row[0] for row in cursor.fetchall()]
+        return events
 
     def put_events(self,
                    queue: ProcessingStage,
                    events: EventDataList):
         """
-        Put an event with a given event-id on a queue
+        Put an event with a given event-id on a queue, and notify listeners of the queue. The notification
+        is delivered when the transaction is committed.
 
         :param queue: Which queue to put the event on
         :param events: list of events with ids
@@ -81,11 +162,80 @@ class PostgresQueues:
         if not events:
             return
         table_name = self._queue_to_table(queue)
-        insert_query = f'''
-            insert into
-            {table_name}(event_id, value)
-            values %s
-            '''
-        values: List[Tuple[uuid.UUID, str]] = [(event['id'], json.dumps(event)) for event in events]
+        columns: Sequence[str] = ('event_id', 'value')
+        values: List[Sequence[Any]] = [(event['id'], json_dumps(event)) for event in events]
+        if self.queue_layout == 'rotating':
+            # Insert directly in the bucket, so no other buckets are locked
+            bucket = self.get_current_bucket()
+            table_name = self._bucket_to_table(queue, bucket)
+            columns = ('event_id', 'value', 'bucket')
+            values = [(event_id, value, bucket) for event_id, value in values]
         with self.connection.cursor() as cursor:
-            execute_values(cursor, insert_query, values, template=None, page_size=100)
+            if self.write_engine == 'copy':
+                copy_rows(cursor, table_name=table_name, columns=columns, rows=values)
+            else:
+                insert_query = f'''
+                    insert into
+                    {table_name}({', '.join(columns)})
+                    values %s
+                    '''
+                execute_values(cursor, insert_query, values, template=None, page_size=100)
+            # Postgres only delivers one notification per channel per transaction, so calling this multiple
+            # times in a transaction is cheap.
+            cursor.execute(f'notify {self._queue_to_channel(queue)};')
+
+    def truncate_drained_buckets(self,
+                                 queues: Iterable[ProcessingStage] = tuple(ProcessingStage)) -> List[str]:
+        """
+        Truncate the buckets of the queues that are not written to anymore, and of which all events are
+        consumed. This removes the dead rows of the consumed events, without needing vacuum. Only does
+        something with the 'rotating' queue layout.
+
+        Unlike the other methods this commits: every bucket is truncated in its own transaction, as
+        truncating keeps a bucket locked till the end of the transaction. Must be called outside a
+        transaction. A bucket that is still locked by a consumer after _TRUNCATE_LOCK_TIMEOUT is skipped,
+        it will be truncated by a later call.
+        :param queues: queues of which to truncate the buckets
+        :return: names of the truncated bucket tables
+        """
+        if self.queue_layout != 'rotating':
+            return []
+        current_bucket = self.get_current_bucket()
+        table_names = [self._bucket_to_table(queue, bucket)
+                       for queue in queues
+                       for bucket in range(QUEUE_BUCKET_COUNT) if bucket != current_bucket]
+        if not table_names:
+            return []
+        truncated: List[str] = []
+        with self.connection.cursor() as cursor:
+            # Truncated buckets take no space, so there is nothing to do for those
+            cursor.execute('select name from unnest(%s) as name where pg_relation_size(name::regclass) > 0;',
+                           (table_names, ))
+            table_names = [row[0] for row in cursor.fetchall()]
+            self.connection.commit()
+            for table_name in table_names:
+                try:
+                    if self._truncate_if_empty(cursor, table_name):
+                        truncated.append(table_name)
+                    self.connection.commit()
+                except LockNotAvailable:
+                    self.connection.rollback()
+        return truncated
+
+    @staticmethod
+    def _truncate_if_empty(cursor, table_name: str) -> bool:
+        """ Truncate the bucket table if it has no events. :return: whether the bucket was truncated """
+        empty_query = f'select not exists (select from {table_name} order by insert_order limit 1);'
+        # Check for events before locking, so buckets that are still being consumed are not locked
+        cursor.execute(empty_query)
+        if not cursor.fetchone()[0]:
+            return False
+        cursor.execute(f"set local lock_timeout = '{_TRUNCATE_LOCK_TIMEOUT}';")
+        cursor.execute(f'lock table {table_name} in access exclusive mode;')
+        # Now that no-one else uses the bucket, check again: a collector with a clock that is off can have
+        # put events in it.
+        cursor.execute(empty_query)
+        if not cursor.fetchone()[0]:
+            return False
+        cursor.execute(f'truncate {table_name};')
+        return True
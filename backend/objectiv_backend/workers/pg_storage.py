@@ -1,17 +1,36 @@
 """
 Copyright 2021 Objectiv B.V.
 """
-import json
+import uuid
 from datetime import datetime, timedelta
-
+from typing import Any, Tuple, Set, List, Optional
 
 from psycopg2.extras import execute_values
 
+from objectiv_backend.common.config import PG_WRITE_ENGINE, PG_DATA_LAYOUT, PG_DATA_PARTITIONED
 from objectiv_backend.common.event_utils import get_context
+from objectiv_backend.common.json_codec import json_dumps
+from objectiv_backend.common.metrics import DUPLICATE_EVENTS
 from objectiv_backend.common.types import FailureReason, EventDataList
-
-
-def insert_events_into_data(connection, events: EventDataList):
+from objectiv_backend.workers.pg_copy import copy_rows, copy_rows_on_conflict_do_nothing
+from objectiv_backend.workers.recent_event_ids import RecentEventIds
+
+_DATA_COLUMNS = ('event_id', 'day', 'moment', 'cookie_id', 'value')
+# Columns of the data table with the 'extracted' layout, see PG_DATA_LAYOUT
+_DATA_EXTRACTED_COLUMNS = _DATA_COLUMNS + \
+    ('event_type', 'stack_event_types', 'global_contexts', 'location_stack')
+_NOK_DATA_COLUMNS = ('event_id', 'day', 'moment', 'cookie_id', 'value', 'reason')
+# If the data table is partitioned, we look for duplicate events with a day that is at most this number of
+# days before or after the days of the events. See insert_events_into_data()
+_DUPLICATE_CHECK_DAYS = 1
+
+
+def insert_events_into_data(connection,
+                            events: EventDataList,
+                            write_engine: str = PG_WRITE_ENGINE,
+                            data_layout: str = PG_DATA_LAYOUT,
+                            data_partitioned: bool = PG_DATA_PARTITIONED,
+                            recent_event_ids: Optional[RecentEventIds] = None) -> List[str]:
     """
     Insert events into the 'data' table.
 
@@ -25,15 +44,33 @@ def insert_events_into_data(connection, events: EventDataList):
     fail if the blocking exceeds the lock_timeout. To minimize impact of blocks and rollbacks, try to keep
     transactions that use this function short and do not insert too much data in one call
 
+    If recent_event_ids is given, events with an id in that filter are inserted in nok_data directly,
+    without trying to insert them in the data table. After the transaction is committed, the caller should
+    add the returned event ids to the filter.
+
     This function assumes that the postgres connection has the isolation level
     ISOLATION_LEVEL_READ_COMMITTED set and a lock_timeout is configured.
 
     :param connection: psycopg2 database connection, must have ISOLATION_LEVEL_READ_COMMITTED set.
     :param events: EventDataList, list of events. Each event must be a valid Event, and must have a CookieIdContext
+    :param write_engine: 'insert' or 'copy', see PG_WRITE_ENGINE
+    :param data_layout: 'json' or 'extracted', see PG_DATA_LAYOUT
+    :param data_partitioned: whether the data table is partitioned by day, see PG_DATA_PARTITIONED
+    :param recent_event_ids: optional filter of the ids of recently committed events
+    :return: ids of the events that were inserted in the data table
     :raise Exception: If the database is not available, or if it blocks longer than lock_timeout.
     """
+    filtered_events: EventDataList = []
+    if recent_event_ids is not None:
+        events, filtered_events = recent_event_ids.split_duplicates(events)
+    if filtered_events:
+        print(f'Known duplicate events found, count: {len(filtered_events)}. '
+              f'Will be inserted in nok_data table.')
+        DUPLICATE_EVENTS.inc(len(filtered_events), detected_by='filter')
+        insert_events_into_nok_data(connection, filtered_events, reason=FailureReason.DUPLICATE,
+                                    write_engine=write_engine)
     if not events:
-        return
+        return []
 
     # We use 'on conflict do nothing'. With the read-committed isolation level this guarantees that this
     # transaction will not insert a row that will conflict with another transaction, even if the results
@@ -50,67 +87,131 @@ def insert_events_into_data(connection, events: EventDataList):
     #
     # [1] https://www.postgresql.org/docs/13/transaction-iso.html
     # [2] https://www.postgresql.org/docs/13/sql-insert.html
-    insert_query = f'''
-        insert into data(event_id, day, moment, cookie_id, value)
-        values %s
-        on conflict(event_id) do nothing
-        returning event_id
-    '''
-    values = []
-    for event in events:
-        timestamp = _millis_to_datetime(event['time'])
-        cookie_id = get_context(event, 'CookieIdContext')['cookie_id']
-        value = (event['id'],
-                 timestamp,
-                 timestamp,
-                 cookie_id,
-                 json.dumps(event))
-        values.append(value)
+    #
+    # With the 'copy' write engine the same insert is done, but from a staging table into which the rows
+    # are loaded with COPY, see copy_rows_on_conflict_do_nothing().
+    #
+    # If the data table is partitioned by day, the primary key is (event_id, day), which only guarantees
+    # that an event is not stored twice for the same day. A duplicate normally has the same time as the
+    # original event, but the time is corrected for the clock of the tracker, so a duplicate might end up on
+    # an adjacent day. Therefore we first look for the events in the partitions of the adjacent days, and
+    # skip the ones that are found. Unlike the primary key, this does not protect against a concurrent
+    # transaction that inserts the same event with a different day.
+    events_to_insert = events
+    if data_partitioned:
+        existing_event_ids = _get_existing_event_ids(connection, events)
+        if existing_event_ids:
+            events_to_insert = [event for event in events
+                                if uuid.UUID(str(event['id'])) not in existing_event_ids]
+
+    columns: Tuple[str, ...]
+    if data_layout == 'extracted':
+        columns = _DATA_EXTRACTED_COLUMNS
+        values = [_event_to_data_row(event) + _event_to_extracted_values(event)
+                  for event in events_to_insert]
+    else:
+        columns = _DATA_COLUMNS
+        values = [_event_to_data_row(event) for event in events_to_insert]
     with connection.cursor() as cursor:
-        inserted_event_ids = execute_values(
-            cursor, insert_query, values, template=None, page_size=100, fetch=True)
+        if write_engine == 'copy':
+            inserted_event_ids = copy_rows_on_conflict_do_nothing(
+                cursor, table_name='data', columns=columns, rows=values, returning='event_id')
+        else:
+            insert_query = f'''
+                insert into data({', '.join(columns)})
+                values %s
+                on conflict do nothing
+                returning event_id
+            '''
+            rows = execute_values(cursor, insert_query, values, template=None, page_size=100, fetch=True)
+            inserted_event_ids = [row[0] for row in rows]
 
     # Determine whether there were any duplicate events that were already in the table
     # In case of duplicate events, we'll add those to the nok_data table for traceability
+    inserted_events = events
     duplicate_events: EventDataList = []
     if len(inserted_event_ids) < len(events):
-        inserted_event_ids_set = set(inserted_event_ids)
+        inserted_events = []
+        inserted_event_ids_set: Set[uuid.UUID] = {uuid.UUID(str(event_id)) for event_id in inserted_event_ids}
         for event in events:
-            if event['id'] not in inserted_event_ids_set:
+            event_id = uuid.UUID(str(event['id']))
+            if event_id in inserted_event_ids_set:
+                # Only one event per id gets inserted, further events with the same id are duplicates
+                inserted_event_ids_set.remove(event_id)
+                inserted_events.append(event)
+            else:
                 duplicate_events.append(event)
     if duplicate_events:
         print(f'Duplicate events found, count: {len(duplicate_events)}. '
               f'Will be inserted in nok_data table.')
-        insert_events_into_nok_data(connection, duplicate_events, reason=FailureReason.DUPLICATE)
+        DUPLICATE_EVENTS.inc(len(duplicate_events), detected_by='database')
+        insert_events_into_nok_data(connection, duplicate_events, reason=FailureReason.DUPLICATE,
+                                    write_engine=write_engine)
+    return [str(event['id']) for event in inserted_events]
+
+
+def _get_existing_event_ids(connection, events: EventDataList) -> Set[uuid.UUID]:
+    """
+    Give the ids of the events that are already in the data table, with a day that is at most
+    _DUPLICATE_CHECK_DAYS before or after the days of the events. As the data table is partitioned by day,
+    this only has to look at a few partitions.
+    """
+    event_ids: List[uuid.UUID] = [uuid.UUID(str(event['id'])) for event in events]
+    days = [_millis_to_datetime(event['time']).date() for event in events]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'select event_id from data where event_id = any(%s) and day between %s and %s',
+            (event_ids,
+             min(days) - timedelta(days=_DUPLICATE_CHECK_DAYS),
+             max(days) + timedelta(days=_DUPLICATE_CHECK_DAYS))
+        )
+        return {uuid.UUID(str(row[0])) for row in cursor.fetchall()}
 
 
 def insert_events_into_nok_data(connection,
                                 events: EventDataList,
-                                reason: FailureReason = FailureReason.FAILED_VALIDATION):
+                                reason: FailureReason = FailureReason.FAILED_VALIDATION,
+                                write_engine: str = PG_WRITE_ENGINE):
     """
     Insert events into the not-ok data ('nok_data') table
     Does not do any transaction management, this merely issues insert commands.
     :param connection: db connection
     :param events: EventDataList, list of events. Each event must have a CookieIdContext
     :param reason: Why are these events written to the nok_data table.
+    :param write_engine: 'insert' or 'copy', see PG_WRITE_ENGINE
     """
     if not events:
         return
 
-    insert_query = f'insert into nok_data (event_id, day, moment, cookie_id, value, reason) values %s'
-    values = []
-    for event in events:
-        timestamp = _millis_to_datetime(event['time'])
-        cookie_id = get_context(event, 'CookieIdContext')['cookie_id']
-        value = (event['id'],
-                 timestamp,
-                 timestamp,
-                 cookie_id,
-                 json.dumps(event),
-                 reason.value)
-        values.append(value)
+    values = [_event_to_data_row(event) + (reason.value, ) for event in events]
     with connection.cursor() as cursor:
-        execute_values(cursor, insert_query, values, template=None, page_size=100)
+        if write_engine == 'copy':
+            copy_rows(cursor, table_name='nok_data', columns=_NOK_DATA_COLUMNS, rows=values)
+        else:
+            insert_query = f'insert into nok_data (event_id, day, moment, cookie_id, value, reason) values %s'
+            execute_values(cursor, insert_query, values, template=None, page_size=100)
+
+
+def _event_to_data_row(event) -> Tuple[Any, ...]:
+    """ Give the values for the columns event_id, day, moment, cookie_id, and value. """
+    timestamp = _millis_to_datetime(event['time'])
+    cookie_id = get_context(event, 'CookieIdContext')['cookie_id']
+    return (event['id'],
+            timestamp,
+            timestamp,
+            cookie_id,
+            json_dumps(event))
+
+
+def _event_to_extracted_values(event) -> Tuple[Any, ...]:
+    """
+    Give the values for the extracted columns: event_type, stack_event_types, global_contexts, and
+    location_stack.
+    """
+    return (event['_type'],
+            json_dumps(event['_types']),
+            json_dumps(event['global_contexts']),
+            json_dumps(event['location_stack']))
 
 
 def _millis_to_datetime(millis: int) -> datetime:
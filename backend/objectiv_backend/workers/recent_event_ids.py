@@ -0,0 +1,103 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+In-memory filter of the ids of events that were recently committed to the data table
+(POSTGRES_DUPLICATE_FILTER_SIZE).
+
+Most duplicate events are retries of trackers, e.g. mobile clients with a flaky connection that didn't get
+a response. insert_events_into_data() detects duplicates with the unique index of the data table, but an
+insert that conflicts with a transaction that is still in progress blocks till that transaction finishes,
+and fails the whole batch if that takes longer than the lock_timeout. With this filter, events that were
+already committed by this process are written to nok_data directly.
+
+Only the ids of committed events are added to the filter, so an event in the filter is certainly a
+duplicate. A set is used instead of e.g. a Bloom filter for that reason: a false positive would move a
+valid event to nok_data. Anything that is not in the filter, e.g. events written by other processes, is
+left to the database.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Tuple
+
+from objectiv_backend.common.config import PG_DUPLICATE_FILTER_SIZE, PG_DUPLICATE_FILTER_SECONDS
+from objectiv_backend.common.per_process import PerProcess
+from objectiv_backend.common.types import EventDataList
+
+
+class RecentEventIds:
+    """
+    Bounded set of event ids, that forgets ids after max_age_seconds, or earlier if it holds more than
+    max_size ids. A max_size of 0 disables the filter. Thread-safe.
+    """
+
+    def __init__(self,
+                 max_size: int = PG_DUPLICATE_FILTER_SIZE,
+                 max_age_seconds: float = PG_DUPLICATE_FILTER_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        if max_size < 0 or max_age_seconds < 0:
+            raise ValueError(f'Invalid duplicate filter settings. Must be non-negative, '
+                             f'max_size: {max_size}, max_age_seconds: {max_age_seconds}')
+        self.max_size = max_size
+        self.max_age_seconds = max_age_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        # per event id the time at which it was added, the oldest first
+        self._added: 'OrderedDict[str, float]' = OrderedDict()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire(self._clock())
+            return len(self._added)
+
+    def __contains__(self, event_id: str) -> bool:
+        with self._lock:
+            self._expire(self._clock())
+            return event_id in self._added
+
+    def add(self, event_ids: Iterable[str]):
+        """
+        Add the ids of events that were committed to the data table. Must only be called after the
+        transaction is committed, otherwise a retry of a failed transaction would be seen as duplicates.
+        """
+        if not self.max_size:
+            return
+        now = self._clock()
+        with self._lock:
+            for event_id in event_ids:
+                self._added[event_id] = now
+                self._added.move_to_end(event_id)
+            self._expire(now)
+
+    def split_duplicates(self, events: EventDataList) -> Tuple[EventDataList, EventDataList]:
+        """
+        Split the events in events with an id that is not in the filter, and events that are.
+        :return: tuple: list of events that are not known duplicates, list of known duplicates
+        """
+        with self._lock:
+            self._expire(self._clock())
+            if not self._added:
+                return events, []
+            new_events: EventDataList = []
+            duplicate_events: EventDataList = []
+            for event in events:
+                if str(event['id']) in self._added:
+                    duplicate_events.append(event)
+                else:
+                    new_events.append(event)
+        return new_events, duplicate_events
+
+    def _expire(self, now: float):
+        """ Forget the oldest ids, while there are too many or they are too old. Must hold the lock. """
+        added = self._added
+        min_time = now - self.max_age_seconds
+        while added and (len(added) > self.max_size or next(iter(added.values())) < min_time):
+            added.popitem(last=False)
+
+
+_RECENT_EVENT_IDS: PerProcess[RecentEventIds] = PerProcess(RecentEventIds)
+
+
+def get_recent_event_ids() -> RecentEventIds:
+    """ Give the process-wide filter of recent event ids, configured by POSTGRES_DUPLICATE_FILTER_SIZE. """
+    return _RECENT_EVENT_IDS.get()
@@ -1,28 +1,103 @@
 """
 Copyright 2021 Objectiv B.V.
 """
+import threading
 import time
-from typing import Callable, Any
+from typing import Callable, Any, Iterable, Optional
 
-from objectiv_backend.common.config import get_config_postgres
+from objectiv_backend.common.config import get_config_postgres, WORKER_SLEEP_SECONDS, WORKER_METRICS_PORT, \
+    WORKER_METRICS_HOST, PG_QUEUE_LAYOUT
 from objectiv_backend.common.db import get_db_connection
+from objectiv_backend.common.metrics import REGISTRY, QUEUE_DEPTH, start_metrics_server
+from objectiv_backend.workers.pg_queues import PostgresQueues, ProcessingStage
 
 
-def worker_main(function: Callable[[Any], int], loop: bool) -> int:
+def get_worker_metrics_port(process_nr: int = 0) -> Optional[int]:
+    """ Give the port on which worker process process_nr serves its metrics, None if not configured. """
+    if not WORKER_METRICS_PORT:
+        return None
+    return int(WORKER_METRICS_PORT) + process_nr
+
+
+def start_worker_metrics_server(port: int):
+    """
+    Serve the metrics of this process on WORKER_METRICS_HOST:port, see start_metrics_server(). The depth of
+    the queues is queried at every scrape, with a separate database connection.
+    """
+    pg_config = get_config_postgres()
+    if pg_config is None:
+        raise Exception('Missing Postgres configuration')
+    connection: Any = None
+
+    def collect_queue_depth():
+        nonlocal connection
+        if connection is None or connection.closed:
+            connection = get_db_connection(pg_config)
+        try:
+            with connection:
+                pg_queues = PostgresQueues(connection=connection)
+                for queue in ProcessingStage:
+                    QUEUE_DEPTH.set(pg_queues.get_queue_depth(queue), queue=queue.value)
+        except Exception:
+            connection.close()
+            raise
+
+    REGISTRY.add_collect_hook(collect_queue_depth)
+    start_metrics_server(port, host=WORKER_METRICS_HOST)
+
+
+# Minimum time between two checks for queue buckets that can be truncated, per process
+_TRUNCATE_BUCKETS_INTERVAL_SECONDS = 10
+_next_truncate_buckets = 0.0
+_truncate_buckets_lock = threading.Lock()
+
+
+def truncate_drained_queue_buckets(connection, queues: Iterable[ProcessingStage] = tuple(ProcessingStage)):
+    """
+    With the 'rotating' queue layout, truncate the queue buckets of which all events are consumed, see
+    PostgresQueues.truncate_drained_buckets(). Can be called after every batch: the check is done at most
+    once every _TRUNCATE_BUCKETS_INTERVAL_SECONDS per process. Must be called outside a transaction.
+    """
+    global _next_truncate_buckets
+    if PG_QUEUE_LAYOUT != 'rotating':
+        return
+    with _truncate_buckets_lock:
+        now = time.monotonic()
+        if now < _next_truncate_buckets:
+            return
+        _next_truncate_buckets = now + _TRUNCATE_BUCKETS_INTERVAL_SECONDS
+    truncated = PostgresQueues(connection=connection).truncate_drained_buckets(queues)
+    if truncated:
+        print(f'Truncated drained queue buckets: {", ".join(truncated)}')
+
+
+def worker_main(function: Callable[[Any], int],
+                loop: bool,
+                queues: Iterable[ProcessingStage] = tuple(ProcessingStage)) -> int:
     """
     Run the function once, or in a loop.
     Will print the last part of the function's name and information about the function's execution time.
 
-    If running in a loop it will sleep a second between invocations if the function returns 0.
+    If running in a loop it will wait for events to be put on one of the queues if the function returns 0.
+    If no notification arrives, the function is called again after WORKER_SLEEP_SECONDS.
     :param function: function that will be called. Should take a `connection` as arguments. The connection
         is a db_connection as delivered by get_db_connection()
     :param loop: whether to call the function once (False) or in an endless loop (True)
+    :param queues: queues that the function reads from. Only relevant if loop is True
     :return number of processed events, if loop is False
     """
     pg_config = get_config_postgres()
     if pg_config is None:
         raise Exception('Missing Postgres configuration')
     connection = get_db_connection(pg_config)
+    pg_queues = PostgresQueues(connection=connection)
+    metrics_port = get_worker_metrics_port()
+    if loop and metrics_port is not None:
+        start_worker_metrics_server(metrics_port)
+    if loop:
+        # Start listening before the first call, so we don't miss events that are put on the queues
+        # while the function is running.
+        pg_queues.listen(queues)
     name = function.__name__.split('_')[-1]
     print(f'{name} worker')
     while True:
@@ -31,6 +106,8 @@ def worker_main(function: Callable[[Any], int], loop: bool) -> int:
         end = time.time()
         print(f'Processing time: {(end - start):.5} s')
         if not loop:
+            connection.close()
             return event_count
+        truncate_drained_queue_buckets(connection, queues)
         if event_count == 0:
-            time.sleep(1)
+            pg_queues.wait_for_notification(timeout=WORKER_SLEEP_SECONDS)
@@ -5,24 +5,34 @@ import sys
 import time
 from typing import List, Tuple
 
-from objectiv_backend.common.config import WORKER_BATCH_SIZE, get_collector_config
+from objectiv_backend.common.config import get_collector_config
+from objectiv_backend.common.metrics import STAGE_SECONDS
 from objectiv_backend.schema.hydrate_events import hydrate_types_into_event
-from objectiv_backend.schema.validate_events import validate_event_adheres_to_schema, validate_event_time, EventError
+from objectiv_backend.schema.validate_events import validate_events_adhere_to_schema, validate_event_time, \
+    EventError
+from objectiv_backend.workers.batch_size import AdaptiveBatchSize, run_batch
 from objectiv_backend.workers.pg_queues import PostgresQueues, ProcessingStage
 from objectiv_backend.workers.pg_storage import insert_events_into_nok_data
 from objectiv_backend.workers.util import worker_main
 from objectiv_backend.common.types import EventDataList
 
 
+# Batch size of the entry queue, shared by all consumers in this process
+_BATCH_SIZE = AdaptiveBatchSize(name='entry')
+
+
 def main_entry(connection) -> int:
     """
     Pick events from the entry queue and insert them into the finalize queue.
     :return number of processed events
     """
+    return run_batch(_BATCH_SIZE, lambda max_items: _entry_batch(connection, max_items))
+
+
+def _entry_batch(connection, max_items: int) -> int:
     with connection:
         pg_queues = PostgresQueues(connection=connection)
-        events: EventDataList = pg_queues.get_events(queue=ProcessingStage.ENTRY,
-                                                     max_items=WORKER_BATCH_SIZE)
+        events: EventDataList = pg_queues.get_events(queue=ProcessingStage.ENTRY, max_items=max_items)
         print(f'event-ids: {sorted(event["id"] for event in events)}')
 
         ok_events, nok_events, event_errors = process_events_entry(events)
@@ -55,11 +65,16 @@ def process_events_entry(events: EventDataList, current_millis: int = 0) -> \
     if current_millis == 0:
         current_millis = round(time.time() * 1000)
 
-    for event in events:
-
-        error_info = \
-            validate_event_adheres_to_schema(event_schema=event_schema, event=event) + \
-            validate_event_time(event=event, current_millis=current_millis)
+    # time spent per stage, over all events
+    start = time.perf_counter()
+    schema_errors = validate_events_adhere_to_schema(event_schema=event_schema, events=events)
+    validation_seconds = time.perf_counter() - start
+    hydration_seconds = 0.0
+    for event, event_schema_errors in zip(events, schema_errors):
+        start = time.perf_counter()
+        error_info = event_schema_errors + validate_event_time(event=event, current_millis=current_millis)
+        validated = time.perf_counter()
+        validation_seconds += validated - start
 
         if error_info:
             print(f"error, event_id: {event['id']}, errors: {[ei.info for ei in error_info]}")
@@ -68,9 +83,12 @@ def process_events_entry(events: EventDataList, current_millis: int = 0) -> \
         else:
             event = hydrate_types_into_event(event_schema=event_schema, event=event)
             ok_events.append(event)
+            hydration_seconds += time.perf_counter() - validated
+    STAGE_SECONDS.observe(validation_seconds, stage='schema_validation')
+    STAGE_SECONDS.observe(hydration_seconds, stage='hydration')
     return ok_events, nok_events, event_errors
 
 
 if __name__ == '__main__':
     _loop = sys.argv[1:2] == ['--loop']
-    worker_main(function=main_entry, loop=_loop)
+    worker_main(function=main_entry, loop=_loop, queues=[ProcessingStage.ENTRY])
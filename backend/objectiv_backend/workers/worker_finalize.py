@@ -3,26 +3,38 @@ Copyright 2021 Objectiv B.V.
 """
 import sys
 
-from objectiv_backend.common.config import WORKER_BATCH_SIZE
 from objectiv_backend.common.types import EventDataList
+from objectiv_backend.workers.batch_size import AdaptiveBatchSize, run_batch
 from objectiv_backend.workers.pg_queues import PostgresQueues, ProcessingStage
 from objectiv_backend.workers.pg_storage import insert_events_into_data
+from objectiv_backend.workers.recent_event_ids import get_recent_event_ids
 from objectiv_backend.workers.util import worker_main
 
 
+# Batch size of the finalize queue, shared by all consumers in this process
+_BATCH_SIZE = AdaptiveBatchSize(name='finalize')
+
+
 def main_finalize(connection) -> int:
     """
     Pick events from the finalize queue, and write them to the data table.
     :return number of processed events
     """
+    return run_batch(_BATCH_SIZE, lambda max_items: _finalize_batch(connection, max_items))
+
+
+def _finalize_batch(connection, max_items: int) -> int:
+    recent_event_ids = get_recent_event_ids()
     with connection:
         pg_queues = PostgresQueues(connection=connection)
-        events: EventDataList = pg_queues.get_events(queue=ProcessingStage.FINALIZE, max_items=WORKER_BATCH_SIZE)
+        events: EventDataList = pg_queues.get_events(queue=ProcessingStage.FINALIZE, max_items=max_items)
         print(f'event-ids: {sorted(event["id"] for event in events)}')
-        insert_events_into_data(connection, events)
+        inserted_event_ids = insert_events_into_data(connection, events, recent_event_ids=recent_event_ids)
+    # only add the events to the filter once they are committed
+    recent_event_ids.add(inserted_event_ids)
     return len(events)
 
 
 if __name__ == '__main__':
     _loop = sys.argv[1:2] == ['--loop']
-    worker_main(function=main_finalize, loop=_loop)
+    worker_main(function=main_finalize, loop=_loop, queues=[ProcessingStage.FINALIZE])
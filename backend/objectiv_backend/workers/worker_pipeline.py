@@ -0,0 +1,52 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Single-stage alternative to the entry and finalize workers: events are picked from the entry queue,
+validated and hydrated, and written to the data or nok_data table, all in a single transaction.
+
+Compared to the two-stage pipeline, events are not serialized into and parsed from the finalize queue,
+which halves the writes to the queue tables. Both pipelines can process the same entry queue, so a
+deployment can switch between them without draining the queues first.
+"""
+import sys
+
+from objectiv_backend.common.types import EventDataList
+from objectiv_backend.workers.batch_size import AdaptiveBatchSize, run_batch
+from objectiv_backend.workers.pg_queues import PostgresQueues, ProcessingStage
+from objectiv_backend.workers.pg_storage import insert_events_into_data, insert_events_into_nok_data
+from objectiv_backend.workers.recent_event_ids import get_recent_event_ids
+from objectiv_backend.workers.util import worker_main
+from objectiv_backend.workers.worker_entry import process_events_entry
+
+
+# Batch size of the entry queue, shared by all consumers in this process
+_BATCH_SIZE = AdaptiveBatchSize(name='pipeline')
+
+
+def main_pipeline(connection) -> int:
+    """
+    Pick events from the entry queue, and write them to the data table, or to the nok_data table if they
+    don't pass validation.
+    :return number of processed events
+    """
+    return run_batch(_BATCH_SIZE, lambda max_items: _pipeline_batch(connection, max_items))
+
+
+def _pipeline_batch(connection, max_items: int) -> int:
+    recent_event_ids = get_recent_event_ids()
+    with connection:
+        pg_queues = PostgresQueues(connection=connection)
+        events: EventDataList = pg_queues.get_events(queue=ProcessingStage.ENTRY, max_items=max_items)
+        print(f'event-ids: {sorted(event["id"] for event in events)}')
+
+        ok_events, nok_events, event_errors = process_events_entry(events)
+        inserted_event_ids = insert_events_into_data(connection, ok_events, recent_event_ids=recent_event_ids)
+        insert_events_into_nok_data(connection=connection, events=nok_events)
+    # only add the events to the filter once they are committed
+    recent_event_ids.add(inserted_event_ids)
+    return len(events)
+
+
+if __name__ == '__main__':
+    _loop = sys.argv[1:2] == ['--loop']
+    worker_main(function=main_pipeline, loop=_loop, queues=[ProcessingStage.ENTRY])
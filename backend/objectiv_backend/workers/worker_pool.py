@@ -0,0 +1,183 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Run multiple queue consumers concurrently: a supervisor process starts a number of worker processes, and
+each worker process runs a number of consumer threads. Every consumer thread has its own database
+connection and processes both the entry and the finalize queue, or in single-stage mode only the entry
+queue (see worker_pipeline.py).
+
+Consumers can safely work on the same queue at the same time, as PostgresQueues.get_events() uses
+`for update skip locked`: each event is picked by exactly one consumer.
+"""
+import multiprocessing
+import signal
+import threading
+import time
+import traceback
+from typing import Dict, List, Callable, Any
+
+from objectiv_backend.common.config import WORKER_SLEEP_SECONDS, get_config_postgres
+from objectiv_backend.common.db import get_db_connection
+from objectiv_backend.workers.pg_queues import PostgresQueues, ProcessingStage
+from objectiv_backend.workers.util import get_worker_metrics_port, start_worker_metrics_server, \
+    truncate_drained_queue_buckets
+from objectiv_backend.workers.worker_entry import main_entry
+from objectiv_backend.workers.worker_finalize import main_finalize
+from objectiv_backend.workers.worker_pipeline import main_pipeline
+
+# Functions that process a single batch of a stage. Each function takes a connection and returns the
+# number of processed events.
+STAGES: Dict[str, Callable[[Any], int]] = {
+    'entry': main_entry,
+    'finalize': main_finalize
+}
+SINGLE_STAGES: Dict[str, Callable[[Any], int]] = {
+    'pipeline': main_pipeline
+}
+
+# Time to wait before reconnecting, after a consumer encountered an error
+_ERROR_SLEEP_SECONDS = 1
+# Maximum time to wait for a notification at once, before checking whether the consumer should stop
+_STOP_CHECK_SECONDS = 1
+
+
+def _consumer(stages: Dict[str, Callable[[Any], int]], stop_event, counters: Dict[str, Any]):
+    """
+    Process batches of events from all stages, until stop_event is set. If there is no work to do, waits
+    till events are put on one of the queues.
+    Errors are printed, after which the consumer continues with a new connection.
+    """
+    pg_config = get_config_postgres()
+    if pg_config is None:
+        raise Exception('Missing Postgres configuration')
+    connection = None
+    while not stop_event.is_set():
+        try:
+            if connection is None or connection.closed:
+                connection = get_db_connection(pg_config)
+                PostgresQueues(connection=connection).listen(ProcessingStage)
+            event_count = 0
+            for stage, function in stages.items():
+                stage_count = function(connection)
+                with counters[stage].get_lock():
+                    counters[stage].value += stage_count
+                event_count += stage_count
+            truncate_drained_queue_buckets(connection)
+            if event_count == 0:
+                _wait_for_events(PostgresQueues(connection=connection), stop_event)
+        except Exception:
+            traceback.print_exc()
+            if connection is not None:
+                connection.close()
+            connection = None
+            stop_event.wait(_ERROR_SLEEP_SECONDS)
+    if connection is not None:
+        connection.close()
+
+
+def _wait_for_events(pg_queues: PostgresQueues, stop_event):
+    """
+    Wait till events are put on one of the queues, stop_event is set, or WORKER_SLEEP_SECONDS have passed.
+    """
+    deadline = time.time() + WORKER_SLEEP_SECONDS
+    while not stop_event.is_set():
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        if pg_queues.wait_for_notification(timeout=min(remaining, _STOP_CHECK_SECONDS)):
+            return
+
+
+def _worker_process(stages: Dict[str, Callable[[Any], int]],
+                    thread_count: int,
+                    stop_event,
+                    counters: Dict[str, Any],
+                    process_nr: int = 0):
+    """
+    Run thread_count consumer threads, until stop_event is set. If configured, the metrics of this process
+    are served on WORKER_METRICS_PORT + process_nr.
+    """
+    # The supervisor handles the signals, and sets stop_event. Ignore them here, so that a consumer isn't
+    # interrupted in the middle of a batch.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    metrics_port = get_worker_metrics_port(process_nr)
+    if metrics_port is not None:
+        start_worker_metrics_server(metrics_port)
+    threads = [threading.Thread(target=_consumer, args=(stages, stop_event, counters),
+                                name=f'consumer-{i}')
+               for i in range(thread_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_worker_pool(process_count: int,
+                    thread_count: int,
+                    stats_interval: float = 60,
+                    single_stage: bool = False):
+    """
+    Start process_count worker processes, each with thread_count consumers. Runs until a SIGINT or SIGTERM
+    is received, after which all consumers finish their current batch and the processes exit.
+    Every stats_interval seconds the aggregate throughput of all consumers is printed.
+    If single_stage is True, the consumers process events from the entry queue straight into the data
+    tables, instead of through the finalize queue.
+    """
+    if process_count < 1 or thread_count < 1:
+        raise ValueError('Number of processes and threads must be at least 1')
+    stages = SINGLE_STAGES if single_stage else STAGES
+    stop_event = multiprocessing.Event()
+    counters = {stage: multiprocessing.Value('q', 0) for stage in stages}
+
+    def start_process(nr: int) -> multiprocessing.Process:
+        process = multiprocessing.Process(
+            target=_worker_process, args=(stages, thread_count, stop_event, counters, nr), name=f'worker-{nr}'
+        )
+        process.start()
+        return process
+
+    # The signal handler only sets a flag: setting stop_event from the handler could deadlock, if the
+    # signal arrives while the main thread holds the event's internal lock.
+    received_signals: List[int] = []
+
+    def stop(signum, frame):
+        received_signals.append(signum)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    print(f'Starting worker pool: {process_count} process(es), with {thread_count} thread(s) each')
+    processes: List[multiprocessing.Process] = [start_process(nr) for nr in range(process_count)]
+    last_counts = {stage: 0 for stage in stages}
+    last_stats = time.time()
+    while True:
+        time.sleep(1)
+        if received_signals:
+            print(f'Received signal {received_signals[0]}, stopping worker pool after the current batches')
+            stop_event.set()
+            break
+        for nr, process in enumerate(processes):
+            if not process.is_alive():
+                print(f'Worker process {process.name} exited with code {process.exitcode}, restarting')
+                processes[nr] = start_process(nr)
+        now = time.time()
+        if now - last_stats >= stats_interval:
+            _print_stats(counters, last_counts, now - last_stats)
+            last_stats = now
+
+    for process in processes:
+        process.join()
+    _print_stats(counters, last_counts, time.time() - last_stats)
+    print('Worker pool stopped')
+
+
+def _print_stats(counters: Dict[str, Any], last_counts: Dict[str, int], duration: float):
+    """ Print the number of processed events per stage since the last call, and update last_counts. """
+    stats = []
+    for stage, counter in counters.items():
+        count = counter.value
+        stats.append(f'{stage}: {count - last_counts[stage]} events '
+                     f'({(count - last_counts[stage]) / max(duration, 0.001):.1f}/s, total {count})')
+        last_counts[stage] = count
+    print(f'Worker pool stats over {duration:.1f} s - {", ".join(stats)}')
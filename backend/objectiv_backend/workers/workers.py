@@ -3,40 +3,60 @@ Copyright 2021 Objectiv B.V.
 """
 import argparse
 import sys
-import time
 
-from objectiv_backend.common.config import WORKER_SLEEP_SECONDS
+from objectiv_backend.workers.pg_queues import ProcessingStage
 from objectiv_backend.workers.util import worker_main
 from objectiv_backend.workers.worker_entry import main_entry
 from objectiv_backend.workers.worker_finalize import main_finalize
+from objectiv_backend.workers.worker_pipeline import main_pipeline
+from objectiv_backend.workers.worker_pool import run_worker_pool
+
+
+def main_all(connection) -> int:
+    """
+    Process a batch of events from the entry queue, and a batch from the finalize queue.
+    :return number of processed events
+    """
+    event_count = main_entry(connection)
+    event_count += main_finalize(connection)
+    return event_count
 
 
 def call_all(loop: bool):
-    while True:
-        event_count = worker_main(function=main_entry, loop=False)
-        event_count += worker_main(function=main_finalize, loop=False)
-        if not loop:
-            break
-        if event_count == 0:
-            # sleeping a short random time is nice for catching concurrency problems
-            # time.sleep(0.2 * random.random())
-            time.sleep(WORKER_SLEEP_SECONDS)
+    return worker_main(function=main_all, loop=loop)
 
 
 def main():
     parser = argparse.ArgumentParser(prog='worker')
     parser.add_argument('type',
-                        choices=['all', 'entry', 'finalize'],
+                        choices=['all', 'entry', 'finalize', 'pipeline', 'pool'],
                         default='all',
                         type=str)
     parser.add_argument('--loop', action='store_true')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Number of worker processes. Only used by the `pool` type')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='Number of consumer threads per worker process. Only used by the `pool` type')
+    parser.add_argument('--stats-interval', type=float, default=60,
+                        help='Seconds between printing throughput statistics. Only used by the `pool` type')
+    parser.add_argument('--single-stage', action='store_true',
+                        help='Process events from the entry queue straight into the data tables, instead of '
+                             'through the finalize queue. Only used by the `pool` type')
     args = parser.parse_args(sys.argv[1:])
+    if args.type == 'pool':
+        # The pool always loops, until it receives a SIGINT or SIGTERM
+        return run_worker_pool(process_count=args.processes,
+                               thread_count=args.threads,
+                               stats_interval=args.stats_interval,
+                               single_stage=args.single_stage)
     if args.type == 'all':
         return call_all(args.loop)
     if args.type == 'entry':
-        return worker_main(function=main_entry, loop=args.loop)
+        return worker_main(function=main_entry, loop=args.loop, queues=[ProcessingStage.ENTRY])
     if args.type == 'finalize':
-        return worker_main(function=main_finalize, loop=args.loop)
+        return worker_main(function=main_finalize, loop=args.loop, queues=[ProcessingStage.FINALIZE])
+    if args.type == 'pipeline':
+        return worker_main(function=main_pipeline, loop=args.loop, queues=[ProcessingStage.ENTRY])
 
 
 if __name__ == '__main__':
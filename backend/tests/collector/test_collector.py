@@ -1,6 +1,7 @@
 import json
 
-from objectiv_backend.end_points.collector import add_http_context_to_event, add_marketing_context_to_event
+from objectiv_backend.end_points.collector import add_http_context_to_event, add_marketing_context_to_event, \
+    get_http_context
 from objectiv_backend.common.event_utils import add_global_context_to_event, get_contexts
 from tests.schema.test_schema import CLICK_EVENT_JSON, make_event_from_dict, order_dict
 
@@ -134,3 +135,28 @@ def test_enrich_marketing_context():
 
     # check serialized jsons match for set and unset optionals
     assert json.dumps(order_dict(generated_marketing_context)) == marketing_context_json
+
+
+def test_enrich_request_contexts():
+    """
+    Test that the HttpContexts and the MarketingContexts that are added to the events of a request are
+    equal, but not shared.
+    """
+    event_list = json.loads(CLICK_EVENT_JSON)
+    events = [make_event_from_dict(event_list['events'][0]) for _ in range(2)]
+    http_context = get_http_context(HTTP_REQUEST)
+    for event in events:
+        get_contexts(event=event, context_type='PathContext')[0]['id'] = 'http://localhost:3000?utm_source=s&' \
+                                                                         'utm_medium=m&utm_campaign=c'
+        add_http_context_to_event(event=event, request=HTTP_REQUEST, http_context=http_context)
+        add_marketing_context_to_event(event=event)
+
+    assert order_dict(http_context) == order_dict(_get_http_context())
+    http_contexts = [get_contexts(event=event, context_type='HttpContext')[0] for event in events]
+    assert http_contexts[0] == http_contexts[1] == http_context
+    assert http_contexts[0] is not http_contexts[1] and http_contexts[0] is not http_context
+    marketing_contexts = [get_contexts(event=event, context_type='MarketingContext') for event in events]
+    assert len(marketing_contexts[0]) == 1
+    assert marketing_contexts[0] == marketing_contexts[1]
+    assert marketing_contexts[0][0] is not marketing_contexts[1][0]
+    assert marketing_contexts[0][0]['source'] == 's'
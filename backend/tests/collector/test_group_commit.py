@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+from objectiv_backend.end_points import group_commit
+from objectiv_backend.end_points.group_commit import GroupCommitBuffer, TABLE_DATA, TABLE_NOK_DATA
+
+
+def _events(*ids):
+    return [{'id': event_id} for event_id in ids]
+
+
+def test_group_commit_max_events():
+    writes = []
+    buffer = GroupCommitBuffer(write=writes.append, max_events=3, max_delay_seconds=60,
+                               max_buffered_events=10)
+    future_1 = buffer.add({TABLE_DATA: _events(1), TABLE_NOK_DATA: _events(2)})
+    assert not future_1.done()
+    future_2 = buffer.add({TABLE_DATA: _events(3)})
+    future_2.result(timeout=1)
+    assert future_1.done()
+    assert writes == [{TABLE_DATA: _events(1, 3), TABLE_NOK_DATA: _events(2)}]
+    buffer.close()
+
+
+def test_group_commit_max_delay():
+    writes = []
+    buffer = GroupCommitBuffer(write=writes.append, max_events=100, max_delay_seconds=0.05,
+                               max_buffered_events=1000)
+    buffer.add({TABLE_DATA: _events(1)}).result(timeout=1)
+    assert writes == [{TABLE_DATA: _events(1)}]
+    buffer.close()
+
+
+def test_group_commit_close():
+    writes = []
+    buffer = GroupCommitBuffer(write=writes.append, max_events=100, max_delay_seconds=60,
+                               max_buffered_events=1000)
+    future = buffer.add({TABLE_DATA: _events(1)})
+    buffer.close()
+    assert future.done()
+    assert writes == [{TABLE_DATA: _events(1)}]
+    with pytest.raises(Exception, match='closed'):
+        buffer.add({TABLE_DATA: _events(2)})
+
+
+def test_group_commit_write_error():
+    def write(events_per_table):
+        raise ValueError('write failed')
+
+    buffer = GroupCommitBuffer(write=write, max_events=1, max_delay_seconds=60, max_buffered_events=10)
+    with pytest.raises(ValueError, match='write failed'):
+        buffer.add({TABLE_DATA: _events(1)}).result(timeout=1)
+    buffer.close()
+
+
+def test_group_commit_buffer_full(monkeypatch):
+    monkeypatch.setattr(group_commit, 'BUFFER_TIMEOUT_SECONDS', 0.05)
+    unblock = threading.Event()
+    buffer = GroupCommitBuffer(write=lambda events_per_table: unblock.wait(), max_events=2,
+                               max_delay_seconds=60, max_buffered_events=2)
+    # the first write blocks, the next events stay in the buffer
+    buffer.add({TABLE_DATA: _events(1, 2)})
+    buffer.add({TABLE_DATA: _events(3)})
+    with pytest.raises(Exception, match='buffer is full'):
+        buffer.add({TABLE_DATA: _events(4, 5)})
+    unblock.set()
+    buffer.close()
@@ -0,0 +1,132 @@
+import gzip
+import json
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+from objectiv_backend.common.config import OutputBufferConfig, AwsOutputConfig, FileSystemOutputConfig
+from objectiv_backend.end_points.extra_output import write_object_to_s3, write_object_to_fs
+from objectiv_backend.end_points import output_buffer as output_buffer_module
+from objectiv_backend.end_points.output_buffer import OutputBuffer, FileFormat, _close_in_process
+
+
+def _events(*ids):
+    return [{'id': event_id, 'value': 'x' * 10} for event_id in ids]
+
+
+def _read_ndjson(data: bytes):
+    return [json.loads(line) for line in data.decode('utf-8').splitlines()]
+
+
+def test_output_buffer_max_bytes():
+    written = []
+    config = OutputBufferConfig(max_bytes=100, max_seconds=60, compression='gzip')
+    output_buffer = OutputBuffer(write_object=lambda *args: written.append(args), config=config)
+    output_buffer.append('OK', _events(1))
+    output_buffer.append('NOK', _events(2))
+    assert written == []
+    # each event is 28 bytes of json
+    output_buffer.append('OK', _events(3, 4, 5))
+    assert len(written) == 1
+    prefix, name, moment, data = written[0]
+    assert prefix == 'OK'
+    assert name.endswith('.json.gz')
+    assert isinstance(moment, datetime)
+    assert _read_ndjson(gzip.decompress(data)) == _events(1, 3, 4, 5)
+
+    output_buffer.close()
+    assert len(written) == 2
+    assert written[1][0] == 'NOK'
+    assert _read_ndjson(gzip.decompress(written[1][3])) == _events(2)
+
+
+def test_output_buffer_max_seconds():
+    written = []
+    config = OutputBufferConfig(max_bytes=1_000_000, max_seconds=0.1, compression='none')
+    output_buffer = OutputBuffer(write_object=lambda *args: written.append(args), config=config)
+    output_buffer.append('RAW', _events(1, 2))
+    time.sleep(0.3)
+    assert len(written) == 1
+    assert written[0][1].endswith('.json')
+    assert _read_ndjson(written[0][3]) == _events(1, 2)
+    output_buffer.close()
+    assert len(written) == 1
+
+
+def test_output_buffer_zstd():
+    zstandard = pytest.importorskip('zstandard')
+    written = []
+    config = OutputBufferConfig(max_bytes=1_000_000, max_seconds=60, compression='zstd')
+    output_buffer = OutputBuffer(write_object=lambda *args: written.append(args), config=config)
+    output_buffer.append('OK', _events(1, 2))
+    output_buffer.close()
+    assert written[0][1].endswith('.json.zst')
+    data = zstandard.ZstdDecompressor().decompressobj().decompress(written[0][3])
+    assert _read_ndjson(data) == _events(1, 2)
+
+
+def test_output_buffer_write_error():
+    def write_object(prefix, name, moment, data):
+        raise ValueError('write failed')
+
+    config = OutputBufferConfig(max_bytes=10, max_seconds=60, compression='gzip')
+    output_buffer = OutputBuffer(write_object=write_object, config=config)
+    with pytest.raises(ValueError, match='write failed'):
+        output_buffer.append('OK', _events(1))
+    output_buffer.close()
+
+
+class FakeS3Client:
+    """ Local stand-in for a boto3 S3 client. """
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body
+
+
+def test_output_buffer_close_after_fork(monkeypatch):
+    written = []
+    config = OutputBufferConfig(max_bytes=1000, max_seconds=60, compression='none')
+    output_buffer = OutputBuffer(write_object=lambda *args: written.append(args), config=config)
+    output_buffer.append('OK', _events(1))
+    pid = os.getpid()
+    # a forked process doesn't write the buffered events of its parent at exit, the parent does
+    monkeypatch.setattr(output_buffer_module.os, 'getpid', lambda: pid + 1)
+    _close_in_process(output_buffer, pid)
+    assert written == []
+    monkeypatch.undo()
+    _close_in_process(output_buffer, pid)
+    assert len(written) == 1
+
+
+def test_file_format_abstract():
+    class _IncompleteFormat(FileFormat):
+        def encode(self, events):
+            return b''
+
+    # a format that doesn't implement new_chunk() can't be created
+    with pytest.raises(TypeError):
+        _IncompleteFormat()
+
+
+def test_write_object_to_s3():
+    aws_config = AwsOutputConfig(access_key_id='id', secret_access_key='secret', region='eu-west-1',
+                                 bucket='bucket', s3_prefix='events')
+    s3_client = FakeS3Client()
+    write_object_to_s3(aws_config, prefix='OK', name='1.json.gz', moment=datetime(2022, 3, 4),
+                       data=b'data', s3_client=s3_client)
+    assert s3_client.objects == {('bucket', 'events/2022/03/04/OK/1.json.gz'): b'data'}
+    write_object_to_s3(aws_config, prefix='parquet/OK/day=2022-03-03', name='2.parquet',
+                       moment=datetime(2022, 3, 4), data=b'data', s3_client=s3_client, datestamp=False)
+    assert ('bucket', 'events/parquet/OK/day=2022-03-03/2.parquet') in s3_client.objects
+
+
+def test_write_object_to_fs(tmp_path):
+    fs_config = FileSystemOutputConfig(path=str(tmp_path))
+    write_object_to_fs(fs_config, prefix='OK', name='1.json.gz', data=b'data')
+    assert [path.name for path in (tmp_path / 'OK').iterdir()] == ['1.json.gz']
+    assert (tmp_path / 'OK' / '1.json.gz').read_bytes() == b'data'
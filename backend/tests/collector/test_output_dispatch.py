@@ -0,0 +1,134 @@
+import threading
+import time
+
+import pytest
+
+from objectiv_backend.common.config import OutputConfig
+from objectiv_backend.common.metrics import OUTPUT_TIMEOUTS, OUTPUT_DROPPED
+from objectiv_backend.end_points.output_dispatch import dispatch_outputs, OutputError
+
+
+def _output_config(mandatory=('postgres', 'aws'), timeout_seconds=5.0, threads=4,
+                   background_queue_size=1000, mandatory_queue_size=1000) -> OutputConfig:
+    return OutputConfig(postgres=None, aws=None, file_system=None, snowplow=None,
+                        mandatory=mandatory, timeout_seconds=timeout_seconds, threads=threads,
+                        background_queue_size=background_queue_size,
+                        mandatory_queue_size=mandatory_queue_size)
+
+
+def test_dispatch_outputs_concurrent():
+    def write_slow():
+        time.sleep(0.2)
+
+    start = time.perf_counter()
+    timings = dispatch_outputs({'postgres': write_slow, 'aws': write_slow}, _output_config())
+    assert time.perf_counter() - start < 0.35
+    assert [(timing.output, timing.status) for timing in timings] == [('postgres', 'ok'), ('aws', 'ok')]
+    assert all(timing.seconds is not None and timing.seconds >= 0.2 for timing in timings)
+
+
+def test_dispatch_outputs_optional():
+    optional_done = threading.Event()
+
+    def write_optional():
+        time.sleep(0.2)
+        optional_done.set()
+
+    def write_fail():
+        raise Exception('write failed')
+
+    # the response doesn't wait for, and doesn't fail on, optional outputs
+    timings = dispatch_outputs({'postgres': lambda: None, 'file_system': write_optional, 'aws': write_fail},
+                               _output_config(mandatory=('postgres', )))
+    statuses = [(timing.output, timing.status) for timing in timings]
+    assert statuses[:2] == [('postgres', 'ok'), ('file_system', 'background')]
+    # the failing output might not have finished yet
+    assert statuses[2] in [('aws', 'error'), ('aws', 'background')]
+    assert not optional_done.is_set()
+    assert optional_done.wait(timeout=1)
+
+
+def test_dispatch_outputs_mandatory_failure():
+    written = threading.Event()
+
+    def write_fail():
+        raise ValueError('write failed')
+
+    with pytest.raises(OutputError, match='aws: write failed'):
+        dispatch_outputs({'postgres': written.set, 'aws': write_fail}, _output_config())
+    # the other output is still written
+    assert written.is_set()
+
+
+def test_dispatch_outputs_timeout():
+    timeouts_before = OUTPUT_TIMEOUTS.get(output='postgres')
+    with pytest.raises(OutputError, match='postgres: timeout'):
+        dispatch_outputs({'postgres': lambda: time.sleep(0.3)}, _output_config(timeout_seconds=0.05))
+    assert OUTPUT_TIMEOUTS.get(output='postgres') == timeouts_before + 1
+
+
+def test_dispatch_outputs_timeout_starts_with_write():
+    # With a single thread, the second request waits for the first write. That doesn't count as timeout.
+    output_config = _output_config(mandatory=('postgres', ), timeout_seconds=0.3, threads=1)
+    results = []
+
+    def request():
+        results.append(dispatch_outputs({'postgres': lambda: time.sleep(0.2)}, output_config))
+
+    threads = [threading.Thread(target=request) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [[timing.status for timing in timings] for timings in results] == [['ok'], ['ok']]
+
+
+def test_dispatch_outputs_hanging_write():
+    # With a single thread that hangs, later requests fail within their timeout instead of waiting forever
+    output_config = _output_config(mandatory=('postgres', ), timeout_seconds=0.1, threads=1)
+    hanging = threading.Event()
+    written = []
+    try:
+        with pytest.raises(OutputError, match='postgres: timeout'):
+            dispatch_outputs({'postgres': hanging.wait}, output_config)
+        start = time.perf_counter()
+        with pytest.raises(OutputError, match='postgres: timeout'):
+            dispatch_outputs({'postgres': lambda: written.append('second')}, output_config)
+        assert time.perf_counter() - start < 0.5
+    finally:
+        hanging.set()
+    # the write of the second request never got a thread, and is cancelled
+    time.sleep(0.1)
+    assert written == []
+
+
+def test_dispatch_outputs_mandatory_bounded():
+    output_config = _output_config(mandatory=('postgres', ), timeout_seconds=0.05, threads=1,
+                                   mandatory_queue_size=1)
+    hanging = threading.Event()
+    dropped_before = OUTPUT_DROPPED.get(output='postgres')
+    try:
+        with pytest.raises(OutputError, match='postgres: timeout'):
+            dispatch_outputs({'postgres': hanging.wait}, output_config)
+        # the hanging write still takes the only slot, so the next write is refused directly
+        with pytest.raises(OutputError, match='postgres: dropped'):
+            dispatch_outputs({'postgres': lambda: None}, output_config)
+        assert OUTPUT_DROPPED.get(output='postgres') == dropped_before + 1
+    finally:
+        hanging.set()
+
+
+def test_dispatch_outputs_background_bounded():
+    output_config = _output_config(mandatory=('postgres', ), threads=1, background_queue_size=2)
+    blocked = threading.Event()
+    dropped_before = OUTPUT_DROPPED.get(output='file_system')
+    try:
+        statuses = []
+        for _ in range(3):
+            timings = dispatch_outputs({'postgres': lambda: None, 'file_system': blocked.wait}, output_config)
+            statuses.append([timing.status for timing in timings])
+        # a slow background output doesn't hold up the mandatory outputs, and its backlog is bounded
+        assert statuses == [['ok', 'background'], ['ok', 'background'], ['ok', 'dropped']]
+        assert OUTPUT_DROPPED.get(output='file_system') == dropped_before + 1
+    finally:
+        blocked.set()
@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+from objectiv_backend.common.config import OutputBufferConfig
+from objectiv_backend.end_points.output_buffer import OutputBuffer
+from objectiv_backend.end_points.parquet_output import DAY_UNKNOWN, ParquetFormat, split_events_by_day
+
+pyarrow = pytest.importorskip('pyarrow')
+import pyarrow.parquet  # noqa: E402
+
+
+# 2021-10-18 and 2021-10-19, UTC
+_DAY_1_MILLIS = 1634515200000
+_DAY_2_MILLIS = _DAY_1_MILLIS + 24 * 3600 * 1000
+
+
+def _event(event_id: str, millis=_DAY_1_MILLIS):
+    return {
+        '_type': 'PressEvent',
+        '_types': ['AbstractEvent', 'InteractiveEvent', 'PressEvent'],
+        'id': event_id,
+        'time': millis,
+        'global_contexts': [
+            {'_type': 'CookieIdContext', '_types': ['AbstractContext', 'AbstractGlobalContext',
+                                                    'CookieIdContext'],
+             'id': 'cookie', 'cookie_id': 'f84446c6-eb76-4458-8ef4-93ade596fd5b'}
+        ],
+        'location_stack': [{'_type': 'RootLocationContext', 'id': 'home'}]
+    }
+
+
+def _read(data: bytes):
+    return pyarrow.parquet.ParquetFile(pyarrow.BufferReader(data))
+
+
+def _write(events, row_group_size=10000, max_bytes=1024 * 1024):
+    writes = []
+    config = OutputBufferConfig(max_bytes=1024 * 1024, max_seconds=60, compression='gzip')
+    file_format = ParquetFormat(compression='gzip', row_group_size=row_group_size, max_bytes=max_bytes)
+    buffer = OutputBuffer(write_object=lambda prefix, name, moment, data: writes.append((prefix, name, data)),
+                          config=config, file_format=file_format)
+    for event in events:
+        buffer.append('OK', [event])
+    buffer.close()
+    return writes
+
+
+def test_parquet_columns():
+    writes = _write([_event('a'), _event('b')])
+    assert len(writes) == 1
+    prefix, name, data = writes[0]
+    assert name.endswith('.parquet')
+    rows = _read(data).read().to_pylist()
+    assert [row['event_id'] for row in rows] == ['a', 'b']
+    row = rows[0]
+    assert row['event_type'] == 'PressEvent'
+    assert row['event_types'] == ['AbstractEvent', 'InteractiveEvent', 'PressEvent']
+    assert row['time'].isoformat() == '2021-10-18T00:00:00'
+    assert row['cookie_id'] == 'f84446c6-eb76-4458-8ef4-93ade596fd5b'
+    global_context = row['global_contexts'][0]
+    assert global_context['_type'] == 'CookieIdContext'
+    assert global_context['id'] == 'cookie'
+    assert json.loads(global_context['properties']) == {'cookie_id': 'f84446c6-eb76-4458-8ef4-93ade596fd5b'}
+    assert row['location_stack'] == [
+        {'_type': 'RootLocationContext', '_types': None, 'id': 'home', 'properties': '{}'}
+    ]
+
+
+def test_parquet_row_groups():
+    writes = _write([_event(str(i)) for i in range(10)], row_group_size=4)
+    parquet_file = _read(writes[0][2])
+    assert parquet_file.metadata.num_rows == 10
+    assert [parquet_file.metadata.row_group(i).num_rows for i in range(parquet_file.num_row_groups)] \
+        == [4, 4, 2]
+
+
+def test_parquet_max_bytes():
+    # Parquet files have their own size limit, the size of the json limit doesn't apply
+    events = [_event(str(i)) for i in range(10)]
+    assert len(_write(events, max_bytes=1)) == 10
+    assert len(_write(events, max_bytes=None)) == 1
+
+
+def test_parquet_invalid_events():
+    # events that failed validation are written as far as possible
+    events = [
+        {'id': 1, '_types': 'PressEvent', 'time': 'yesterday', 'global_contexts': 'invalid',
+         'location_stack': [1, {'_type': 'RootLocationContext', 'id': 2}]},
+        {}
+    ]
+    rows = _read(_write(events)[0][2]).read().to_pylist()
+    assert rows[0]['event_id'] == '1'
+    assert rows[0]['event_types'] is None
+    assert rows[0]['time'] is None
+    assert rows[0]['global_contexts'] is None
+    assert rows[0]['location_stack'] == [
+        {'_type': None, '_types': None, 'id': None, 'properties': '1'},
+        {'_type': 'RootLocationContext', '_types': None, 'id': '2', 'properties': '{}'}
+    ]
+    assert rows[1]['event_id'] is None
+
+
+def test_split_events_by_day():
+    events = [_event('a'), _event('b', millis=_DAY_2_MILLIS), _event('c'), _event('d', millis=None)]
+    result = split_events_by_day(events)
+    assert {day: [event['id'] for event in day_events] for day, day_events in result.items()} == {
+        '2021-10-18': ['a', 'c'],
+        '2021-10-19': ['b'],
+        DAY_UNKNOWN: ['d']
+    }
@@ -1,11 +1,19 @@
+import copy
 import json
+import uuid
+from concurrent.futures import Future
+
 import jsonschema
+import pytest
 import base64
-from objectiv_backend.snowplow.schema.ttypes import CollectorPayload
+from objectiv_backend.snowplow.collector_payload import CollectorPayload, encode_collector_payload, \
+    encode_collector_payload_generic
 from objectiv_backend.snowplow.snowplow_helper import make_snowplow_custom_context, \
-    objectiv_event_to_snowplow, objectiv_event_to_snowplow_payload, snowplow_schema_violation
+    objectiv_event_to_snowplow, objectiv_event_to_snowplow_payload, snowplow_schema_violation, \
+    write_data_to_pubsub, payload_to_thrift
 from tests.schema.test_schema import CLICK_EVENT_JSON, make_event_from_dict
 from objectiv_backend.common.config import SnowplowConfig
+from objectiv_backend.common.metrics import SNOWPLOW_MESSAGES
 from objectiv_backend.schema.validate_events import EventError, ErrorInfo
 
 
@@ -69,6 +77,26 @@ def test_objectiv_event_to_snowplow_payload():
     assert json.loads(base64.b64decode(body['data'][0]['cx']))
 
 
+def test_payload_to_thrift():
+    collector_payload = objectiv_event_to_snowplow_payload(event=event, config=config)
+    assert payload_to_thrift(collector_payload) == encode_collector_payload_generic(collector_payload)
+
+
+def test_encode_collector_payload():
+    payloads = [
+        CollectorPayload(),
+        CollectorPayload(schema='schema', timestamp=0, headers=[]),
+        CollectorPayload(schema='schema', ipAddress='::1', timestamp=-1, encoding='UTF-8', collector='c',
+                         userAgent='Mozilla/5.0 (X11; Linux x86_64) \u00e9\u4e2d\U0001f600', refererUri='',
+                         path='/com.snowplowanalytics.snowplow/tp2', querystring='a=1&b=%20',
+                         body='{"data": "' + 'x' * 100_000 + '"}', headers=['Accept: */*', '\u00fc'],
+                         contentType='application/json', hostname='host', networkUserId=str(uuid.uuid4())),
+        CollectorPayload(timestamp=2 ** 63 - 1, networkUserId='id'),
+    ]
+    for payload in payloads:
+        assert encode_collector_payload(payload) == encode_collector_payload_generic(payload)
+
+
 def test_snowplow_failed_event():
     # as we do no actual validation of the event, there's no need to use an invalid event.
     event_error = EventError(
@@ -92,3 +120,58 @@ def test_snowplow_failed_event():
         instance = violation['data']
 
         jsonschema.validate(instance=instance, schema=schema,)
+
+
+class FakePublisher:
+    """ Local stand-in for pubsub_v1.PublisherClient, publishing succeeds unless fail is set. """
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.messages = []
+
+    def publish(self, topic, data):
+        self.messages.append((topic, data))
+        future = Future()
+        if self.fail:
+            future.set_exception(Exception('publish failed'))
+        else:
+            future.set_result(str(len(self.messages)))
+        return future
+
+
+def _make_events(count: int):
+    events = []
+    for _ in range(count):
+        new_event = copy.deepcopy(event)
+        new_event['id'] = str(uuid.uuid4())
+        events.append(new_event)
+    return events
+
+
+def test_write_data_to_pubsub_good():
+    pubsub_config = config._replace(gcp_project='project', gcp_pubsub_topic_raw='raw')
+    publisher = FakePublisher()
+    write_data_to_pubsub(events=_make_events(3), config=pubsub_config, channel='good', publisher=publisher)
+    assert len(publisher.messages) == 3
+    assert {topic for topic, _ in publisher.messages} == {'projects/project/topics/raw'}
+
+
+def test_write_data_to_pubsub_bad():
+    pubsub_config = config._replace(gcp_project='project', gcp_pubsub_topic_bad='bad')
+    events = _make_events(3)
+    event_errors = [EventError(event_id=events[1]['id'], error_info=[ErrorInfo(data=[], info='error 1')])]
+    publisher = FakePublisher()
+    write_data_to_pubsub(events=events, config=pubsub_config, channel='bad', event_errors=event_errors,
+                         publisher=publisher)
+    assert [topic for topic, _ in publisher.messages] == ['projects/project/topics/bad'] * 3
+    data_reports = [json.loads(data)['data']['failure']['messages'][0]['error']['dataReports']
+                    for _, data in publisher.messages]
+    assert [[report['message'] for report in reports] for reports in data_reports] == [[], ['error 1'], []]
+
+
+def test_write_data_to_pubsub_failure():
+    pubsub_config = config._replace(gcp_project='project', gcp_pubsub_topic_raw='raw')
+    failed_before = SNOWPLOW_MESSAGES.get(channel='good', result='failed')
+    with pytest.raises(Exception, match='failed for 2 of 2 messages, first error: publish failed'):
+        write_data_to_pubsub(events=_make_events(2), config=pubsub_config, publisher=FakePublisher(fail=True))
+    assert SNOWPLOW_MESSAGES.get(channel='good', result='failed') == failed_before + 2
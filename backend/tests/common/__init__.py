@@ -0,0 +1,3 @@
+"""
+Copyright 2021 Objectiv B.V.
+"""
@@ -0,0 +1,131 @@
+"""
+Copyright 2021 Objectiv B.V.
+"""
+import psycopg2
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS, \
+    TRANSACTION_STATUS_UNKNOWN
+
+from objectiv_backend.common import db
+from objectiv_backend.common.config import PostgresConfig
+from objectiv_backend.common.db import ConnectionPool
+
+
+class FakeInfo:
+    transaction_status = TRANSACTION_STATUS_IDLE
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query):
+        if self.connection.broken:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        self.connection.queries.append(query)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.info = FakeInfo()
+        self.queries = []
+        self.rollbacks = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+PG_CONFIG = PostgresConfig(hostname='localhost', port=5432, database_name='objectiv', user='objectiv',
+                           password='', pool_min_size=1, pool_max_size=2, pool_health_check_seconds=30)
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    created = []
+
+    def fake_get_db_connection(pg_config):
+        connection = FakeConnection()
+        created.append(connection)
+        return connection
+    monkeypatch.setattr(db, 'get_db_connection', fake_get_db_connection)
+    monkeypatch.setattr(db, 'POOL_TIMEOUT_SECONDS', 0.01)
+    return created
+
+
+def test_pool_reuses_connections(connections):
+    pool = ConnectionPool(PG_CONFIG)
+    assert len(connections) == 1
+    for _ in range(3):
+        with pool.connection() as connection:
+            assert connection is connections[0]
+    assert len(connections) == 1
+
+
+def test_pool_max_size(connections):
+    pool = ConnectionPool(PG_CONFIG)
+    with pool.connection() as connection1:
+        with pool.connection() as connection2:
+            assert connection1 is not connection2
+            with pytest.raises(Exception, match='no database connection available'):
+                with pool.connection():
+                    pass
+    assert len(connections) == 2
+    # both connections are available again
+    with pool.connection() as connection1:
+        with pool.connection():
+            pass
+
+
+def test_pool_rollback_and_discard(connections):
+    pool = ConnectionPool(PG_CONFIG)
+    with pool.connection() as connection:
+        connection.info.transaction_status = TRANSACTION_STATUS_INTRANS
+    assert connection.rollbacks == 1
+    assert not connection.closed
+
+    with pool.connection() as connection:
+        connection.info.transaction_status = TRANSACTION_STATUS_UNKNOWN
+    assert connection.closed
+
+    # a connection that raised an OperationalError is discarded, and replaced by a new connection
+    with pytest.raises(psycopg2.OperationalError):
+        with pool.connection() as connection:
+            raise psycopg2.OperationalError()
+    assert connection.closed
+    with pool.connection() as connection:
+        assert not connection.closed
+    assert len(connections) == 3
+
+
+def test_pool_health_check(connections):
+    pool = ConnectionPool(PG_CONFIG._replace(pool_health_check_seconds=0))
+    with pool.connection() as connection:
+        pass
+    assert connection.queries == ['select 1;']
+
+    # an idle connection that fails the health check is replaced by a new connection
+    connection.broken = True
+    with pool.connection() as new_connection:
+        assert new_connection is not connection
+    assert connection.closed
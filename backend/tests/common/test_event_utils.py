@@ -0,0 +1,60 @@
+"""
+Copyright 2021 Objectiv B.V.
+"""
+import pytest
+
+from objectiv_backend.common.event_utils import add_global_context_to_event, get_context, get_contexts, \
+    get_optional_context
+from objectiv_backend.schema.schema import HttpContext
+
+
+def _event():
+    return {
+        '_type': 'PressEvent',
+        'id': 'event',
+        'global_contexts': [
+            {'_type': 'ApplicationContext', '_types': ['AbstractContext', 'AbstractGlobalContext',
+                                                       'ApplicationContext'], 'id': 'app'}
+        ],
+        'location_stack': [
+            {'_type': 'RootLocationContext', '_types': ['AbstractContext', 'AbstractLocationContext',
+                                                        'RootLocationContext'], 'id': 'home'},
+            {'_type': 'PathContext', 'id': 'https://example.com/'}
+        ]
+    }
+
+
+def test_get_contexts():
+    event = _event()
+    assert [c['id'] for c in get_contexts(event, 'AbstractContext')] == ['app', 'home']
+    assert get_context(event, 'PathContext')['id'] == 'https://example.com/'
+    assert get_optional_context(event, 'HttpContext') is None
+    with pytest.raises(ValueError):
+        get_context(event, 'HttpContext')
+    # looking up contexts doesn't change the event
+    assert event == _event() and type(event['global_contexts']) is list
+
+
+def test_add_global_context_to_event():
+    event = _event()
+    assert get_contexts(event, 'HttpContext') == []
+    add_global_context_to_event(event, HttpContext(id='http', referrer='', user_agent=''))
+    assert get_context(event, 'HttpContext')['id'] == 'http'
+    # global contexts come before the location stack
+    event['global_contexts'][1]['_types'] = ['AbstractContext', 'HttpContext']
+    assert [c['id'] for c in get_contexts(event, 'AbstractContext')] == ['app', 'http', 'home']
+
+
+def test_context_changes():
+    event = _event()
+    assert get_optional_context(event, 'CookieIdContext') is None
+    # contexts that are replaced in place, or of which the type changes, are found
+    event['global_contexts'][0] = {'_type': 'CookieIdContext', 'id': 'cookie'}
+    assert get_context(event, 'CookieIdContext')['id'] == 'cookie'
+    assert get_optional_context(event, 'ApplicationContext') is None
+    event['global_contexts'][0]['_type'] = 'ApplicationContext'
+    assert get_optional_context(event, 'CookieIdContext') is None
+    assert get_context(event, 'ApplicationContext')['id'] == 'cookie'
+    event['location_stack'] = []
+    assert get_optional_context(event, 'PathContext') is None
+
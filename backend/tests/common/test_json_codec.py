@@ -0,0 +1,100 @@
+"""
+Copyright 2021 Objectiv B.V.
+"""
+import json
+import uuid
+from datetime import datetime, timezone, date
+from typing import NamedTuple
+
+import pytest
+
+from objectiv_backend.common import json_codec
+from objectiv_backend.common.json_codec import json_dumps, json_loads
+
+_BACKENDS = [(json_codec._stdlib_dumps, json_codec._stdlib_loads)]
+if json_codec.orjson is not None:
+    _BACKENDS.append((json_codec._orjson_dumps, json_codec._orjson_loads))
+
+
+class _Info(NamedTuple):
+    data: str
+    info: str
+
+
+_EVENT = {
+    '_type': 'PressEvent',
+    'id': '0fb5d2a1-6d4c-4a5f-9a4c-a3fd4b8a5d34',
+    'time': 1631282400000,
+    'location_stack': [{'_type': 'RootLocationContext', 'id': 'home'}],
+    'global_contexts': [
+        {'_type': 'PathContext', 'id': 'https://example.com/é?q=a b&x=\\"\\n'},
+        {'_type': 'InputValueContext', 'id': 'x', 'value': '\u0000 €🙂'},
+    ],
+    'nested': {'float': 0.5, 'negative': -12, 'true': True, 'false': False, 'null': None, 'empty': []}
+}
+
+
+@pytest.mark.parametrize('dumps, loads', _BACKENDS)
+def test_round_trip(dumps, loads):
+    encoded = dumps(_EVENT)
+    assert isinstance(encoded, str)
+    assert loads(encoded) == _EVENT
+    assert loads(encoded.encode('utf-8')) == _EVENT
+    # output is interchangeable with the standard library
+    assert json.loads(encoded) == _EVENT
+
+
+@pytest.mark.parametrize('dumps, loads', _BACKENDS)
+def test_special_types(dumps, loads):
+    event_id = uuid.UUID('0fb5d2a1-6d4c-4a5f-9a4c-a3fd4b8a5d34')
+    data = {
+        'id': event_id,
+        'moment': datetime(2021, 9, 10, 14, 0, 1, 123456),
+        'moment_utc': datetime(2021, 9, 10, 14, 0, 1, tzinfo=timezone.utc),
+        'day': date(2021, 9, 10),
+        'info': _Info(data='a', info='b'),
+        'big': 2 ** 70
+    }
+    assert loads(dumps(data)) == {
+        'id': '0fb5d2a1-6d4c-4a5f-9a4c-a3fd4b8a5d34',
+        'moment': '2021-09-10T14:00:01.123456',
+        'moment_utc': '2021-09-10T14:00:01+00:00',
+        'day': '2021-09-10',
+        'info': ['a', 'b'],
+        'big': 2 ** 70
+    }
+    with pytest.raises(TypeError):
+        dumps({'x': object()})
+
+
+def test_backends_consistent():
+    data = dict(_EVENT, id=uuid.UUID(_EVENT['id']), info=_Info(data='a', info='b'),
+                moment=datetime(2021, 9, 10, 14, 0, 1, 123456))
+    assert json_dumps(data) == json_codec._stdlib_dumps(data)
+    assert json_loads(json_dumps(data)) == json_codec._stdlib_loads(json_codec._stdlib_dumps(data))
+
+
+@pytest.mark.parametrize('dumps, loads', _BACKENDS)
+def test_invalid_json(dumps, loads):
+    for data in ['', '{', '{"a": 1,}', "{'a': 1}"]:
+        with pytest.raises(ValueError):
+            loads(data)
+
+
+@pytest.mark.parametrize('dumps, loads', _BACKENDS)
+def test_surrogates(dumps, loads):
+    # surrogate pairs are decoded, and can be encoded as utf-8
+    value = loads('{"\\ud83d\\ude42": "\\ud83d\\ude42 \\u00e9"}')
+    assert value == {'🙂': '🙂 é'}
+    assert loads(dumps(value).encode('utf-8')) == value
+    # lone surrogates can't be encoded as utf-8 (e.g. to store in Postgres), and are rejected by both backends
+    for data in ['"\\ud800"', '["a\\udc00"]', '{"\\udbff": 1}', '{"a": "\ud800"}', b'"\xed\xa0\x80"']:
+        with pytest.raises(json.JSONDecodeError):
+            loads(data)
+
+
+@pytest.mark.parametrize('dumps, loads', _BACKENDS)
+def test_non_finite_numbers(dumps, loads):
+    for data in ['NaN', '[Infinity]', '{"a": -Infinity}']:
+        with pytest.raises(json.JSONDecodeError):
+            loads(data)
@@ -0,0 +1,95 @@
+"""
+Copyright 2021 Objectiv B.V.
+"""
+import os
+import urllib.request
+
+import pytest
+
+from objectiv_backend.common.metrics import MetricsRegistry, start_metrics_server, CONTENT_TYPE
+
+
+def _samples(registry: MetricsRegistry):
+    pid = os.getpid()
+    return [line.replace(f'pid="{pid}"', 'pid') for line in registry.render().splitlines()
+            if not line.startswith('#')]
+
+
+def test_counter_and_gauge():
+    registry = MetricsRegistry()
+    counter = registry.counter('test_events_total', 'Events.', ['result'])
+    gauge = registry.gauge('test_queue_depth', 'Depth.')
+    counter.inc(result='ok')
+    counter.inc(3, result='ok')
+    counter.inc(result='n"o\\k')
+    gauge.set(2.5)
+    assert counter.get(result='ok') == 4
+    assert _samples(registry) == [
+        'test_events_total{result="n\\"o\\\\k",pid} 1',
+        'test_events_total{result="ok",pid} 4',
+        'test_queue_depth{pid} 2.5'
+    ]
+    lines = registry.render().splitlines()
+    assert lines[:2] == ['# HELP test_events_total Events.', '# TYPE test_events_total counter']
+    with pytest.raises(ValueError):
+        counter.inc(status='ok')
+    with pytest.raises(ValueError):
+        registry.counter('test_events_total', 'Events.')
+
+
+def test_histogram():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('test_seconds', 'Latency.', ['stage'], buckets=(0.1, 1))
+    for value in [0.05, 0.1, 0.5, 2]:
+        histogram.observe(value, stage='parse')
+    with histogram.time(stage='enrichment'):
+        pass
+    assert histogram.get_count(stage='parse') == 4
+    samples = _samples(registry)
+    # the sum of the enrichment stage is the measured time
+    assert samples[3].startswith('test_seconds_sum{stage="enrichment",pid} ')
+    assert samples[:3] + samples[4:] == [
+        'test_seconds_bucket{stage="enrichment",pid,le="0.1"} 1',
+        'test_seconds_bucket{stage="enrichment",pid,le="1"} 1',
+        'test_seconds_bucket{stage="enrichment",pid,le="+Inf"} 1',
+        'test_seconds_count{stage="enrichment",pid} 1',
+        'test_seconds_bucket{stage="parse",pid,le="0.1"} 2',
+        'test_seconds_bucket{stage="parse",pid,le="1"} 3',
+        'test_seconds_bucket{stage="parse",pid,le="+Inf"} 4',
+        'test_seconds_sum{stage="parse",pid} 2.65',
+        'test_seconds_count{stage="parse",pid} 4'
+    ]
+
+
+def test_collect_hook():
+    registry = MetricsRegistry()
+    gauge = registry.gauge('test_queue_depth', 'Depth.', ['queue'])
+
+    def failing_hook():
+        raise Exception('database unavailable')
+
+    registry.add_collect_hook(failing_hook)
+    registry.add_collect_hook(lambda: gauge.set(7, queue='entry'))
+    # errors in hooks are printed, the other metrics are still rendered
+    assert _samples(registry) == ['test_queue_depth{queue="entry",pid} 7']
+
+
+def test_metrics_server():
+    server = start_metrics_server(port=0)
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+        with urllib.request.urlopen(url) as response:
+            assert response.headers['Content-Type'] == CONTENT_TYPE
+            assert '# TYPE objectiv_collector_requests_total counter' in response.read().decode('utf-8')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_metrics_server_host():
+    # the metrics are not served on all interfaces, unless configured
+    server = start_metrics_server(port=0)
+    try:
+        assert server.server_address[0] == '127.0.0.1'
+    finally:
+        server.server_close()
@@ -0,0 +1,30 @@
+"""
+Copyright 2021 Objectiv B.V.
+"""
+import os
+
+from objectiv_backend.common import per_process
+from objectiv_backend.common.per_process import PerProcess
+
+
+def test_per_process(monkeypatch):
+    closed = []
+    holder = PerProcess(lambda name: [name], close=closed.append)
+    first = holder.get('a')
+    assert holder.get('a') is first
+
+    # other arguments replace the object, and close the old one
+    second = holder.get('b')
+    assert second == ['b'] and closed == [first]
+
+    # a forked process creates its own object, and doesn't close the object of its parent at exit
+    parent_pid = os.getpid()
+    monkeypatch.setattr(per_process.os, 'getpid', lambda: parent_pid + 1)
+    third = holder.get('b')
+    assert third is not second
+    holder._close_at_exit()
+    assert closed == [first, third]
+
+    monkeypatch.setattr(per_process.os, 'getpid', lambda: parent_pid)
+    holder._close_at_exit()
+    assert closed == [first, third]
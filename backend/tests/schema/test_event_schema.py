@@ -157,6 +157,34 @@ def test_all_child_context_types():
     assert schema.get_all_child_context_types('ExtraContext') == {'ExtraContext'}
 
 
+def test_sorted_parent_types():
+    schema = _get_schema()
+    assert schema.get_sorted_parent_event_types('GrandChildEvent') == \
+           ('BaseEvent', 'Child2Event', 'ChildEvent', 'GrandChildEvent')
+    assert schema.get_sorted_parent_context_types('X') == ('X', )
+    assert schema.get_sorted_parent_context_types('ExtraContext') == \
+           ('BaseContext', 'ExtraContext', 'OtherContext')
+
+
+def test_required_contexts_mask():
+    schema = _get_schema()
+
+    def has_required_contexts(event_type, context_types):
+        mask = 0
+        for context_type in context_types:
+            mask |= schema.get_context_type_mask(context_type)
+        required_mask = schema.get_required_contexts_mask(event_type)
+        return required_mask & mask == required_mask
+
+    assert schema.get_context_type_mask('X') == 0
+    assert has_required_contexts('ChildEvent', ['BaseContext'])
+    assert not has_required_contexts('GrandChildEvent', ['BaseContext', 'X'])
+    # parent types are included: an OtherContext is also a BaseContext
+    assert has_required_contexts('GrandChildEvent', ['OtherContext'])
+    assert not has_required_contexts('GreatGrandChildEvent', ['OtherContext'])
+    assert has_required_contexts('GreatGrandChildEvent', ['ExtraContext'])
+
+
 def test_get_context_schema():
     schema = _get_schema()
     base_context_json_schema = {
@@ -209,6 +237,31 @@ def test_optional_property():
     assert other_context['required'] == ['id', 'other_property']
 
 
+def test_get_validators():
+    schema = _get_schema()
+    assert schema.get_event_validator('NonExistingEvent') is None
+    assert schema.get_context_validator('NonExistingContext') is None
+
+    validator = schema.get_context_validator('OtherContext')
+    assert validator.is_valid({'id': 'x', 'other_property': 1, 'optional_property': None})
+    assert not validator.is_valid({'id': 'x'})
+
+    event_validator = schema.get_event_validator('BaseEvent')
+    assert event_validator.is_valid({})
+    assert not event_validator.is_valid([])
+
+
+def test_get_validators_extended_schema():
+    schema = EventSchema().get_extended_schema(_SIMPLE_BASE_SCHEMA)
+    assert schema.get_context_validator('ExtraContext') is None
+    extended_schema = schema.get_extended_schema(_EXTENSION_TO_SIMPLE_BASE_SCHEMA)
+    # the original schema is unmodified, the extended schema has newly compiled validators
+    assert schema.get_context_validator('ExtraContext') is None
+    validator = extended_schema.get_context_validator('ExtraContext')
+    assert not validator.is_valid({'id': 'x', 'other_property': 1})
+    assert validator.is_valid({'id': 'x', 'other_property': 1, 'extra_property': 'y'})
+
+
 # ### Below are helper functions and test data
 def _get_schema() -> EventSchema:
 
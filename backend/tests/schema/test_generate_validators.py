@@ -0,0 +1,166 @@
+"""
+Copyright 2021 Objectiv B.V.
+
+Differential tests: the generated validators must agree with the jsonschema validation, on the test events
+and on fuzzed events.
+"""
+import os
+import random
+from copy import deepcopy
+
+from objectiv_backend.common import config
+from objectiv_backend.common.config import get_collector_config
+from objectiv_backend.schema.event_schemas import EventSchema, get_event_schema
+from objectiv_backend.schema.generate_validators import compile_validators, generate_validators_source
+from objectiv_backend.schema.validate_events import validate_event_adheres_to_schema, \
+    validate_events_adhere_to_schema
+from tests.schema.test_validate_events import _get_events
+
+_EXTENSIONS_DIRECTORY = os.path.join(os.path.dirname(__file__), '..', 'test_data', 'schemas1')
+
+_FUZZ_VALUES = [
+    None, True, False, 0, 1, -1, 1.0, 1.5, float('nan'), '', 'text', 'd8b0f1ca-4ebe-45b6-b7fb-7858cf46082a',
+    'D8B0F1CA-4EBE-45B6-B7FB-7858CF46082A', 'd8b0f1ca-4ebe-15b6-b7fb-7858cf46082a', [], [1], [{}], ['a'],
+    {}, {'a': 1}, {'_type': 'ApplicationContext', 'id': 'app'}
+]
+
+
+def _get_corpus(event_schema: EventSchema):
+    """ Give the test events, and events with a context of every type """
+    events = _get_events()
+    for context_type in event_schema.list_context_types():
+        event = deepcopy(events[0])
+        context = {'_type': context_type, 'id': 'id'}
+        # fill in all properties, with the right type for the common cases
+        schema = event_schema.get_context_schema(context_type)
+        for name, property_schema in schema['properties'].items():
+            if name not in context:
+                context[name] = 'value' if 'string' in property_schema['type'] else 1
+        event['global_contexts'].append(context)
+        event['location_stack'].insert(0, deepcopy(context))
+        events.append(event)
+    return events
+
+
+def _fuzz_event(rng: random.Random, event_schema: EventSchema, corpus, property_names):
+    """ Give a copy of a random event of the corpus, with random changes to the event and its contexts. """
+    event = deepcopy(rng.choice(corpus))
+    for _ in range(rng.randint(1, 3)):
+        contexts = [context for key in ('global_contexts', 'location_stack')
+                    if isinstance(event.get(key), list)
+                    for context in event[key] if isinstance(context, dict)]
+        target = rng.choice(contexts) if contexts and rng.random() < 0.7 else event
+        mutation = rng.randrange(8)
+        if mutation == 0 and target:
+            target[rng.choice(list(target.keys()))] = rng.choice(_FUZZ_VALUES)
+        elif mutation == 1 and target:
+            del target[rng.choice(list(target.keys()))]
+        elif mutation == 2:
+            target[rng.choice(property_names)] = rng.choice(_FUZZ_VALUES)
+        elif mutation == 3:
+            types = event_schema.list_event_types() if target is event else event_schema.list_context_types()
+            target['_type'] = rng.choice(types + ['UnknownType'])
+        elif mutation == 4 and isinstance(event.get('global_contexts'), list) \
+                and isinstance(event.get('location_stack'), list):
+            # move a context to the other list
+            source, destination = rng.sample([event['global_contexts'], event['location_stack']], 2)
+            if source:
+                destination.append(source.pop(rng.randrange(len(source))))
+        elif mutation == 5 and isinstance(event.get('location_stack'), list) and event['location_stack']:
+            event['location_stack'].pop(rng.randrange(len(event['location_stack'])))
+        elif mutation == 6:
+            event[rng.choice(['global_contexts', 'location_stack'])] = rng.choice(_FUZZ_VALUES)
+        elif mutation == 7 and isinstance(event.get('global_contexts'), list):
+            event['global_contexts'].append(rng.choice(_FUZZ_VALUES))
+    return event
+
+
+def _get_fuzzed_events(event_schema: EventSchema, count: int):
+    corpus = _get_corpus(event_schema)
+    property_names = sorted({name for context_type in event_schema.list_context_types()
+                             for name in event_schema.get_context_schema(context_type)['properties']} |
+                            {'time', 'id', 'extra'})
+    rng = random.Random(1234)
+    return corpus + [_fuzz_event(rng, event_schema, corpus, property_names) for _ in range(count)]
+
+
+def _get_jsonschema_errors(event_schema: EventSchema, event):
+    """ Give the errors of the jsonschema validation, or None if the validation raises. """
+    try:
+        return validate_event_adheres_to_schema(event_schema=event_schema, event=event)
+    except (KeyError, TypeError):
+        return None
+
+
+def _assert_same_as_jsonschema(event_schema: EventSchema, events):
+    validators = compile_validators(event_schema)
+    valid_count = 0
+    for event in events:
+        for contexts in (event.get('global_contexts'), event.get('location_stack')):
+            for context in contexts if isinstance(contexts, list) else []:
+                context_type = context.get('_type') if isinstance(context, dict) else None
+                for context_type in [context_type, 'ApplicationContext', 'MarketingContext']:
+                    if isinstance(context_type, str) and context_type in validators.context_validators:
+                        expected = event_schema.get_context_validator(context_type).is_valid(context)
+                        assert validators.context_validators[context_type](context) == expected, context
+        event_type = event.get('_type')
+        if isinstance(event_type, str) and event_type in validators.event_validators:
+            expected = event_schema.get_event_validator(event_type).is_valid(event)
+            assert validators.event_validators[event_type](event) == expected, event
+
+        errors = _get_jsonschema_errors(event_schema, event)
+        assert validators.is_valid_event(event) == (errors == []), (event, errors)
+        valid_count += errors == []
+    # make sure that the events are not all valid, or all invalid
+    assert 0 < valid_count < len(events)
+
+
+def test_generated_validators_default_schema():
+    event_schema = get_collector_config().event_schema
+    _assert_same_as_jsonschema(event_schema, _get_fuzzed_events(event_schema, 2000))
+
+
+def test_generated_validators_extended_schema():
+    event_schema = get_event_schema(schema_extensions_directory=_EXTENSIONS_DIRECTORY)
+    assert 'XContext' in compile_validators(event_schema).context_validators
+    _assert_same_as_jsonschema(event_schema, _get_fuzzed_events(event_schema, 500))
+
+
+def test_generated_validators_unsupported_keyword():
+    # A context type with a keyword that the generator doesn't support, is validated with jsonschema
+    event_schema = get_collector_config().event_schema.get_extended_schema({
+        'name': 'test',
+        'version': {'test': '0.0.1'},
+        'events': {},
+        'contexts': {
+            'LimitedContext': {
+                'parents': ['AbstractGlobalContext'],
+                'description': 'test context',
+                'properties': {
+                    'code': {'type': 'string', 'description': 'code', 'maxLength': 3}
+                }
+            }
+        }
+    })
+    source = generate_validators_source(event_schema)
+    assert "'LimitedContext': _JSONSCHEMA_CONTEXT_VALIDATORS['LimitedContext']" in source
+    assert "'ApplicationContext': _validate_context_ApplicationContext" in source
+    is_valid_context = compile_validators(event_schema).context_validators['LimitedContext']
+    assert is_valid_context({'_type': 'LimitedContext', 'id': 'x', 'code': 'abc'})
+    assert not is_valid_context({'_type': 'LimitedContext', 'id': 'x', 'code': 'abcd'})
+
+
+def test_validate_events_generated(monkeypatch):
+    event_schema = get_collector_config().event_schema
+    # only events that have the structure that validate_event_list() checks, other events can make the
+    # jsonschema validation raise
+    events = [event for event in _get_fuzzed_events(event_schema, 500)
+              if isinstance(event.get('global_contexts'), list) and isinstance(event.get('location_stack'), list)
+              and _get_jsonschema_errors(event_schema, event) is not None]
+    expected_single = [validate_event_adheres_to_schema(event_schema, event) for event in events]
+    expected_batch = validate_events_adhere_to_schema(event_schema, events)
+
+    monkeypatch.setattr(config, '_CACHED_COLLECTOR_CONFIG',
+                        get_collector_config()._replace(schema_validator='generated'))
+    assert [validate_event_adheres_to_schema(event_schema, event) for event in events] == expected_single
+    assert validate_events_adhere_to_schema(event_schema, events) == expected_batch
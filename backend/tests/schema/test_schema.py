@@ -193,3 +193,29 @@ def test_add_context_with_optionals_set():
     assert marketing_context['term'] == context_vars['term']
     assert 'content' in marketing_context
     assert marketing_context['content'] == context_vars['content']
+
+
+def test_validate_structure_event_list():
+    event_list = json.loads(CLICK_EVENT_JSON)
+    assert validate_structure_event_list(event_list) == []
+
+    # the fast path must never accept data that the full event-list schema rejects
+    validator = get_collector_config().event_list_validator
+    assert validator.is_valid(event_list)
+
+    # integer-valued floats are valid json-schema integers, these are accepted by the full validation
+    event_list['transport_time'] = 1630049335313.0
+    assert validate_structure_event_list(event_list) == []
+
+    invalid_event_lists = [
+        {'events': event_list['events']},
+        {'events': event_list['events'], 'transport_time': 'now'},
+        {'events': {}, 'transport_time': 1630049335313},
+        {'events': ['event'], 'transport_time': 1630049335313},
+        {'events': [], 'transport_time': True},
+    ]
+    for invalid_event_list in invalid_event_lists:
+        assert not validator.is_valid(invalid_event_list)
+        errors = validate_structure_event_list(invalid_event_list)
+        assert len(errors) == 1
+        assert errors[0].info.startswith('Overall structure does not adhere to schema')
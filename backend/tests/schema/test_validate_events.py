@@ -0,0 +1,59 @@
+"""
+Copyright 2021 Objectiv B.V.
+"""
+import json
+from copy import deepcopy
+
+from objectiv_backend.common.config import get_collector_config
+from objectiv_backend.schema.schema import HttpContext
+from objectiv_backend.schema.validate_events import validate_event_adheres_to_schema, \
+    validate_events_adhere_to_schema
+from tests.schema.test_schema import CLICK_EVENT_JSON
+
+
+def _get_event(**changes):
+    event = json.loads(CLICK_EVENT_JSON)['events'][0]
+    event.update(changes)
+    return event
+
+
+def _get_events():
+    """ Give a list of events, with a variety of valid and invalid events and contexts. """
+    shared_context = HttpContext(id='http_context', referrer='', user_agent='test', remote_address='::1')
+    events = [_get_event() for _ in range(3)]
+    for event in events:
+        event['global_contexts'].append(shared_context)
+    location_stack = _get_event()['location_stack']
+    events.extend([
+        _get_event(_type='UnknownEvent'),
+        _get_event(_type='VisibleEvent'),
+        _get_event(id='not-a-uuid', time='now'),
+        # global context on the location stack, and the other way around
+        _get_event(location_stack=location_stack + [deepcopy(shared_context)]),
+        _get_event(global_contexts=location_stack[:1]),
+        # missing required context
+        _get_event(location_stack=location_stack[:2]),
+        # unknown context type
+        _get_event(global_contexts=[{'_type': 'UnknownContext', 'id': 'x'}]),
+        # invalid contexts, of which the first two are equal in python, but not in json
+        _get_event(global_contexts=[{'_type': 'ApplicationContext', 'id': 1}]),
+        _get_event(global_contexts=[{'_type': 'ApplicationContext', 'id': True}]),
+        _get_event(global_contexts=[{'_type': 'ApplicationContext', 'id': 'app', 'extra': [1]}]),
+        _get_event(global_contexts=[{'_type': 'ApplicationContext'}]),
+    ])
+    return events
+
+
+def test_validate_events_adhere_to_schema():
+    event_schema = get_collector_config().event_schema
+    events = _get_events()
+    expected = [validate_event_adheres_to_schema(event_schema=event_schema, event=event) for event in events]
+    result = validate_events_adhere_to_schema(event_schema=event_schema, events=events)
+    assert result == expected
+    # the errors refer to the contexts of the event itself, not to an equal context of another event
+    for result_errors, expected_errors in zip(result, expected):
+        assert [error.data for error in result_errors] == [error.data for error in expected_errors]
+        assert all(result_error.data is expected_error.data
+                   for result_error, expected_error in zip(result_errors, expected_errors))
+    assert [len(errors) for errors in result] == [0, 0, 0, 1, 0, 1, 1, 2, 1, 2, 1, 1, 0, 1]
+    assert validate_events_adhere_to_schema(event_schema=event_schema, events=[]) == []
@@ -0,0 +1,109 @@
+"""
+Copyright 2021 Objectiv B.V.
+"""
+from datetime import date
+
+from psycopg2.errors import CheckViolation
+
+from objectiv_backend.tools.db_partitions import db_partitions
+from objectiv_backend.tools.db_partitions.db_partitions import partition_name, parse_partition_day, \
+    maintain_partitions, create_partition
+
+
+def test_partition_name():
+    assert partition_name('data', date(2021, 3, 7)) == 'data_p20210307'
+    assert partition_name('nok_data', date(2021, 12, 31)) == 'nok_data_p20211231'
+
+
+def test_parse_partition_day():
+    assert parse_partition_day('data', 'data_p20210307') == date(2021, 3, 7)
+    assert parse_partition_day('nok_data', 'nok_data_p20211231') == date(2021, 12, 31)
+    assert parse_partition_day('data', 'data_default') is None
+    assert parse_partition_day('data', 'nok_data_p20210307') is None
+    assert parse_partition_day('data', 'data_p2021030') is None
+
+
+def test_maintain_partitions(monkeypatch):
+    existing_days = [date(2021, 3, 1), date(2021, 3, 2), date(2021, 3, 5), date(2021, 3, 6)]
+    created = []
+    archived = []
+    monkeypatch.setattr(db_partitions, 'get_partition_days', lambda connection, table_name: existing_days)
+    monkeypatch.setattr(db_partitions, 'create_partition',
+                        lambda connection, table_name, day: created.append((table_name, day)))
+    monkeypatch.setattr(db_partitions, 'archive_partition',
+                        lambda connection, table_name, day, archive_schema:
+                        archived.append((table_name, day, archive_schema)))
+
+    maintain_partitions(None, today=date(2021, 3, 5), days_ahead=2)
+    assert created == [('data', date(2021, 3, 7)), ('nok_data', date(2021, 3, 7))]
+    assert archived == []
+
+    created.clear()
+    maintain_partitions(None, today=date(2021, 3, 5), days_ahead=1, retention_days=3, archive_schema=None)
+    assert created == []
+    assert archived == [('data', date(2021, 3, 1), None), ('nok_data', date(2021, 3, 1), None)]
+
+
+class _FakeCursor:
+    """ Cursor on a data table with only a default partition, see _FakeConnection. """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, params=None):
+        connection = self.connection
+        query = repr(query)
+        connection.queries.append(query)
+        if 'lock table' in query:
+            connection.default_locked = True
+        elif 'delete from' in query:
+            self.rowcount = connection.default_days.count(params[0])
+            connection.default_days = [day for day in connection.default_days if day != params[0]]
+            # another transaction inserts an event for the day, which is blocked by a lock
+            if connection.default_locked:
+                connection.blocked_inserts.append(params[0])
+            else:
+                connection.default_days.append(params[0])
+        elif 'attach partition' in query and params[0] in connection.default_days:
+            raise CheckViolation('updated partition constraint for default partition would be violated')
+
+
+class _FakeConnection:
+    """
+    Connection to a database with a data table that only has a default partition. After rows are moved
+    from the default partition, another transaction inserts a row for the same day.
+    :param default_days: per row in the default partition, its day
+    """
+
+    def __init__(self, default_days):
+        self.default_days = default_days
+        self.default_locked = False
+        self.blocked_inserts = []
+        self.queries = []
+
+    def cursor(self):
+        return _FakeCursor(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        # the blocked insert continues after commit, and is written to the new partition
+        self.default_locked = False
+
+
+def test_create_partition_concurrent_insert():
+    day = date(2021, 3, 7)
+    connection = _FakeConnection(default_days=[day, date(2021, 3, 8), day])
+    create_partition(connection, 'data', day)
+    assert connection.default_days == [date(2021, 3, 8)]
+    assert connection.blocked_inserts == [day]
+    assert 'lock table' in connection.queries[0]
+    assert not connection.default_locked
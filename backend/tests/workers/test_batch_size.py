@@ -0,0 +1,68 @@
+"""
+Copyright 2021 Objectiv B.V.
+"""
+import pytest
+from psycopg2.errors import LockNotAvailable
+
+from objectiv_backend.common.metrics import WORKER_BATCH_EVENTS, WORKER_LOCK_TIMEOUTS, \
+    WORKER_CURRENT_BATCH_SIZE
+from objectiv_backend.workers.batch_size import AdaptiveBatchSize, run_batch
+
+
+def test_adaptive_batch_size_bounds():
+    assert AdaptiveBatchSize(initial_size=1, min_size=10, max_size=100).size == 10
+    assert AdaptiveBatchSize(initial_size=1000, min_size=10, max_size=100).size == 100
+    with pytest.raises(ValueError):
+        AdaptiveBatchSize(initial_size=10, min_size=100, max_size=10)
+    with pytest.raises(ValueError):
+        AdaptiveBatchSize(initial_size=10, min_size=0, max_size=10)
+    with pytest.raises(ValueError):
+        AdaptiveBatchSize(initial_size=10, min_size=1, max_size=10, target_seconds=0)
+
+
+def test_adaptive_batch_size():
+    batch_size = AdaptiveBatchSize(initial_size=100, min_size=10, max_size=1000, target_seconds=1)
+    # queue is not deep: no change
+    batch_size.record_batch(batch_size=100, event_count=50, duration=0.1)
+    assert batch_size.size == 100
+    # full, fast batches: grow till the maximum
+    batch_size.record_batch(batch_size=100, event_count=100, duration=0.1)
+    assert batch_size.size == 200
+    for _ in range(5):
+        batch_size.record_batch(batch_size=batch_size.size, event_count=batch_size.size, duration=0.1)
+    assert batch_size.size == 1000
+    # slow batch: shrink proportionally
+    batch_size.record_batch(batch_size=1000, event_count=1000, duration=4)
+    assert batch_size.size == 250
+    # lock timeouts: halve till the minimum
+    batch_size.record_lock_timeout()
+    assert batch_size.size == 125
+    for _ in range(5):
+        batch_size.record_lock_timeout()
+    assert batch_size.size == 10
+
+
+def test_run_batch():
+    batch_size = AdaptiveBatchSize(name='test', initial_size=100, min_size=10, max_size=1000,
+                                   target_seconds=1)
+    assert run_batch(batch_size, lambda max_items: max_items) == 100
+    assert batch_size.size == 200
+    assert WORKER_BATCH_EVENTS.get_count(worker='test') == 1
+    assert WORKER_CURRENT_BATCH_SIZE.get(worker='test') == 200
+    # empty batches are not recorded in the batch metrics
+    assert run_batch(batch_size, lambda max_items: 0) == 0
+    assert WORKER_BATCH_EVENTS.get_count(worker='test') == 1
+
+    def lock_timeout(max_items: int) -> int:
+        raise LockNotAvailable()
+
+    assert run_batch(batch_size, lock_timeout) == 0
+    assert batch_size.size == 100
+    assert WORKER_LOCK_TIMEOUTS.get(worker='test') == 1
+
+    def error(max_items: int) -> int:
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        run_batch(batch_size, error)
+    assert batch_size.size == 100
@@ -0,0 +1,29 @@
+"""
+Copyright 2021 Objectiv B.V.
+"""
+from objectiv_backend.workers.pg_copy import _CopyRowsFile, _escape_copy_text
+
+
+def test_escape_copy_text():
+    assert _escape_copy_text('plain text') == 'plain text'
+    assert _escape_copy_text(123) == '123'
+    assert _escape_copy_text('{"a": "b\\\\c"}') == '{"a": "b\\\\\\\\c"}'
+    assert _escape_copy_text('a\tb\nc\rd') == 'a\\tb\\nc\\rd'
+
+
+def test_copy_rows_file():
+    rows = [('id1', 'value\t1'), ('id2', 'value\\2'), ('id3', 'waarde €')]
+    expected = 'id1\tvalue\\t1\nid2\tvalue\\\\2\nid3\twaarde €\n'
+    assert _CopyRowsFile(rows).read() == expected
+
+    # reading in small chunks gives the same data
+    rows_file = _CopyRowsFile(rows)
+    chunks = []
+    while True:
+        chunk = rows_file.read(5)
+        if not chunk:
+            break
+        assert len(chunk) <= 5
+        chunks.append(chunk)
+    assert ''.join(chunks) == expected
+    assert _CopyRowsFile([]).read(10) == ''
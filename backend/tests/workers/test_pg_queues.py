@@ -0,0 +1,118 @@
+"""
+Copyright 2021 Objectiv B.V.
+"""
+import socket
+
+from psycopg2.errors import LockNotAvailable
+
+from objectiv_backend.workers.pg_queues import PostgresQueues, ProcessingStage
+
+
+class _FakeConnection:
+    """ Connection with a real socket, on which the 'database' side can send notifications. """
+
+    def __init__(self):
+        self._client, self.server = socket.socketpair()
+        self.notifies = []
+
+    def fileno(self):
+        return self._client.fileno()
+
+    def poll(self):
+        for _ in self._client.recv(1024):
+            self.notifies.append('notification')
+
+
+def test_wait_for_notification():
+    connection = _FakeConnection()
+    pg_queues = PostgresQueues(connection=connection)
+    assert pg_queues.wait_for_notification(timeout=0.01) is False
+
+    connection.server.send(b'x')
+    assert pg_queues.wait_for_notification(timeout=1) is True
+    assert connection.notifies == []
+    assert pg_queues.wait_for_notification(timeout=0.01) is False
+
+    # notifications that were already received, e.g. while executing a query, don't need waiting
+    connection.notifies.append('notification')
+    assert pg_queues.wait_for_notification(timeout=0) is True
+    assert connection.notifies == []
+
+
+class _FakeDatabase:
+    """
+    Connection and cursor that record the queries, for the queue buckets with the 'rotating' layout.
+    :param events: per bucket table the number of events, tables that are not in here take no space
+    :param locked: bucket tables that are locked by another transaction
+    """
+
+    def __init__(self, events, locked=()):
+        self.events = events
+        self.locked = locked
+        self.queries = []
+        self.transactions = []
+        self._result = None
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def commit(self):
+        self.transactions.append('commit')
+
+    def rollback(self):
+        self.transactions.append('rollback')
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+        table_name = query.split()[-1].rstrip(';')
+        if query.startswith('select name from unnest'):
+            self._result = [(name, ) for name in params[0] if name in self.events]
+        elif query.startswith('select not exists'):
+            table_name = query.split(' from ')[1].split()[0]
+            self._result = [(self.events[table_name] == 0, )]
+        elif query.startswith('lock table') and query.split()[2] in self.locked:
+            raise LockNotAvailable('lock timeout')
+        elif query.startswith('truncate'):
+            self.events[table_name] = 0
+
+    def fetchone(self):
+        return self._result[0]
+
+    def fetchall(self):
+        return self._result
+
+    def copy_expert(self, query, rows_file, size):
+        self.queries.append((query, rows_file.read()))
+
+
+def test_put_events_rotating():
+    database = _FakeDatabase(events={})
+    pg_queues = PostgresQueues(connection=database, write_engine='copy', queue_layout='rotating',
+                               bucket_seconds=300, clock=lambda: 300 * 6 + 10)
+    assert pg_queues.get_current_bucket() == 2
+    pg_queues.put_events(ProcessingStage.FINALIZE, [{'id': 'id1'}])
+    query, rows = database.queries[0]
+    assert 'queue_finalize_b2' in repr(query) and "'bucket'" in repr(query)
+    assert rows == 'id1\t{"id":"id1"}\t2\n'
+    assert database.queries[1] == 'notify queue_finalize;'
+
+
+def test_truncate_drained_buckets():
+    database = _FakeDatabase(events={
+        'queue_entry_b0': 0, 'queue_entry_b1': 0, 'queue_entry_b2': 5, 'queue_entry_b3': 0,
+        'queue_finalize_b0': 0
+    }, locked=['queue_entry_b3'])
+    pg_queues = PostgresQueues(connection=database, queue_layout='rotating', bucket_seconds=300,
+                               clock=lambda: 300 * 5)
+    # The current bucket (1) is not truncated, neither are buckets with events, or that stay locked
+    assert pg_queues.truncate_drained_buckets() == ['queue_entry_b0', 'queue_finalize_b0']
+    assert database.transactions == ['commit', 'commit', 'commit', 'rollback', 'commit']
+    assert 'lock table queue_entry_b2 in access exclusive mode;' not in database.queries
+
+    assert PostgresQueues(connection=None, queue_layout='table').truncate_drained_buckets() == []
@@ -0,0 +1,72 @@
+"""
+Copyright 2021 Objectiv B.V.
+"""
+import pytest
+
+from objectiv_backend.common.types import FailureReason
+from objectiv_backend.workers import pg_storage
+from objectiv_backend.workers.recent_event_ids import RecentEventIds
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _events(*event_ids: str):
+    return [{'id': event_id} for event_id in event_ids]
+
+
+def test_recent_event_ids():
+    clock = _Clock()
+    recent_event_ids = RecentEventIds(max_size=3, max_age_seconds=60, clock=clock)
+    recent_event_ids.add(['a', 'b'])
+    clock.now += 30
+    recent_event_ids.add(['c', 'd'])
+    # 'a' is forgotten, as at most 3 ids are kept
+    assert len(recent_event_ids) == 3
+    assert 'a' not in recent_event_ids
+    assert 'b' in recent_event_ids
+
+    new_events, duplicate_events = recent_event_ids.split_duplicates(_events('a', 'b', 'd', 'e'))
+    assert new_events == _events('a', 'e')
+    assert duplicate_events == _events('b', 'd')
+
+    # ids are forgotten after max_age_seconds
+    clock.now += 31
+    assert 'b' not in recent_event_ids
+    assert 'c' in recent_event_ids
+    clock.now += 30
+    assert len(recent_event_ids) == 0
+    events = _events('c', 'd')
+    assert recent_event_ids.split_duplicates(events) == (events, [])
+
+
+def test_recent_event_ids_disabled():
+    recent_event_ids = RecentEventIds(max_size=0, max_age_seconds=60)
+    recent_event_ids.add(['a'])
+    assert 'a' not in recent_event_ids
+    assert recent_event_ids.split_duplicates(_events('a')) == (_events('a'), [])
+    with pytest.raises(ValueError):
+        RecentEventIds(max_size=-1, max_age_seconds=60)
+
+
+def test_insert_known_duplicates(monkeypatch):
+    nok_inserts = []
+    monkeypatch.setattr(pg_storage, 'insert_events_into_nok_data',
+                        lambda connection, events, reason, write_engine: nok_inserts.append((events, reason)))
+
+    class _NoDatabase:
+        def cursor(self):
+            raise AssertionError('Known duplicates must not be inserted in the data table')
+
+    recent_event_ids = RecentEventIds(max_size=10, max_age_seconds=60)
+    recent_event_ids.add(['a', 'b'])
+    events = _events('a', 'b')
+    inserted_event_ids = pg_storage.insert_events_into_data(
+        _NoDatabase(), events, recent_event_ids=recent_event_ids)
+    assert inserted_event_ids == []
+    assert nok_inserts == [(events, FailureReason.DUPLICATE)]
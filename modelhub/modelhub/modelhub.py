@@ -1,14 +1,14 @@
 """
 Copyright 2021 Objectiv B.V.
 """
-from typing import List, Union
+from typing import List, Union, Dict, Optional
 from typing import TYPE_CHECKING
 
 import bach
 from modelhub.aggregate import Aggregate
 from modelhub.map import Map
 from modelhub.series.series_objectiv import MetaBase
-from sql_models.constants import NotSet, DBDialect
+from sql_models.constants import NotSet
 from modelhub.stack.util import sessionized_data_model
 
 if TYPE_CHECKING:
@@ -20,6 +20,44 @@ GroupByType = Union[List[Union[str, bach.Series]], str, bach.Series, NotSet]
 TIME_DEFAULT_FORMAT = 'YYYY-MM-DD HH24:MI:SS.MS'
 
 
+# Columns of the data table with their database types, for the supported data layouts. In the 'json' layout
+# the full event is stored as json. In the 'extracted' layout the event is stored as jsonb, and the contexts
+# and event types that are needed by the models are stored in separate columns, so they don't have to be
+# extracted from the json.
+# We compare the database types, as multiple Bach dtypes share the jsonb database type.
+_DATA_LAYOUT_DB_DTYPES = {
+    'json': {
+        'event_id': 'uuid',
+        'day': 'date',
+        'moment': 'timestamp without time zone',
+        'cookie_id': 'uuid',
+        'value': 'json'
+    },
+    'extracted': {
+        'event_id': 'uuid',
+        'day': 'date',
+        'moment': 'timestamp without time zone',
+        'cookie_id': 'uuid',
+        'value': 'jsonb',
+        'event_type': 'text',
+        'stack_event_types': 'jsonb',
+        'global_contexts': 'jsonb',
+        'location_stack': 'jsonb'
+    }
+}
+
+
+def _get_data_layout(db_dtypes: Dict[str, str]) -> Optional[str]:
+    """
+    Give the data layout of a table with the given columns and database types, or None if the layout is
+    unknown.
+    """
+    for data_layout, columns in _DATA_LAYOUT_DB_DTYPES.items():
+        if db_dtypes == columns:
+            return data_layout
+    return None
+
+
 class ModelHub():
     """
     The model hub contains collection of data models and convenience functions that you can take, combine and
@@ -104,7 +142,9 @@ class ModelHub():
         :param db_url: the url that indicate database dialect and connection arguments. If not given, env DSN
             is used to create one. If that's not there, the default of
             'postgresql://objectiv:@localhost:5432/objectiv' will be used.
-        :param table_name: the name of the sql table where the data is stored.
+        :param table_name: the name of the sql table where the data is stored. The data layout of the table
+            is detected: either the full events are stored in a json column, or as jsonb with the contexts and
+            event types also stored in separate columns. The latter is faster to query.
         :param start_date: first date for which data is loaded to the DataFrame. If None, data is loaded from
             the first date in the sql table. Format as 'YYYY-MM-DD'.
         :param end_date: last date for which data is loaded to the DataFrame. If None, data is loaded up to
@@ -126,23 +166,16 @@ class ModelHub():
 
         with engine.connect() as conn:
             res = conn.execute(sql)
-        db_dialect = DBDialect.from_engine(engine)
-        dtypes = {
-            x[0]: bach.types.get_dtype_from_db_dtype(db_dialect=db_dialect, db_dtype=x[1])
-            for x in res.fetchall()
-        }
+        db_dtypes = {x[0]: x[1] for x in res.fetchall()}
 
-        expected_columns = {'event_id': 'uuid',
-                            'day': 'date',
-                            'moment': 'timestamp',
-                            'cookie_id': 'uuid',
-                            'value': 'json'}
-        if dtypes != expected_columns:
-            raise KeyError(f'Expected columns not in table {table_name}. Found: {dtypes}')
+        data_layout = _get_data_layout(db_dtypes)
+        if data_layout is None:
+            raise KeyError(f'Expected columns not in table {table_name}. Found: {db_dtypes}')
 
         model = sessionized_data_model(start_date=start_date,
                                        end_date=end_date,
-                                       table_name=table_name)
+                                       table_name=table_name,
+                                       data_layout=data_layout)
         # The model returned by `sessionized_data_model()` has different columns than the underlying table.
         # Note that the order of index_dtype and dtypes matters, as we use it below to get the model_columns
         index_dtype = {'event_id': 'uuid'}
@@ -11,6 +11,18 @@ class ExtractedContexts(SqlModelBuilder):
         return _SQL
 
 
+class ExtractedColumns(SqlModelBuilder):
+    """
+    Same columns as ExtractedContexts, for tables with the 'extracted' data layout. In that layout the
+    contexts and event types are already stored in separate columns, so nothing needs to be extracted from
+    the json.
+    """
+
+    @property
+    def sql(self):
+        return _SQL_EXTRACTED_COLUMNS
+
+
 _SQL = \
     '''
     SELECT event_id,
@@ -24,3 +36,17 @@ _SQL = \
      FROM {table_name}
      {date_range}
      '''
+
+_SQL_EXTRACTED_COLUMNS = \
+    '''
+    SELECT event_id,
+            day,
+            moment,
+            cookie_id AS user_id,
+            global_contexts,
+            location_stack,
+            event_type,
+            stack_event_types
+     FROM {table_name}
+     {date_range}
+     '''
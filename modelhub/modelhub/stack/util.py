@@ -2,7 +2,7 @@
 Copyright 2021 Objectiv B.V.
 """
 from modelhub.stack.basic_features import BasicFeatures
-from modelhub.stack.extracted_contexts import ExtractedContexts
+from modelhub.stack.extracted_contexts import ExtractedContexts, ExtractedColumns
 from modelhub.stack.sessionized_data import SessionizedData
 
 from sql_models.model import SqlModel
@@ -23,14 +23,26 @@ def _get_date_range(start_date, end_date):
     return date_range
 
 
+def _get_extracted_contexts(date_range, table_name, data_layout):
+    if data_layout == 'extracted':
+        return ExtractedColumns(date_range=date_range, table_name=table_name)
+    if data_layout == 'json':
+        return ExtractedContexts(date_range=date_range, table_name=table_name)
+    raise ValueError(f"Unknown data layout: {data_layout}. Must be 'json' or 'extracted'")
+
+
 def basic_feature_model(session_gap_seconds=1800,
                         start_date=None,
                         end_date=None,
-                        table_name='data') -> SqlModel:
-    """ Give a linked BasicFeatures model"""
+                        table_name='data',
+                        data_layout='json') -> SqlModel:
+    """
+    Give a linked BasicFeatures model
+    data_layout is the layout of the data table, either 'json' or 'extracted'.
+    """
     date_range = _get_date_range(start_date, end_date)
 
-    extracted_contexts = ExtractedContexts(date_range=date_range, table_name=table_name)
+    extracted_contexts = _get_extracted_contexts(date_range, table_name, data_layout)
     return BasicFeatures.build(
         sessionized_data=SessionizedData(
             session_gap_seconds=session_gap_seconds,
@@ -42,11 +54,15 @@ def basic_feature_model(session_gap_seconds=1800,
 def sessionized_data_model(session_gap_seconds=1800,
                            start_date=None,
                            end_date=None,
-                           table_name='data') -> SqlModel:
-    """ Give a linked SessionizedData model"""
+                           table_name='data',
+                           data_layout='json') -> SqlModel:
+    """
+    Give a linked SessionizedData model
+    data_layout is the layout of the data table, either 'json' or 'extracted'.
+    """
     date_range = _get_date_range(start_date, end_date)
 
-    extracted_contexts = ExtractedContexts(date_range=date_range, table_name=table_name)
+    extracted_contexts = _get_extracted_contexts(date_range, table_name, data_layout)
     return SessionizedData.build(
             session_gap_seconds=session_gap_seconds,
             extracted_contexts=extracted_contexts
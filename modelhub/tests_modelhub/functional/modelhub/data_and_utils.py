@@ -50,6 +50,23 @@ TEST_DATA_OBJECTIV = '''
 '''
 
 
+# Changes objectiv_data to the 'extracted' data layout, see backend/objectiv_backend/data_layout_extracted.sql
+SQL_EXTRACTED_LAYOUT = '''
+    alter table objectiv_data
+        alter column value type jsonb,
+        add column event_type text,
+        add column stack_event_types jsonb,
+        add column global_contexts jsonb,
+        add column location_stack jsonb;
+
+    update objectiv_data
+    set event_type = value->>'_type',
+        stack_event_types = value->'_types',
+        global_contexts = value->'global_contexts',
+        location_stack = value->'location_stack';
+'''
+
+
 def get_bt_with_json_data_real() -> DataFrame:
     bt = get_bt(TEST_DATA_JSON_REAL, JSON_COLUMNS_REAL, True)
     bt['global_contexts'] = bt.global_contexts.astype('jsonb')
@@ -57,7 +74,7 @@ def get_bt_with_json_data_real() -> DataFrame:
     return bt
 
 
-def get_objectiv_dataframe_test(time_aggregation=None):
+def get_objectiv_dataframe_test(time_aggregation=None, data_layout='json'):
     sql = """
     drop table if exists objectiv_data;
 
@@ -76,6 +93,8 @@ def get_objectiv_dataframe_test(time_aggregation=None):
 
     run_query(sqlalchemy.create_engine(DB_TEST_URL), sql)
     run_query(sqlalchemy.create_engine(DB_TEST_URL), TEST_DATA_OBJECTIV)
+    if data_layout == 'extracted':
+        run_query(sqlalchemy.create_engine(DB_TEST_URL), SQL_EXTRACTED_LAYOUT)
 
     kwargs = {}
     if time_aggregation:
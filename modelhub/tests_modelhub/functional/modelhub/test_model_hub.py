@@ -5,7 +5,7 @@ Copyright 2021 Objectiv B.V.
 # Any import from from modelhub initializes all the types, do not remove
 from modelhub import __version__
 from tests_modelhub.functional.modelhub.data_and_utils import get_objectiv_dataframe_test
-from tests.functional.bach.test_data_and_utils import assert_equals_data
+from tests.functional.bach.test_data_and_utils import assert_equals_data, run_query
 from uuid import UUID
 
 
@@ -13,6 +13,31 @@ def test_get_objectiv_stack():
     get_objectiv_dataframe_test()
 
 
+def test_get_objectiv_stack_extracted_layout():
+    df_json, _ = get_objectiv_dataframe_test()
+    json_rows = run_query(df_json.engine, df_json.sort_index().view_sql()).fetchall()
+
+    df_extracted, _ = get_objectiv_dataframe_test(data_layout='extracted')
+    assert 'JSON_EXTRACT_PATH' not in df_extracted.view_sql()
+    assert df_extracted.dtypes == {
+        'day': 'date',
+        'moment': 'timestamp',
+        'user_id': 'uuid',
+        'global_contexts': 'objectiv_global_context',
+        'location_stack': 'objectiv_location_stack',
+        'event_type': 'string',
+        'stack_event_types': 'jsonb',
+        'session_id': 'int64',
+        'session_hit_number': 'int64'
+    }
+    assert_equals_data(
+        df_extracted,
+        expected_columns=['event_id'] + list(df_json.dtypes.keys()),
+        expected_data=[list(row) for row in json_rows],
+        order_by='event_id'
+    )
+
+
 # map
 def test_is_first_session():
     df, modelhub = get_objectiv_dataframe_test(time_aggregation='YYYY-MM-DD')